@@ -21,6 +21,7 @@ python -m PyInstaller --onefile --windowed --clean ^
     --add-data "config.json;." ^
     --hidden-import flask ^
     --hidden-import requests ^
+    --hidden-import waitress ^
     server.py
 
 echo [4/4] Finalizing build...
@@ -0,0 +1,568 @@
+"""
+Fake Cloud
+==========
+Local stand-in for the kiosk's cloud, for load tests and offline sync
+benchmarks (loadtest.py, sync_bench.py). Standard library only.
+
+Supabase REST (/rest/v1/<table>) — the PostgREST subset the kiosk uses:
+  - filters: eq, neq, gt, gte, lt, lte, in.(...), is.null/true/false,
+    like/ilike, `not.` prefix, and or=(...)/and=(...) with nesting;
+    repeated params are ANDed
+  - select=a,b  order=a.desc,b  limit  offset
+  - bulk inserts (all objects must have the same keys, as in PostgREST),
+    PATCH and DELETE by filter
+  - Prefer: return=representation|minimal, count=exact,
+    resolution=merge-duplicates|ignore-duplicates with on_conflict=
+  - gzip request bodies and gzip responses
+  - id/created_at defaults; every write sets updated_at (strictly increasing),
+    tables with a `version` column get version=1 on insert and +1 per update,
+    like the hr_attendance trigger in the real project
+
+Vercel API: GET /api/hr/employees, PUT /api/hr/employees/<id>,
+GET /api/settings/kiosk-pin, GET /api/employee/profile.
+
+Fault injection (all endpoints above, not /_fake): fixed latency plus jitter,
+random 500s, requests dropped before they are applied, responses lost after
+the write was applied, random 429s and a token-bucket rate limit answering
+429 + Retry-After.
+
+Control endpoints: GET /_fake/state (tables, request and fault counters),
+POST /_fake/faults (change fault settings), POST /_fake/reset.
+
+    python fake_cloud.py --port 8790 --employees 50 --latency-ms 80 --failure-rate 0.05 --throttle-rps 20
+
+Then point the kiosk's config.json at it:
+    "supabase_url": "http://127.0.0.1:8790", "cloud_base_url": "http://127.0.0.1:8790"
+"""
+
+import argparse, copy, gzip, json, random, re, sys, threading, time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+KIOSK_PIN = '9999'
+
+# Columns every row of a table gets even if the client doesn't send them
+TABLE_DEFAULTS = {
+    'hr_attendance': {'version': 1, 'notes': None, 'check_out_time': None, 'source': None,
+                      'synced_from_local': False},
+    'inventory_counts': {'notes': None, 'sync_key': None},
+    'inventory_count_items': {},
+    'products': {},
+}
+
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+FAULT_KEYS = ('latency_ms', 'jitter_ms', 'failure_rate', 'drop_rate', 'lost_response_rate',
+              'throttle_rate', 'throttle_rps', 'retry_after')
+
+
+class PostgrestError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status, self.code, self.message = status, code, message
+
+
+# ── Filter parsing ──────────────────────────
+def _split_top(text):
+    """Split a PostgREST logic list on commas outside parentheses and quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0 and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def _unquote(value):
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def parse_condition(field, expr):
+    """`field`, `op.value` -> predicate(row). Raises PostgrestError on bad syntax."""
+    negate = expr.startswith('not.')
+    if negate:
+        expr = expr[4:]
+    op, sep, arg = expr.partition('.')
+    if not sep:
+        raise PostgrestError(400, 'PGRST100', f'failed to parse filter ({field}={expr})')
+    if op in ('and', 'or'):
+        raise PostgrestError(400, 'PGRST100', f'unexpected logic operator in filter ({field})')
+    if op == 'in':
+        if not (arg.startswith('(') and arg.endswith(')')):
+            raise PostgrestError(400, 'PGRST100', f'failed to parse filter ({field}=in.{arg})')
+        values = [_unquote(v.strip()) for v in _split_top(arg[1:-1])]
+        pred = lambda row: row.get(field) is not None and any(_cmp(row.get(field), v) == 0 for v in values)
+    elif op == 'is':
+        target = {'null': None, 'true': True, 'false': False}.get(arg.lower(), 'invalid')
+        if target == 'invalid':
+            raise PostgrestError(400, 'PGRST100', f'failed to parse filter ({field}=is.{arg})')
+        pred = lambda row: row.get(field) is target
+    elif op in ('like', 'ilike'):
+        pattern = re.compile('^' + re.escape(_unquote(arg)).replace(r'\*', '.*').replace('%', '.*') + '$',
+                             re.IGNORECASE if op == 'ilike' else 0)
+        pred = lambda row: row.get(field) is not None and bool(pattern.match(str(row.get(field))))
+    elif op in ('eq', 'neq', 'gt', 'gte', 'lt', 'lte'):
+        value = _unquote(arg)
+        check = {
+            'eq': lambda c: c == 0, 'neq': lambda c: c != 0, 'gt': lambda c: c > 0,
+            'gte': lambda c: c >= 0, 'lt': lambda c: c < 0, 'lte': lambda c: c <= 0,
+        }[op]
+        pred = lambda row: row.get(field) is not None and check(_cmp(row.get(field), value))
+    else:
+        raise PostgrestError(400, 'PGRST100', f'unknown operator "{op}" ({field})')
+    return (lambda row: not pred(row)) if negate else pred
+
+
+def parse_logic(op, body):
+    """or=(a.eq.1,and(b.gt.2,c.is.null)) -> predicate(row)."""
+    if not (body.startswith('(') and body.endswith(')')):
+        raise PostgrestError(400, 'PGRST100', f'failed to parse logic tree ({op}={body})')
+    preds = []
+    for item in _split_top(body[1:-1]):
+        item = item.strip()
+        negate = item.startswith('not.')
+        inner = item[4:] if negate else item
+        m = re.match(r'^(and|or)(\(.*\))$', inner)
+        if m:
+            pred = parse_logic(m.group(1), m.group(2))
+            preds.append((lambda p: lambda row: not p(row))(pred) if negate else pred)
+        else:
+            field, sep, expr = item.partition('.')
+            if not sep:
+                raise PostgrestError(400, 'PGRST100', f'failed to parse logic tree ({item})')
+            preds.append(parse_condition(field, expr))
+    combine = all if op == 'and' else any
+    return lambda row: combine(p(row) for p in preds)
+
+
+def _cmp(current, value):
+    """Compare a stored value with a filter literal the way Postgres would after casting."""
+    if isinstance(current, bool):
+        other = value.lower() in ('true', 't', '1')
+        return (current > other) - (current < other)
+    if isinstance(current, (int, float)):
+        try:
+            other = float(value)
+        except ValueError:
+            raise PostgrestError(400, '22P02', f'invalid input syntax for type numeric: "{value}"')
+        return (current > other) - (current < other)
+    current = str(current)
+    return (current > value) - (current < value)
+
+
+def build_filter(params):
+    preds = []
+    for key, value in params:
+        if key in RESERVED_PARAMS:
+            continue
+        if key in ('or', 'and', 'not.or', 'not.and'):
+            pred = parse_logic(key.split('.')[-1], value)
+            preds.append((lambda p: lambda row: not p(row))(pred) if key.startswith('not.') else pred)
+        else:
+            preds.append(parse_condition(key, value))
+    return lambda row: all(p(row) for p in preds)
+
+
+def parse_order(spec):
+    keys = []
+    for part in filter(None, (p.strip() for p in (spec or '').split(','))):
+        bits = part.split('.')
+        desc = 'desc' in bits[1:]
+        nulls_first = 'nullsfirst' in bits[1:] or ('nullslast' not in bits[1:] and desc)
+        keys.append((bits[0], desc, nulls_first))
+    return keys
+
+
+def sort_rows(rows, order):
+    # Stable sorts from the last key to the first
+    for field, desc, nulls_first in reversed(order):
+        present = [r for r in rows if r.get(field) is not None]
+        nulls = [r for r in rows if r.get(field) is None]
+        present.sort(key=lambda r: r[field], reverse=desc)
+        rows = nulls + present if nulls_first else present + nulls
+    return rows
+
+
+def parse_prefer(header):
+    prefs = {}
+    for part in (header or '').split(','):
+        key, _, value = part.strip().partition('=')
+        if key:
+            prefs[key] = value
+    return prefs
+
+
+class FakeCloud:
+    """In-memory PostgREST tables and Vercel endpoints behind a threaded HTTP server."""
+
+    def __init__(self, employees=50, products=200, latency_ms=0, seed=0, **faults):
+        self.lock = threading.RLock()
+        self.rng = random.Random(seed)
+        self.faults = {'latency_ms': latency_ms, 'jitter_ms': 0, 'failure_rate': 0, 'drop_rate': 0,
+                       'lost_response_rate': 0, 'throttle_rate': 0, 'throttle_rps': 0, 'retry_after': 1}
+        self.set_faults(**faults)
+        self._seed = (employees, products)
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        employees, products = self._seed
+        with self.lock:
+            self.ids = {}
+            self._last_ts = datetime.now(timezone.utc)
+            self.tables = {name: {} for name in TABLE_DEFAULTS}
+            self.employees = {
+                i: {
+                    'id': i, 'name': f'موظف {i}', 'job_title': 'باريستا', 'phone': f'010{i:08d}',
+                    'pin_code': f'{1000 + i}', 'work_start_time': '09:00', 'work_end_time': '17:00',
+                    'late_threshold_minutes': 15, 'off_days': [], 'is_active': True, 'device_id': None,
+                }
+                for i in range(1, employees + 1)
+            }
+            self.insert('products', [
+                {'name': f'منتج {i}', 'category': f'قسم {i % 8}', 'barcode': f'622{i:07d}',
+                 'price': 10 + i % 90, 'unit': 'قطعة'}
+                for i in range(1, products + 1)
+            ])
+            self.requests = {}
+            self.injected = {}
+            self._bucket = (float(self.faults['throttle_rps'] or 0), time.monotonic())
+
+    def set_faults(self, **faults):
+        unknown = set(faults) - set(FAULT_KEYS)
+        if unknown:
+            raise ValueError(f"unknown fault settings: {', '.join(sorted(unknown))}")
+        with self.lock:
+            self.faults.update({k: float(v) for k, v in faults.items()})
+            self._bucket = (self.faults['throttle_rps'], time.monotonic())
+
+    def _bump(self, counter, key):
+        with self.lock:
+            counter[key] = counter.get(key, 0) + 1
+
+    def _now(self):
+        """Strictly increasing UTC timestamp, like now() across separate transactions."""
+        now = datetime.now(timezone.utc)
+        if now <= self._last_ts:
+            now = self._last_ts + timedelta(microseconds=1)
+        self._last_ts = now
+        return now.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+    # ── Table operations (also usable directly from benchmarks) ──
+    def rows(self, table):
+        with self.lock:
+            return [copy.deepcopy(r) for r in self.tables.get(table, {}).values()]
+
+    def insert(self, table, objects, on_conflict=None, resolution=None):
+        if table not in self.tables:
+            raise PostgrestError(404, '42P01', f'relation "public.{table}" does not exist')
+        if not objects:
+            return []
+        keys = set(objects[0])
+        if any(set(o) != keys for o in objects):
+            raise PostgrestError(400, 'PGRST102', 'All object keys must match')
+        with self.lock:
+            store = self.tables[table]
+            conflict_cols = [c.strip() for c in on_conflict.split(',')] if on_conflict else ['id']
+            index = {tuple(r.get(c) for c in conflict_cols): r for r in store.values()}
+            out, fresh = [], []
+            for obj in objects:
+                match = index.get(tuple(obj.get(c) for c in conflict_cols)) if (
+                    on_conflict or 'id' in obj) else None
+                if match is not None:
+                    if resolution == 'merge-duplicates':
+                        match.update(obj)
+                        self._touch(table, match)
+                        out.append(match)
+                    elif resolution == 'ignore-duplicates':
+                        continue
+                    else:
+                        raise PostgrestError(409, '23505', f'duplicate key value violates unique constraint '
+                                                           f'"{table}_{"_".join(conflict_cols)}_key"')
+                    continue
+                now = self._now()
+                row = {**TABLE_DEFAULTS[table], 'created_at': now, **obj, 'updated_at': now}
+                if 'id' not in obj:
+                    self.ids[table] = self.ids.get(table, 0) + 1
+                    row['id'] = self.ids[table]
+                else:
+                    self.ids[table] = max(self.ids.get(table, 0), int(row['id']))
+                fresh.append(row)
+                index[tuple(row.get(c) for c in conflict_cols)] = row
+                out.append(row)
+            for row in fresh:
+                store[row['id']] = row
+            return [copy.deepcopy(r) for r in out]
+
+    def _touch(self, table, row):
+        row['updated_at'] = self._now()
+        if 'version' in TABLE_DEFAULTS[table]:
+            row['version'] = (row.get('version') or 0) + 1
+
+    def update(self, table, params, changes):
+        if table not in self.tables:
+            raise PostgrestError(404, '42P01', f'relation "public.{table}" does not exist')
+        match = build_filter(params)
+        with self.lock:
+            changed = []
+            for row in self.tables[table].values():
+                if match(row):
+                    row.update({k: v for k, v in changes.items() if k not in ('id', 'updated_at')})
+                    self._touch(table, row)
+                    changed.append(copy.deepcopy(row))
+            return changed
+
+    def delete(self, table, params):
+        if table not in self.tables:
+            raise PostgrestError(404, '42P01', f'relation "public.{table}" does not exist')
+        match = build_filter(params)
+        with self.lock:
+            gone = [r for r in self.tables[table].values() if match(r)]
+            for row in gone:
+                del self.tables[table][row['id']]
+            return copy.deepcopy(gone)
+
+    def select(self, table, params):
+        if table not in self.tables:
+            raise PostgrestError(404, '42P01', f'relation "public.{table}" does not exist')
+        single = dict(params)
+        match = build_filter(params)
+        with self.lock:
+            found = [copy.deepcopy(r) for r in self.tables[table].values() if match(r)]
+        found = sort_rows(found, parse_order(single.get('order')))
+        total = len(found)
+        offset = int(single.get('offset', 0))
+        found = found[offset:offset + int(single['limit'])] if 'limit' in single else found[offset:]
+        return found, total, offset
+
+    def hr_edit(self, attendance_id, **changes):
+        """Simulate an HR correction in the dashboard (bumps version/updated_at)."""
+        return self.update('hr_attendance', [('id', f'eq.{attendance_id}')], changes)
+
+    # ── Request handling ───────────────────
+    def rest(self, method, table, params, body, prefer):
+        single = dict(params)
+        select = single.get('select', '*').replace(' ', '')
+        status, out, headers = 200, [], {}
+        if method in ('GET', 'HEAD'):
+            out, total, offset = self.select(table, params)
+            if 'count' in prefer:
+                end = offset + len(out) - 1
+                headers['Content-Range'] = f"{offset}-{end}/{total}" if out else f"*/{total}"
+        elif method == 'POST':
+            objects = body if isinstance(body, list) else [body or {}]
+            out = self.insert(table, objects, single.get('on_conflict'), prefer.get('resolution'))
+            status = 201
+        elif method == 'PATCH':
+            if not isinstance(body, dict):
+                raise PostgrestError(400, 'PGRST102', 'Empty or invalid json')
+            out = self.update(table, params, body)
+        elif method == 'DELETE':
+            out = self.delete(table, params)
+        else:
+            raise PostgrestError(405, 'PGRST117', f'Unsupported HTTP method: {method}')
+
+        if method != 'GET' and prefer.get('return') != 'representation':
+            return (201 if method == 'POST' else 204), None, headers
+        if select != '*':
+            cols = select.split(',')
+            out = [{c: r.get(c) for c in cols} for r in out]
+        return status, out, headers
+
+    def api(self, method, path, params, body):
+        if path == '/api/hr/employees' and method == 'GET':
+            with self.lock:
+                return 200, [dict(e) for e in self.employees.values()]
+        if path.startswith('/api/hr/employees/') and method == 'PUT':
+            try:
+                emp_id = int(path.rsplit('/', 1)[1])
+            except ValueError:
+                return 400, {'error': 'invalid id'}
+            with self.lock:
+                if emp_id not in self.employees:
+                    return 404, {'error': 'Employee not found'}
+                self.employees[emp_id].update(body or {})
+                return 200, dict(self.employees[emp_id])
+        if path == '/api/settings/kiosk-pin' and method == 'GET':
+            return 200, {'pin': KIOSK_PIN}
+        if path == '/api/employee/profile' and method == 'GET':
+            with self.lock:
+                known = any(e['pin_code'] == dict(params).get('pin') for e in self.employees.values())
+            return (200, {'payments': [], 'purchases': []}) if known else (404, {'error': 'Employee not found'})
+        return 404, {'error': 'Not found'}
+
+    def inject(self):
+        """Decide this request's fault: None, '500', 'drop', 'lost', or ('429', retry_after)."""
+        f = self.faults
+        delay = f['latency_ms'] + (self.rng.uniform(0, f['jitter_ms']) if f['jitter_ms'] else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        with self.lock:
+            if f['throttle_rps']:
+                tokens, last = self._bucket
+                now = time.monotonic()
+                tokens = min(f['throttle_rps'], tokens + (now - last) * f['throttle_rps'])
+                if tokens < 1:
+                    self._bucket = (tokens, now)
+                    return '429'
+                self._bucket = (tokens - 1, now)
+            roll = self.rng.random()
+        for fault, rate in (('429', f['throttle_rate']), ('500', f['failure_rate']),
+                            ('drop', f['drop_rate']), ('lost', f['lost_response_rate'])):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def handler(self):
+        cloud = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                data = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                if payload is not None:
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                if len(data) >= 1024 and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                    data = gzip.compress(data, compresslevel=5)
+                    self.send_header('Content-Encoding', 'gzip')
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            def _drop(self):
+                self.close_connection = True
+                self.connection.close()
+
+            def _control(self, url, body):
+                if url.path == '/_fake/state' and self.command == 'GET':
+                    with cloud.lock:
+                        state = {
+                            'faults': dict(cloud.faults),
+                            'requests': dict(cloud.requests),
+                            'injected': dict(cloud.injected),
+                            'tables': {t: list(rows.values()) for t, rows in cloud.tables.items()},
+                            'employees': list(cloud.employees.values()),
+                        }
+                        return self._send(200, state)
+                if url.path == '/_fake/faults' and self.command == 'POST':
+                    try:
+                        cloud.set_faults(**(body or {}))
+                    except (TypeError, ValueError) as e:
+                        return self._send(400, {'error': str(e)})
+                    return self._send(200, cloud.faults)
+                if url.path == '/_fake/reset' and self.command == 'POST':
+                    cloud.reset()
+                    return self._send(200, {'success': True})
+                return self._send(404, {'error': 'Not found'})
+
+            def _handle(self):
+                url = urlparse(self.path)
+                params = parse_qsl(url.query, keep_blank_values=True)
+                try:
+                    raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                    if self.headers.get('Content-Encoding') == 'gzip':
+                        raw = gzip.decompress(raw)
+                    body = json.loads(raw) if raw else None
+                except (OSError, ValueError):
+                    return self._send(400, {'code': 'PGRST102', 'message': 'Empty or invalid json'})
+
+                if url.path.startswith('/_fake/'):
+                    return self._control(url, body)
+
+                is_rest = url.path.startswith('/rest/v1/')
+                target = url.path[len('/rest/v1/'):] if is_rest else re.sub(r'/\d+$', '/:id', url.path)
+                cloud._bump(cloud.requests, f'{self.command} {target}')
+
+                fault = cloud.inject()
+                if fault:
+                    cloud._bump(cloud.injected, fault)
+                if fault == '429':
+                    return self._send(429, {'code': '429', 'message': 'Too Many Requests'},
+                                      {'Retry-After': str(int(cloud.faults['retry_after']))})
+                if fault == '500':
+                    return self._send(500, {'code': '500', 'message': 'Injected failure'})
+                if fault == 'drop':
+                    return self._drop()
+
+                try:
+                    if is_rest:
+                        status, payload, headers = cloud.rest(self.command, target, params, body,
+                                                              parse_prefer(self.headers.get('Prefer')))
+                    else:
+                        (status, payload), headers = cloud.api(self.command, url.path, params, body), {}
+                except PostgrestError as e:
+                    status, payload, headers = e.status, {'code': e.code, 'message': e.message,
+                                                          'details': None, 'hint': None}, {}
+                if fault == 'lost':
+                    return self._drop()
+                self._send(status, payload, headers)
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = do_HEAD = _handle
+
+        return Handler
+
+    def start(self, port=0):
+        """Serve on 127.0.0.1 in a background thread; returns the base URL."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=0, help='added latency per cloud request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='extra random latency, 0..N ms')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share of requests answered 500')
+    parser.add_argument('--drop-rate', type=float, default=0, help='share of connections closed before applying')
+    parser.add_argument('--lost-response-rate', type=float, default=0,
+                        help='share of requests applied but whose response is lost')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='share of requests answered 429')
+    parser.add_argument('--throttle-rps', type=float, default=0, help='token-bucket limit, 429 above it')
+
+
+def faults_from_args(args):
+    return {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'failure_rate': args.failure_rate,
+            'drop_rate': args.drop_rate, 'lost_response_rate': args.lost_response_rate,
+            'throttle_rate': args.throttle_rate, 'throttle_rps': args.throttle_rps}
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description='Local stand-in for Supabase REST + the Vercel API')
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--employees', type=int, default=50)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    cloud = FakeCloud(employees=args.employees, products=args.products, seed=args.seed, **faults_from_args(args))
+    print(f"Fake cloud on {cloud.start(args.port)} ({args.employees} employees, kiosk PIN {KIOSK_PIN})")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        cloud.stop()
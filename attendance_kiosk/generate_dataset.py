@@ -0,0 +1,292 @@
+"""
+Synthetic Dataset Generator
+===========================
+Fills a kiosk database with realistic, deterministic data for benchmarks and
+for reproducing slow pages on a dev machine:
+
+  - employees with morning/evening/night schedules (night shifts check out
+    after midnight), 1-2 off days, late thresholds, phones and PINs; some
+    join late in the period and a few leave before it ends
+  - attendance per working day: personal absence and lateness tendencies,
+    split shifts (several sessions a day), the odd forgotten check-out and
+    off-day overtime; statuses come from server.calculate_status like real
+    punches
+  - inventory counts per shift with hundreds of items each
+  - sync_log history every --sync-every minutes, with failures
+  - recent --unsynced-days left unsynced, older rows linked to cloud ids
+
+The seed is stored as the `dataset_seed` setting. The ids are made up and
+collide with real cloud ids, so server.py never syncs a database that has
+one (it reports offline), whatever config.json points at.
+
+Same seed, same database. Rows are streamed through executemany in one
+transaction with the change-feed and rollup insert triggers dropped while
+loading (the feed sequence is set directly, the triggers re-created by
+init_db and the analytics rollup built in one pass), so millions of rows
+take seconds:
+
+    python generate_dataset.py --out bench.db --employees 60 --days 365
+    python generate_dataset.py --out big.db --employees 400 --days 1095 --seed 7 --force
+"""
+
+import argparse, json, os, random, sqlite3, sys, time
+from datetime import date, datetime, timedelta
+
+FIRST_NAMES = ['محمد', 'أحمد', 'محمود', 'مصطفى', 'علي', 'عمر', 'يوسف', 'خالد', 'إبراهيم', 'حسن',
+               'كريم', 'طارق', 'سارة', 'مريم', 'نور', 'فاطمة', 'آية', 'منة', 'هدى', 'ياسمين',
+               'عبد الرحمن', 'عبد الله', 'إسلام', 'زياد', 'صلاح', 'هشام', 'رنا', 'دينا', 'شيماء', 'سلمى']
+LAST_NAMES = ['عبد الله', 'حسن', 'السيد', 'إبراهيم', 'محمود', 'علي', 'مصطفى', 'فتحي', 'عادل', 'سعيد',
+              'جمال', 'رمضان', 'شعبان', 'منصور', 'الشافعي', 'عثمان', 'يوسف', 'كمال', 'نبيل', 'فؤاد']
+JOB_TITLES = ['باريستا'] * 5 + ['كاشير'] * 3 + ['شيف'] * 2 + ['عامل نظافة', 'مشرف وردية', 'مدير فرع']
+# (start, end) — ends before the start cross midnight
+SCHEDULES = [('07:00', '15:00'), ('09:00', '17:00'), ('09:00', '17:00'), ('12:00', '20:00'),
+             ('15:00', '23:00'), ('17:00', '01:00'), ('18:00', '02:00')]
+CATEGORIES = {
+    'مشروبات ساخنة': ['قهوة تركي', 'إسبريسو', 'كابتشينو', 'لاتيه', 'شاي', 'هوت شوكليت', 'نسكافيه'],
+    'مشروبات باردة': ['آيس لاتيه', 'فرابيه', 'موهيتو', 'عصير برتقال', 'ليمون نعناع', 'سموذي'],
+    'حلويات': ['تشيز كيك', 'براونيز', 'كوكيز', 'وافل', 'كريب', 'دونتس'],
+    'فطار': ['كرواسون', 'ساندويتش جبنة', 'بيض', 'فول', 'فلافل', 'توست'],
+    'خامات': ['لبن', 'سكر', 'بن', 'كاكاو', 'صوص كراميل', 'صوص شوكولاتة', 'كريمة'],
+    'تغليف': ['أكواب ورق', 'أغطية', 'شفاطات', 'أكياس', 'مناديل', 'علب'],
+}
+BRANCHES = ['Suzz 1', 'Suzz 2']
+
+
+def _minutes(hhmm):
+    h, m = map(int, hhmm.split(':'))
+    return h * 60 + m
+
+
+def _hhmm(minutes):
+    minutes %= 24 * 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def make_employees(rng, count, days):
+    employees = []
+    for emp_id in range(1, count + 1):
+        start, end = rng.choice(SCHEDULES)
+        off_days = sorted(rng.sample(range(7), rng.choice([1, 1, 2])))
+        # Most staff were there all period; some joined later, a few left
+        joined = 0 if rng.random() < 0.7 else rng.randint(0, days * 3 // 4)
+        left = days if rng.random() < 0.9 else rng.randint(joined + 1, days)
+        employees.append({
+            'id': emp_id,
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'job_title': rng.choice(JOB_TITLES),
+            'work_start_time': start,
+            'work_end_time': end,
+            'late_threshold_minutes': rng.choice([10, 15, 15, 20]),
+            'off_days': off_days,
+            'is_active': 1 if left == days else 0,
+            'pin_code': f"{rng.randint(0, 9999):04d}",
+            'phone': f"01{rng.choice('0125')}{rng.randint(0, 99999999):08d}",
+            'can_view_inventory': 1 if rng.random() < 0.6 else 0,
+            # Behaviour, not stored
+            'joined': joined, 'left': left,
+            'absence_rate': rng.uniform(0.01, 0.08),
+            'late_rate': rng.uniform(0.02, 0.25),
+            'split_rate': rng.uniform(0.0, 0.2),
+        })
+    return employees
+
+
+def make_products(rng, count):
+    products = []
+    names = [(cat, item) for cat, items in CATEGORIES.items() for item in items]
+    for pid in range(1, count + 1):
+        cat, item = names[(pid - 1) % len(names)]
+        size = (pid - 1) // len(names)
+        products.append((pid, f"{item} {size + 1}" if size else item, cat, f"622{pid:07d}",
+                         f"SKU-{pid:05d}", round(rng.uniform(5, 150), 2), 1 if rng.random() < 0.95 else 0,
+                         rng.choice(['قطعة', 'كوب', 'كيلو', 'لتر', 'علبة'])))
+    return products
+
+
+def attendance_rows(rng, employees, first_day, days, unsynced_from, calculate_status):
+    """Yield attendance tuples in date order, like a kiosk filling up over time."""
+    row_id = 0
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        day_iso = day.isoformat()
+        js_weekday = (day.weekday() + 1) % 7
+        synced = 0 if day >= unsynced_from else 1
+        for emp in employees:
+            if not emp['joined'] <= offset < emp['left']:
+                continue
+            off_day = js_weekday in emp['off_days']
+            if off_day and rng.random() > 0.04:
+                continue  # off-day overtime is rare
+            if not off_day and rng.random() < emp['absence_rate']:
+                continue
+            start = _minutes(emp['work_start_time'])
+            shift_len = (_minutes(emp['work_end_time']) - start) % (24 * 60) or 8 * 60
+            check_in = start + int(rng.gauss(-5, 7))
+            if rng.random() < emp['late_rate']:
+                check_in += rng.randint(emp['late_threshold_minutes'] + 1, 75)
+            check_out = start + shift_len + int(rng.gauss(5, 15))
+            # Split shift: a break in the middle makes two (rarely three) sessions
+            sessions = [(check_in, check_out)]
+            if rng.random() < emp['split_rate']:
+                mid = check_in + (check_out - check_in) // 2
+                sessions = [(check_in, mid - 15), (mid + rng.randint(15, 60), check_out)]
+                if rng.random() < 0.15:
+                    s, e = sessions[1]
+                    sessions[1:] = [(s, s + (e - s) // 2), (s + (e - s) // 2 + 20, e)]
+            for n, (ci, co) in enumerate(sessions):
+                ci_str = _hhmm(ci)
+                if ci >= 24 * 60:
+                    break  # a session starting after midnight belongs to the next day's roster
+                forgot = n == len(sessions) - 1 and rng.random() < 0.015
+                co_str = None if forgot else _hhmm(co)
+                status = 'present' if off_day else calculate_status(ci_str, emp['work_start_time'],
+                                                                    emp['late_threshold_minutes'])
+                row_id += 1
+                out_day = day + timedelta(days=1) if co >= 24 * 60 else day
+                updated_at = f"{(out_day if co_str else day).isoformat()}T{co_str or ci_str}:00"
+                notes = 'عمل في يوم إجازة' if off_day else ('نسي تسجيل الانصراف' if forgot and synced else '')
+                yield (row_id, emp['id'], day_iso, ci_str, co_str, status, notes, synced,
+                       row_id if synced else None, 1 if synced else None, updated_at, row_id)
+
+
+def count_rows(rng, employees, products, first_day, days, unsynced_from, items_min, items_max):
+    """Yield offline_counts tuples: one count per branch and shift per day."""
+    counters = [e for e in employees if e['can_view_inventory']] or employees
+    active_products = [p[1] for p in products if p[6]]
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for branch in BRANCHES:
+            for shift, hour in (('morning', 8), ('evening', 22)):
+                staff = [e for e in counters if e['joined'] <= offset < e['left']]
+                if not staff or rng.random() < 0.05:
+                    continue  # skipped count
+                size = min(len(active_products), rng.randint(items_min, items_max))
+                items = [{'item_name': name, 'quantity': rng.randint(0, 60)}
+                         for name in rng.sample(active_products, size)]
+                created = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour,
+                                                                                 minutes=rng.randint(0, 50))
+                yield (rng.choice(staff)['id'], day.isoformat(), shift, branch,
+                       json.dumps(items, ensure_ascii=False), 0 if day >= unsynced_from else 1,
+                       created.isoformat())
+
+
+def sync_log_rows(rng, first_day, days, unsynced_from, every_minutes):
+    start = datetime.combine(first_day, datetime.min.time())
+    stop = datetime.combine(unsynced_from, datetime.min.time())
+    ts = start
+    while ts < stop:
+        ok = rng.random() > 0.03
+        records = rng.randint(1, 40) if ok else 0
+        message = f'مزامنة مباشرة Supabase: {records} سجل' if ok else 'لا يوجد اتصال بالإنترنت'
+        sent = records * rng.randint(180, 260) if ok else 0
+        yield (ts.isoformat(timespec='seconds'), records, 1 if ok else 0, message, sent,
+               rng.randint(300, 2000) if ok else 0)
+        ts += timedelta(minutes=every_minutes + rng.randint(-3, 3))
+
+
+def batched(rows, size=50000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(args):
+    if os.path.exists(args.out):
+        if not args.force:
+            sys.exit(f"{args.out} exists; pass --force to replace it")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.out + suffix):
+                os.remove(args.out + suffix)
+
+    import server
+    server.DB_PATH = os.path.abspath(args.out)
+    server.init_db()
+
+    rng = random.Random(args.seed)
+    end_day = date.fromisoformat(args.end) if args.end else date.today()
+    first_day = end_day - timedelta(days=args.days - 1)
+    unsynced_from = end_day - timedelta(days=args.unsynced_days - 1) if args.unsynced_days else end_day + timedelta(1)
+    employees = make_employees(rng, args.employees, args.days)
+    products = make_products(rng, args.products)
+
+    start = time.perf_counter()
+    db = sqlite3.connect(server.DB_PATH, isolation_level=None)
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("PRAGMA cache_size=-200000")
+    db.execute("BEGIN")
+    # The change feed numbers rows itself; set change_seq=id directly while loading.
+    # The analytics rollup is rebuilt from scratch afterwards.
+    db.execute("DROP TRIGGER IF EXISTS attendance_change_insert")
+    db.execute("DROP TRIGGER IF EXISTS attendance_daily_insert")
+    db.executemany(
+        """INSERT INTO employees (id, name, job_title, work_start_time, work_end_time, late_threshold_minutes,
+                                  off_days, is_active, pin_code, phone, can_view_inventory, last_synced_at)
+           VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+        [(e['id'], e['name'], e['job_title'], e['work_start_time'], e['work_end_time'],
+          e['late_threshold_minutes'], json.dumps(e['off_days']), e['is_active'], e['pin_code'], e['phone'],
+          e['can_view_inventory'], end_day.isoformat()) for e in employees])
+    db.executemany("INSERT INTO products (id, name, category, barcode, sku, price, active, unit) "
+                   "VALUES (?,?,?,?,?,?,?,?)", products)
+
+    totals = {'employees': len(employees), 'products': len(products),
+              'attendance': 0, 'offline_counts': 0, 'sync_log': 0}
+    for batch in batched(attendance_rows(rng, employees, first_day, args.days, unsynced_from,
+                                         server.calculate_status)):
+        db.executemany(
+            """INSERT INTO attendance (id, employee_id, attendance_date, check_in_time, check_out_time, status,
+                                       notes, synced, cloud_id, cloud_version, updated_at, change_seq)
+               VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""", batch)
+        totals['attendance'] += len(batch)
+    for batch in batched(count_rows(rng, employees, products, first_day, args.days, unsynced_from,
+                                    args.items_min, args.items_max), 5000):
+        db.executemany(
+            """INSERT INTO offline_counts (employee_id, count_date, shift, branch, items_json, synced, created_at)
+               VALUES (?,?,?,?,?,?,?)""", batch)
+        totals['offline_counts'] += len(batch)
+    for batch in batched(sync_log_rows(rng, first_day, args.days, unsynced_from, args.sync_every)):
+        db.executemany(
+            """INSERT INTO sync_log (synced_at, records_count, success, message, bytes_sent, bytes_received)
+               VALUES (?,?,?,?,?,?)""", batch)
+        totals['sync_log'] += len(batch)
+
+    db.execute("UPDATE change_counter SET seq=? WHERE name='attendance'", (totals['attendance'],))
+    for key, value in (('admin_pin', args.admin_pin), ('dataset_seed', str(args.seed))):
+        db.execute("INSERT INTO settings (key, value) VALUES (?, ?) "
+                   "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+    db.execute("COMMIT")
+    db.execute("ANALYZE")
+    db.close()
+    server.init_db()  # re-creates the triggers
+    db = server.get_db()
+    server.refresh_attendance_daily(db, rebuild=True)
+    db.close()
+
+    totals['seconds'] = round(time.perf_counter() - start, 2)
+    totals['size_mb'] = round(os.path.getsize(server.DB_PATH) / 1e6, 1)
+    totals['first_day'], totals['last_day'] = first_day.isoformat(), end_day.isoformat()
+    return totals
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description='Fill a kiosk database with deterministic synthetic data')
+    parser.add_argument('--out', default='attendance.db', help='database file to create')
+    parser.add_argument('--force', action='store_true', help='replace --out if it exists')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--employees', type=int, default=60)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--end', help='last day of data, YYYY-MM-DD (default: today)')
+    parser.add_argument('--products', type=int, default=400)
+    parser.add_argument('--items-min', type=int, default=150, help='items per inventory count, minimum')
+    parser.add_argument('--items-max', type=int, default=350, help='items per inventory count, maximum')
+    parser.add_argument('--sync-every', type=int, default=30, help='minutes between sync_log entries')
+    parser.add_argument('--unsynced-days', type=int, default=2, help='recent days left unsynced')
+    parser.add_argument('--admin-pin', default='1234')
+    args = parser.parse_args()
+
+    print(json.dumps(generate(args), ensure_ascii=False, indent=2))
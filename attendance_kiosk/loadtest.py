@@ -0,0 +1,243 @@
+"""
+Kiosk Load Test
+===============
+Boots server.py's app against a temporary database and a local fake cloud
+(fake_cloud.py), then simulates N phones on the shop WiFi:
+
+    GET /login -> POST /login_and_link, then in a loop:
+    POST /api/auto_login -> GET / -> POST /checkin -> (sometimes) GET /inventory
+    + POST /api/local/inventory, with random think times between steps.
+
+Prints a JSON report (throughput, p50/p95/p99 per step, error rates, the
+kiosk's own metrics summary and the fake cloud's request counts):
+
+    python loadtest.py --phones 40 --duration 60
+    python loadtest.py --phones 40 --duration 60 --http-server dev --out dev.json
+
+The kiosk runs in a child process (`loadtest.py --serve`) so the load
+generator doesn't share its GIL; the background sync and outbox threads run
+as they do in production, against the fake cloud.
+"""
+
+import argparse, json, os, random, shutil, socket, subprocess, sys, tempfile, threading, time, uuid
+from collections import defaultdict
+
+import requests
+
+from fake_cloud import FakeCloud, KIOSK_PIN
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+# ── Kiosk process ──────────────────────────
+def serve(port):
+    """Child-process entry: run the kiosk the way `python server.py` does,
+    minus the firewall rule, port cleanup and browser window."""
+    import server
+    # The fake cloud is on localhost; don't probe 8.8.8.8 before every sync
+    server.has_internet = lambda: server.REQUESTS_OK
+    server.init_db()
+    server.sync_employees_from_cloud()
+    for loop in (server.background_sync_loop, server.cloud_outbox_loop, server.memory_sampler_loop):
+        threading.Thread(target=loop, daemon=True).start()
+    server.run_http_server(port)
+
+
+def start_kiosk(data_dir, cloud_url, port, http_server):
+    with open(os.path.join(data_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'supabase_url': cloud_url,
+            'supabase_service_key': 'loadtest',
+            'sync_endpoint': cloud_url,
+            'cloud_base_url': cloud_url,
+            'sync_api_key': 'loadtest',
+            'kiosk_port': port,
+            'http_server': http_server,
+        }, f)
+    env = dict(os.environ, KIOSK_DATA_DIR=data_dir, PYTHONIOENCODING='utf-8')
+    log = open(os.path.join(data_dir, 'kiosk.log'), 'w', encoding='utf-8')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"kiosk exited early, see {log.name}")
+        try:
+            if requests.get(f"{base}/login", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"kiosk did not start within 30s, see {log.name}")
+
+
+# ── Phones ─────────────────────────────────
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def call(self, step, http, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = http.request(method, url, timeout=30, allow_redirects=False, **kwargs)
+            failure = str(resp.status_code) if resp.status_code >= 400 else None
+        except requests.RequestException as e:
+            resp, failure = None, type(e).__name__
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[step].append(elapsed)
+            if failure:
+                self.errors[step][failure] += 1
+        return resp
+
+    def report(self, wall_seconds):
+        steps = {}
+        total = failed = 0
+        for step, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            errors = sum(self.errors[step].values())
+            total += len(values)
+            failed += errors
+            steps[step] = {
+                'count': len(values),
+                'throughput_rps': round(len(values) / wall_seconds, 2),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1),
+                'error_rate': round(errors / len(values), 4),
+                'errors': dict(self.errors[step]),
+            }
+        return {
+            'requests': total,
+            'throughput_rps': round(total / wall_seconds, 2),
+            'error_rate': round(failed / total, 4) if total else 0,
+            'steps': steps,
+        }
+
+
+def think(mean):
+    if mean > 0:
+        time.sleep(random.expovariate(1 / mean))
+
+
+def phone(base, emp_id, rec, stop_at, args, rng):
+    http = requests.Session()
+    device_id = f"loadtest-{uuid.uuid4().hex[:12]}"
+    rec.call('login_page', http, 'GET', f"{base}/login")
+    think(args.think)
+    resp = rec.call('login_and_link', http, 'POST', f"{base}/login_and_link",
+                    json={'identifier': f'موظف {emp_id}', 'pin': f'{1000 + emp_id}', 'device_id': device_id})
+    if resp is None or not resp.ok or not resp.json().get('success'):
+        return
+    while time.time() < stop_at:
+        think(args.think)
+        rec.call('auto_login', http, 'POST', f"{base}/api/auto_login",
+                 json={'employee_id': emp_id, 'device_id': device_id})
+        rec.call('dashboard', http, 'GET', f"{base}/")
+        think(args.think)
+        rec.call('checkin', http, 'POST', f"{base}/checkin", json={'device_id': device_id})
+        if rng.random() < args.inventory_ratio:
+            think(args.think)
+            rec.call('inventory_page', http, 'GET', f"{base}/inventory")
+            think(args.think * 3)
+            items = [{'item_name': f'منتج {rng.randint(1, 200)}', 'quantity': rng.randint(0, 40)}
+                     for _ in range(rng.randint(5, 40))]
+            rec.call('inventory_submit', http, 'POST', f"{base}/api/local/inventory",
+                     json={'branch': 'Suzz 1', 'shift': rng.choice(['morning', 'evening']), 'items': items})
+
+
+def run(args):
+    cloud = FakeCloud(employees=args.phones, latency_ms=args.cloud_latency_ms)
+    cloud_url = cloud.start()
+    data_dir = tempfile.mkdtemp(prefix='kiosk-loadtest-')
+    proc = None
+    try:
+        proc, base = start_kiosk(data_dir, cloud_url, args.port or free_port(), args.http_server)
+        rec = Recorder()
+        stop_at = time.time() + args.duration
+        started = time.time()
+        threads = []
+        for emp_id in range(1, args.phones + 1):
+            t = threading.Thread(target=phone, args=(base, emp_id, rec, stop_at, args,
+                                                     random.Random(args.seed + emp_id)), daemon=True)
+            t.start()
+            threads.append(t)
+            time.sleep(args.ramp_up / args.phones)
+        for t in threads:
+            t.join()
+        wall = time.time() - started
+
+        report = {
+            'config': {k: v for k, v in vars(args).items() if k not in ('serve', 'out')},
+            'wall_seconds': round(wall, 2),
+            **rec.report(wall),
+        }
+        try:
+            resp = requests.get(f"{base}/api/admin/metrics", params={'admin_pin': KIOSK_PIN}, timeout=10)
+            report['kiosk'] = resp.json() if resp.ok else {'status': resp.status_code}
+        except (requests.RequestException, ValueError) as e:
+            report['kiosk'] = {'error': str(e)}
+        report['cloud_requests'] = dict(sorted(cloud.requests.items()))
+        return report
+    finally:
+        if proc:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        cloud.stop()
+        if args.keep:
+            print(f"[loadtest] kept data in {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description='Simulate phones hitting the kiosk and report latency')
+    parser.add_argument('--phones', type=int, default=30, help='simulated phones (one employee each)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of steady load')
+    parser.add_argument('--ramp-up', type=float, default=5, help='seconds to start all phones')
+    parser.add_argument('--think', type=float, default=1.0, help='mean think time between steps (s)')
+    parser.add_argument('--inventory-ratio', type=float, default=0.2, help='share of loops that submit a count')
+    parser.add_argument('--http-server', choices=['waitress', 'dev'], default='waitress')
+    parser.add_argument('--cloud-latency-ms', type=float, default=50, help='added latency of the fake cloud')
+    parser.add_argument('--port', type=int, default=0, help='kiosk port (default: any free port)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='also write the JSON report to this file')
+    parser.add_argument('--keep', action='store_true', help="keep the temp data dir (DB, kiosk.log)")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        sys.exit(0)
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
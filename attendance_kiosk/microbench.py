@@ -0,0 +1,268 @@
+"""
+Micro-benchmarks
+================
+Times the kiosk's hot data-access paths at several dataset sizes (built with
+generate_dataset.py) and fits how each one scales with the number of
+attendance rows:
+
+  checkin            POST /checkin: latest-session lookup, calculate_status,
+                     insert or check-out update
+  my_counts          GET /api/local/my_counts as admin, all counts with items
+  my_counts_rows     the same query without decoding/returning items
+  my_counts_today    the employee view (today's counts only)
+  admin_page         GET /admin: data assembly + template render
+  sync_status        _load_sync_status() (what /api/sync_status coalesces)
+  sync_chunk_select  the backlog drain's next-chunk query
+  sync_merge         _merge_cloud_attendance() on 100 cloud rows, half
+                     linked by cloud_id, half matched by employee/date/time
+                     (rolled back after each run)
+  hours_month        compute_worked_hours() over the last 31 days for all
+                     employees (numpy when installed)
+  analytics          the four /api/admin/analytics/* endpoints over the last
+                     365 days (rollups already current)
+  export_csv         /api/admin/export/attendance as CSV over the last 365
+                     days, whole stream read
+  export_xlsx        the same as XLSX
+
+    python microbench.py
+    python microbench.py --days 30,365,1095 --employees 100 --budget 3 --out bench.json
+
+Each benchmark runs until --repeats runs or --budget seconds are spent. The
+report lists median/p90/min per size and the log-log slope of the median
+against row count: ~0 is O(1), ~1 is O(n), well above 1 is O(n·m).
+
+The kiosk runs from a temporary data dir whose config.json points every
+cloud URL at a local FakeCloud, so the bundled config's production cloud is
+never used (the generated databases don't sync anyway, see generate_dataset).
+"""
+
+import argparse, json, math, os, shutil, statistics, sys, tempfile, time
+from argparse import Namespace
+from datetime import date
+
+import generate_dataset
+from fake_cloud import FakeCloud
+
+
+def timed_runs(fn, repeats, budget, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < repeats and (len(samples) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def make_benchmarks(server, client, pin):
+    db = server.get_db()
+    emp = db.execute("SELECT id, pin_code FROM employees WHERE is_active=1 ORDER BY id LIMIT 1").fetchone()
+    db.close()
+    today = date.today().isoformat()
+
+    def ok(resp):
+        if resp.status_code != 200:
+            raise RuntimeError(f"HTTP {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+        return resp
+
+    def checkin():
+        ok(client.post('/checkin', json={'employee_id': emp['id'], 'pin_code': emp['pin_code']}))
+
+    def my_counts():
+        ok(client.get('/api/local/my_counts', query_string={'admin_pin': pin}))
+
+    def my_counts_rows():
+        db = server.get_db()
+        db.execute("""SELECT oc.id, oc.created_at, oc.count_date, oc.shift, oc.branch, e.name as employee_name
+                      FROM offline_counts oc JOIN employees e ON oc.employee_id = e.id
+                      ORDER BY oc.id DESC""").fetchall()
+        db.close()
+
+    def my_counts_today():
+        with client.session_transaction() as sess:
+            sess['employee_id'] = emp['id']
+        try:
+            ok(client.get('/api/local/my_counts'))
+        finally:
+            with client.session_transaction() as sess:
+                sess.clear()
+
+    def admin_page():
+        ok(client.get('/admin', query_string={'pin': pin}))
+
+    def sync_status():
+        server._load_sync_status()
+
+    def sync_chunk_select():
+        db = server.get_db()
+        db.execute("SELECT * FROM attendance WHERE synced=0 ORDER BY attendance_date DESC, id ASC LIMIT ?",
+                   (100,)).fetchall()
+        db.close()
+
+    db = server.get_db()
+    linked = [dict(r) for r in db.execute(
+        "SELECT * FROM attendance WHERE cloud_id IS NOT NULL ORDER BY id DESC LIMIT 50").fetchall()]
+    db.close()
+    cloud_rows = [dict(r, id=r['cloud_id'], version=(r['cloud_version'] or 1) + 1, status='late') for r in linked]
+    next_cloud_id = 10 ** 9
+    for n, r in enumerate(linked):
+        # Sessions the kiosk has never seen: matched (and missed) by employee/date/time
+        cloud_rows.append(dict(r, id=next_cloud_id + n, version=1, check_in_time=f"23:{n % 60:02d}"))
+
+    def sync_merge():
+        db = server.get_db()
+        try:
+            server._merge_cloud_attendance(db, cloud_rows)
+        finally:
+            db.rollback()
+            db.close()
+
+    def hours_month():
+        db = server.get_db()
+        server.compute_worked_hours(db, date.fromordinal(date.today().toordinal() - 30), date.today())
+        db.close()
+
+    year_ago = date.fromordinal(date.today().toordinal() - 364).isoformat()
+
+    def analytics():
+        for kind in ('lateness', 'weekly', 'first_punch', 'absences'):
+            ok(client.get(f'/api/admin/analytics/{kind}', query_string={'admin_pin': pin, 'start_date': year_ago}))
+
+    def export(fmt):
+        def run():
+            resp = ok(client.get('/api/admin/export/attendance', buffered=False,
+                                 query_string={'admin_pin': pin, 'start_date': year_ago, 'format': fmt}))
+            for _ in resp.response:
+                pass
+            resp.close()
+        return run
+
+    return {
+        'checkin': checkin,
+        'my_counts': my_counts,
+        'my_counts_rows': my_counts_rows,
+        'my_counts_today': my_counts_today,
+        'admin_page': admin_page,
+        'sync_status': sync_status,
+        'sync_chunk_select': sync_chunk_select,
+        'sync_merge': sync_merge,
+        'hours_month': hours_month,
+        'analytics': analytics,
+        'export_csv': export('csv'),
+        'export_xlsx': export('xlsx'),
+    }
+
+
+def slope(points):
+    """Least-squares slope of log(time) over log(size)."""
+    pts = [(math.log(n), math.log(t)) for n, t in points if n > 0 and t > 0]
+    if len(pts) < 2:
+        return None
+    mx = sum(x for x, _ in pts) / len(pts)
+    my = sum(y for _, y in pts) / len(pts)
+    var = sum((x - mx) ** 2 for x, _ in pts)
+    return round(sum((x - mx) * (y - my) for x, y in pts) / var, 2) if var else None
+
+
+def classify(k):
+    if k is None:
+        return 'n/a'
+    if k < 0.25:
+        return 'O(1)'
+    if k < 1.3:
+        return 'O(n)'
+    return 'O(n·m)'
+
+
+def run(args):
+    cloud = FakeCloud(employees=args.employees, seed=args.seed)
+    cloud_url = cloud.start()
+    cloud_cfg = {
+        'supabase_url': cloud_url,
+        'supabase_service_key': 'microbench',
+        'sync_endpoint': cloud_url,
+        'cloud_base_url': cloud_url,
+        'sync_api_key': 'microbench',
+        'sync_mode': 'standalone',
+        'hub_url': '',
+    }
+    work = tempfile.mkdtemp(prefix='kiosk-microbench-')
+    with open(os.path.join(work, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(cloud_cfg, f)
+    # Set before server is first imported (by generate_dataset), so this
+    # config.json is loaded last and wins over the bundled one
+    os.environ['KIOSK_DATA_DIR'] = work
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    sizes = []
+    try:
+        for days in [int(d) for d in args.days.split(',')]:
+            path = os.path.join(work, f'bench_{days}.db')
+            info = generate_dataset.generate(Namespace(
+                out=path, force=True, seed=args.seed, employees=args.employees, days=days, end=None,
+                products=400, items_min=args.items_min, items_max=args.items_max, sync_every=30,
+                unsynced_days=2, admin_pin='1234'))
+            import server
+            server.cfg.update(cloud_cfg)  # in case server was imported before run()
+            server.DB_PATH = path
+            server.app.config['TESTING'] = True
+            client = server.app.test_client()
+            sizes.append({'days': days, 'attendance': info['attendance'], 'offline_counts': info['offline_counts']})
+            print(f"[microbench] {days} days: {info['attendance']} punches, {info['offline_counts']} counts",
+                  file=sys.stderr)
+            for name, fn in make_benchmarks(server, client, '1234').items():
+                if only and name not in only:
+                    continue
+                samples = sorted(timed_runs(fn, args.repeats, args.budget))
+                results.setdefault(name, []).append({
+                    'days': days,
+                    'rows': info['attendance'],
+                    'runs': len(samples),
+                    'median_ms': round(statistics.median(samples) * 1000, 3),
+                    'p90_ms': round(samples[int(0.9 * (len(samples) - 1))] * 1000, 3),
+                    'min_ms': round(samples[0] * 1000, 3),
+                })
+    finally:
+        cloud.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {'config': vars(args), 'sizes': sizes, 'benchmarks': {}}
+    for name, points in results.items():
+        k = slope([(p['rows'], p['median_ms']) for p in points])
+        report['benchmarks'][name] = {'scaling_exponent': k, 'complexity': classify(k), 'points': points}
+    return report
+
+
+def print_table(report):
+    sizes = [s['days'] for s in report['sizes']]
+    print(f"{'benchmark':<20}" + ''.join(f"{str(d) + 'd ms':>12}" for d in sizes) + f"{'slope':>8}  class",
+          file=sys.stderr)
+    for name, b in report['benchmarks'].items():
+        cells = ''.join(f"{p['median_ms']:>12.2f}" for p in b['points'])
+        print(f"{name:<20}{cells}{str(b['scaling_exponent']):>8}  {b['complexity']}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description='Scaling curves for the kiosk hot paths')
+    parser.add_argument('--days', default='30,90,365', help='dataset sizes, in days of history')
+    parser.add_argument('--employees', type=int, default=60)
+    parser.add_argument('--items-min', type=int, default=150)
+    parser.add_argument('--items-max', type=int, default=350)
+    parser.add_argument('--repeats', type=int, default=30, help='max runs per benchmark and size')
+    parser.add_argument('--budget', type=float, default=2.0, help='seconds per benchmark and size')
+    parser.add_argument('--only', help='comma-separated benchmark names')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = run(args)
+    print_table(report)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
@@ -7,14 +7,35 @@ Attendance is stored in SQLite and synced to the cloud when internet is availabl
 """
 
 import json, os, sqlite3, threading, time, webbrowser, socket, subprocess, sys, base64
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import queue
+import re
+import tracemalloc
+import unicodedata
+import uuid
+import zipfile
+import zlib
 try:
     import psutil
 except ImportError:
     psutil = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from datetime import date, datetime, timedelta
 from contextlib import contextmanager
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, Response, g, has_request_context
+from flask import before_render_template, template_rendered
+from collections import deque
 
 try:
     import requests
@@ -22,6 +43,11 @@ try:
 except ImportError:
     REQUESTS_OK = False
 
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
 # ── Path resolution (works both in dev and PyInstaller EXE) ───────────
 # When frozen: sys._MEIPASS = temp folder where bundled files are extracted
 # When dev:    BASE_DIR     = folder containing server.py
@@ -31,6 +57,8 @@ if getattr(sys, 'frozen', False):
 else:
     RESOURCES_DIR = os.path.dirname(os.path.abspath(__file__))
     APP_DATA_DIR  = RESOURCES_DIR
+# KIOSK_DATA_DIR lets several kiosks (e.g. a hub and its satellites) run from one install
+APP_DATA_DIR = os.environ.get('KIOSK_DATA_DIR') or APP_DATA_DIR
 
 BASE_DIR = RESOURCES_DIR  # kept for any legacy references
 DB_PATH  = os.path.join(APP_DATA_DIR, 'attendance.db')
@@ -47,18 +75,58 @@ cfg = {
     'work_end_time': '17:00',
     'late_threshold_minutes': 15,
     'kiosk_port': 8085,
-    'off_days': [5, 6]
+    'off_days': [5, 6],
+    'sync_chunk_size': 100,
+    'sync_time_budget_seconds': 20,
+    'sync_gzip_requests': True,
+    'sync_gzip_min_bytes': 1024,
+    'attendance_pull_days': 35,
+    # Branch hub mode: 'standalone' talks to the cloud itself, a 'hub' also
+    # serves the satellites on its LAN, a 'satellite' only talks to hub_url
+    'sync_mode': 'standalone',
+    'hub_url': '',
+    'kiosk_id': '',
+    # HTTP server: 'waitress' (production, falls back to the Flask dev server
+    # when not installed) or 'dev'
+    'http_server': 'waitress',
+    'http_threads': 8,
+    'http_connection_limit': 200,
+    'http_channel_timeout': 30,
+    'http_backlog': 1024,
+    'sqlite_busy_timeout_ms': 5000,
+    # Live screens (/api/events); each open stream holds one HTTP thread
+    'sse_max_clients': 32,
+    'sse_heartbeat_seconds': 15,
+    # Admission control: concurrent requests per class, of which
+    # admission_reserved_punch slots only /checkin may use; the rest wait in
+    # a priority queue (punch first) up to their deadline, then get a 503
+    'admission_capacity': 8,
+    'admission_reserved_punch': 2,
+    'admission_limits': {'punch': 8, 'api': 4, 'page': 4, 'admin': 2},
+    'admission_max_wait_seconds': {'punch': 8, 'api': 3, 'page': 3, 'admin': 2},
+    'admission_queue_size': 64,
+    'admission_retry_after_seconds': 2,
+    # Per-request profiling (DB / template / outbound HTTP time), off by default
+    'profiling_enabled': False,
+    'profiling_slow_ms': 500,
+    'profiling_window': 500,
+    # Memory: RSS (+ top allocation sites while tracemalloc runs) every
+    # memory_sample_seconds; memory_tracking starts tracemalloc at boot
+    'memory_tracking': False,
+    'memory_traceback_frames': 1,
+    'memory_sample_seconds': 300,
+    'memory_history_size': 288
 }
 
 def load_config():
     """Load configuration from config.json (bundled or local)."""
     global cfg
     paths_to_try = [
-        os.path.join(APP_DATA_DIR, 'config.json'), # Local override
         os.path.join(RESOURCES_DIR, 'config.json'), # Bundled
+        os.path.join(APP_DATA_DIR, 'config.json'), # Local override (loaded last, wins)
     ]
     
-    for p in paths_to_try:
+    for p in dict.fromkeys(paths_to_try):
         if os.path.exists(p):
             try:
                 with open(p, 'r', encoding='utf-8') as f:
@@ -97,12 +165,62 @@ sync_lock = threading.Lock()
 
 @app.route('/static/logo.jpg')
 def serve_logo():
-    from flask import Response
     data = _load_logo()
     if data:
         return Response(data, mimetype='image/jpeg')
     return '', 404
 
+# ── Request Coalescing ──────────────────────
+# Identical reads that arrive together (30 phones opening /login at once)
+# share one computation: the first caller runs it, the others wait for its
+# result. Shared results must be treated as read-only.
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return fn(), sharing the result with concurrent calls for the same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        SINGLEFLIGHT_CALLS.inc(key=key[0] if isinstance(key, tuple) else key,
+                               role='leader' if leader else 'shared')
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+reads = SingleFlight()
+
+def ttl_cached(seconds):
+    """Cache a no-argument function's result for `seconds`; refreshes are single-flight."""
+    def decorator(fn):
+        entry = {}
+        @functools.wraps(fn)
+        def wrapper():
+            if entry and time.monotonic() - entry['at'] < seconds:
+                return entry['value']
+            value = reads.do(fn.__name__, fn)
+            entry.update(value=value, at=time.monotonic())
+            return value
+        return wrapper
+    return decorator
+
+@ttl_cached(60)
 def get_local_ip():
     """Returns the primary local IP address of the machine."""
     try:
@@ -135,14 +253,657 @@ def get_local_ip():
 
     return "127.0.0.1"
 
+# ── Metrics ─────────────────────────────────
+# Minimal in-process counters/histograms rendered in Prometheus text format at
+# /metrics and summarised for the admin panel. No external dependency so it
+# works inside the PyInstaller EXE.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics_registry = []
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics_registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _metrics_registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def quantile(self, series, q):
+        """Estimate a quantile from bucket counts (linear within the bucket)."""
+        total = series[-1]
+        if not total:
+            return 0.0
+        rank, seen, lower = q * total, 0, 0.0
+        for i, upper in enumerate(self.buckets):
+            if series[i] and seen + series[i] >= rank:
+                return lower + (upper - lower) * (rank - seen) / series[i]
+            seen += series[i]
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.snapshot().items()):
+            cumulative = 0
+            for i, upper in enumerate(self.buckets):
+                cumulative += series[i]
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', upper)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+class Gauge:
+    """Gauge whose samples are computed at scrape time by `collect()` -> {label key: value}.
+
+    Gauges built on the same `source` share one call of it per scrape and get
+    its result as `collect(data)`.
+    """
+    def __init__(self, name, help_text, collect, source=None):
+        self.name, self.help = name, help_text
+        self.collect, self.source = collect, source
+        _metrics_registry.append(self)
+
+    def render(self, sources=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            if self.source is None:
+                samples = self.collect()
+            else:
+                sources = {} if sources is None else sources
+                if self.source not in sources:
+                    sources[self.source] = self.source()
+                samples = self.collect(sources[self.source])
+        except Exception as e:
+            print(f"[Metrics] Gauge {self.name} failed: {e}")
+            samples = {}
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+def render_metrics():
+    lines, sources = [], {}
+    for metric in _metrics_registry:
+        lines.extend(metric.render(sources) if isinstance(metric, Gauge) else metric.render())
+    return '\n'.join(lines) + '\n'
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+HTTP_REQUEST_SECONDS = Histogram('kiosk_http_request_duration_seconds', 'Flask request latency by route.')
+HTTP_REQUESTS = Counter('kiosk_http_requests_total', 'Flask requests by route and status.')
+SQLITE_STATEMENT_SECONDS = Histogram('kiosk_sqlite_statement_duration_seconds', 'SQLite statement time (execute + fetch) by kind.')
+SYNC_STAGE_SECONDS = Histogram('kiosk_sync_stage_duration_seconds', 'Duration of each sync stage run.',
+                               buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+SYNC_RUNS = Counter('kiosk_sync_runs_total', 'Sync stage runs by outcome.')
+CLOUD_REQUEST_SECONDS = Histogram('kiosk_cloud_request_duration_seconds', 'Outbound cloud request latency by target.')
+CLOUD_REQUESTS = Counter('kiosk_cloud_requests_total', 'Outbound cloud requests by target and status.')
+SYNC_RETRIES = Counter('kiosk_sync_retries_total', 'Sync retries by kind.')
+SYNC_BYTES = Counter('kiosk_sync_bytes_total', 'Sync body bytes on the wire by direction.')
+SINGLEFLIGHT_CALLS = Counter('kiosk_singleflight_calls_total', 'Coalesced reads by key and role (leader ran it, shared waited).')
+
+def sync_stage(stage):
+    """Decorator: time a sync function and count its outcome.
+
+    A dict result with success=False counts as 'failed', an exception as 'error'.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = fn(*args, **kwargs)
+                outcome = 'failed' if isinstance(result, dict) and result.get('success') is False else 'ok'
+                return result
+            finally:
+                SYNC_STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+                SYNC_RUNS.inc(stage=stage, outcome=outcome)
+        return wrapper
+    return decorator
+
+_UUID_OR_ID = re.compile(r'/(\d+|[0-9a-f]{8}-[0-9a-f-]{27})(?=/|$)')
+
+def _metric_target(url):
+    """Low-cardinality label for an outbound URL: the PostgREST table or the API path."""
+    path = url.split('://', 1)[-1].split('/', 1)[-1].split('?', 1)[0]
+    if path.startswith('rest/v1/'):
+        return path[len('rest/v1/'):]
+    return _UUID_OR_ID.sub('/:id', '/' + path)
+
+@app.before_request
+def _metrics_start_request():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _metrics_end_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
+# ── Admission Control ───────────────────────
+# At shift change every phone hits /checkin at once while others load pages
+# and the sync thread writes. Requests are admitted per class against a
+# shared capacity; /checkin ('punch') has slots nobody else may take and goes
+# first in the wait queue, so a punch's latency stays bounded under a burst.
+# The CPU profiler is exempt: it mostly sleeps between samples for up to a
+# minute and would otherwise hold one of the few admin slots the whole time;
+# _cpu_profile_lock already keeps it to one run at a time.
+ADMISSION_PRIORITY = {'punch': 0, 'api': 1, 'page': 2, 'admin': 3}
+ADMISSION_EXEMPT = ('/static/', '/api/events', '/metrics', '/api/admin/profile/cpu')
+
+ADMISSION_WAIT_SECONDS = Histogram('kiosk_admission_wait_seconds', 'Time requests waited for admission by class.')
+ADMISSION_REJECTED = Counter('kiosk_admission_rejected_total', 'Requests refused with 503 by class and reason.')
+
+class AdmissionController:
+    def __init__(self, capacity, reserved_punch, limits, queue_size):
+        self.capacity = capacity
+        self.reserved_punch = reserved_punch
+        self.limits = limits
+        self.queue_size = queue_size
+        self.in_flight = {cls: 0 for cls in ADMISSION_PRIORITY}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _fits(self, cls):
+        total = sum(self.in_flight.values())
+        if self.in_flight[cls] >= self.limits.get(cls, self.capacity) or total >= self.capacity:
+            return False
+        if cls != 'punch':
+            return total - self.in_flight['punch'] < self.capacity - self.reserved_punch
+        return True
+
+    def acquire(self, cls, timeout):
+        """Wait up to `timeout` seconds for a slot. Returns None on success or the refusal reason."""
+        with self._cond:
+            if len(self._waiters) >= self.queue_size:
+                return 'queue_full'
+            entry = (ADMISSION_PRIORITY[cls], next(self._seq), cls)
+            heapq.heappush(self._waiters, entry)
+            deadline = time.monotonic() + timeout
+            while True:
+                # The best-placed waiter that fits goes first; a class at its
+                # own limit doesn't hold up the classes behind it
+                chosen = next((w for w in sorted(self._waiters) if self._fits(w[2])), None)
+                if chosen is entry:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self.in_flight[cls] += 1
+                    self._cond.notify_all()
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    return 'timeout'
+                self._cond.wait(remaining)
+
+    def release(self, cls):
+        with self._cond:
+            self.in_flight[cls] -= 1
+            self._cond.notify_all()
+
+    def queue_lengths(self):
+        with self._cond:
+            lengths = {cls: 0 for cls in ADMISSION_PRIORITY}
+            for _, _, cls in self._waiters:
+                lengths[cls] += 1
+            return lengths
+
+admission = AdmissionController(
+    capacity=int(cfg.get('admission_capacity', 8)),
+    reserved_punch=int(cfg.get('admission_reserved_punch', 2)),
+    limits=cfg.get('admission_limits') or {},
+    queue_size=int(cfg.get('admission_queue_size', 64)),
+)
+
+Gauge('kiosk_admission_in_flight', 'Admitted requests in progress by class.',
+      lambda: {(('class', c),): n for c, n in admission.in_flight.items()})
+Gauge('kiosk_admission_queue_length', 'Requests waiting for admission by class.',
+      lambda: {(('class', c),): n for c, n in admission.queue_lengths().items()})
+
+def admission_class(path):
+    if path == '/checkin':
+        return 'punch'
+    if path.startswith(ADMISSION_EXEMPT):
+        return None
+    if path == '/admin' or path.startswith('/api/admin/'):
+        return 'admin'
+    if path.startswith(('/api/', '/hub/', '/sync_now', '/refresh_employees')):
+        return 'api'
+    return 'page'
+
+@app.before_request
+def _admission_enter():
+    cls = admission_class(request.path)
+    if cls is None:
+        return None
+    waits = cfg.get('admission_max_wait_seconds') or {}
+    start = time.perf_counter()
+    refused = admission.acquire(cls, float(waits.get(cls, 3)))
+    ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, **{'class': cls})
+    if refused:
+        ADMISSION_REJECTED.inc(**{'class': cls, 'reason': refused})
+        resp = jsonify({'success': False, 'error': 'السيرفر مشغول، حاول مرة أخرى بعد لحظات'})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = str(cfg.get('admission_retry_after_seconds', 2))
+        return resp
+    g.admission_class = cls
+    g.admission_wait = time.perf_counter() - start
+    return None
+
+@app.after_request
+def _admission_hand_over(response):
+    # A streamed body (CSV/XLSX export) is generated after the request context
+    # is gone, so the slot is held until the server has finished sending it
+    cls = g.pop('admission_class', None)
+    if cls is not None:
+        response.call_on_close(lambda: admission.release(cls))
+    return response
+
+@app.teardown_request
+def _admission_exit(exc):
+    # Only still set when no response was produced (unhandled error)
+    cls = g.pop('admission_class', None)
+    if cls is not None:
+        admission.release(cls)
+
+# ── Request Profiling (opt-in) ──────────────
+# With profiling_enabled, each request's time is split into admission wait,
+# SQLite (from _TimedCursor), template rendering and outbound HTTP (from
+# sync_request). Recent samples per route give rolling percentiles; requests
+# over profiling_slow_ms go to slow_requests.log with secrets redacted.
+SLOW_LOG_PATH = os.path.join(APP_DATA_DIR, 'slow_requests.log')
+SLOW_LOG_MAX_BYTES = 1024 * 1024
+PROFILE_PARTS = ('wait', 'db', 'template', 'http')
+_SECRET_PARAM = re.compile(r'pin|pass|key|token|secret|device', re.I)
+
+_route_samples = {}
+_slow_requests = deque(maxlen=100)
+_profile_lock = threading.Lock()
+
+def profile_add(part, seconds):
+    """Charge `seconds` of `part` to the current request, if it is being profiled."""
+    if has_request_context():
+        prof = g.get('profile')
+        if prof is not None:
+            prof[part] += seconds
+
+def _redact(params):
+    return {k: ('***' if _SECRET_PARAM.search(k) else v) for k, v in params.items()}
+
+def _write_slow_log(entry):
+    try:
+        if os.path.exists(SLOW_LOG_PATH) and os.path.getsize(SLOW_LOG_PATH) > SLOW_LOG_MAX_BYTES:
+            os.replace(SLOW_LOG_PATH, SLOW_LOG_PATH + '.1')
+        with open(SLOW_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+    except OSError as e:
+        print(f"[Profiling] Slow log write failed: {e}")
+
+@app.before_request
+def _profile_start():
+    if cfg.get('profiling_enabled'):
+        g.profile = {part: 0.0 for part in PROFILE_PARTS}
+        g.profile['wait'] = g.get('admission_wait', 0.0)
+
+@before_render_template.connect_via(app)
+def _profile_template_start(sender, template, context, **extra):
+    if g.get('profile') is not None:
+        g.profile_template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _profile_template_end(sender, template, context, **extra):
+    started = g.pop('profile_template_started', None)
+    if started is not None:
+        profile_add('template', time.perf_counter() - started)
+
+@app.after_request
+def _profile_end(response):
+    prof = g.pop('profile', None)
+    started = g.get('request_started')
+    if prof is None or started is None:
+        return response
+    total = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    sample = (total, *(prof[part] for part in PROFILE_PARTS))
+    with _profile_lock:
+        samples = _route_samples.get((route, request.method))
+        if samples is None:
+            samples = _route_samples[(route, request.method)] = deque(maxlen=int(cfg.get('profiling_window', 500)))
+        samples.append(sample)
+
+    if total * 1000 >= float(cfg.get('profiling_slow_ms', 500)):
+        params = dict(request.args)
+        body = request.get_json(silent=True) if request.is_json else None
+        if isinstance(body, dict):
+            params.update(body)
+        entry = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'route': route,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            **{f'{part}_ms': round(prof[part] * 1000, 1) for part in PROFILE_PARTS},
+            'params': _redact(params),
+        }
+        _slow_requests.append(entry)
+        _write_slow_log(entry)
+    return response
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def profiling_summary():
+    with _profile_lock:
+        snapshot = {key: list(samples) for key, samples in _route_samples.items()}
+    routes = []
+    for (route, method), samples in snapshot.items():
+        totals = sorted(s[0] for s in samples)
+        n = len(samples)
+        routes.append({
+            'route': route,
+            'method': method,
+            'count': n,
+            'p50_ms': round(_percentile(totals, 0.50) * 1000, 1),
+            'p95_ms': round(_percentile(totals, 0.95) * 1000, 1),
+            'p99_ms': round(_percentile(totals, 0.99) * 1000, 1),
+            **{f'avg_{part}_ms': round(sum(s[i + 1] for s in samples) / n * 1000, 1)
+               for i, part in enumerate(PROFILE_PARTS)},
+        })
+    routes.sort(key=lambda r: r['p95_ms'], reverse=True)
+    return routes
+
+# ── Live Events (SSE) ───────────────────────
+# Admin screens subscribe to /api/events instead of polling (the stream
+# carries every punch, so it needs the admin PIN; employee phones poll
+# /api/sync_status instead of each holding a connection and a thread).
+# Producers publish once; the broker formats the frame once and fans it out
+# to a bounded queue per client. A client that falls behind (full queue) has
+# its backlog dropped and gets a 'resync' event to refetch its state.
+class EventBroker:
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def subscribe(self, max_clients):
+        """Return a new client queue, or None when `max_clients` are connected."""
+        with self._lock:
+            if len(self._clients) >= max_clients:
+                return None
+            q = queue.Queue(maxsize=self.queue_size)
+            self._clients.add(q)
+            return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._clients.discard(q)
+
+    def frame(self, event, data):
+        with self._lock:
+            self._next_id += 1
+            event_id = self._next_id
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+        return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+    def publish(self, event, data):
+        if not self._clients:
+            return
+        message = self.frame(event, data)
+        with self._lock:
+            clients = list(self._clients)
+        for q in clients:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                try:
+                    q.put_nowait(self.frame('resync', {}))
+                except queue.Full:
+                    pass
+
+    def stream(self, q, first_frames=(), heartbeat=15):
+        """Generator for the response body; unsubscribes when the client goes away."""
+        try:
+            yield "retry: 3000\n\n"
+            yield from first_frames
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(q)
+
+events = EventBroker()
+
+def publish_sync_status():
+    """Publish the backlog counts (one query, only when someone is listening)."""
+    if events.client_count:
+        # Not coalesced: a read already in flight may predate the caller's commit
+        status = _load_sync_status()
+        events.publish('sync_status', {'unsynced_count': status['unsynced_count'],
+                                       'outbox_pending': status['outbox_pending'],
+                                       'last_sync': status['last_sync']})
+
 # ── Database ────────────────────────────────
+# Statement stats grouped by normalized SQL: literals and IN lists collapse
+# to ?, so "WHERE id=5" and "WHERE id=7" count as one statement
+SQL_STATS_MAX_STATEMENTS = 500
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+
+_sql_stats = {}
+_sql_stats_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    sql = ' '.join(sql.split())
+    sql = _SQL_LITERALS.sub('?', sql)
+    return _SQL_IN_LIST.sub('IN (?)', sql)
+
+def _record_sql(sql, elapsed, rows):
+    key = normalize_sql(sql)
+    with _sql_stats_lock:
+        stat = _sql_stats.get(key)
+        if stat is None:
+            if len(_sql_stats) >= SQL_STATS_MAX_STATEMENTS:
+                key = '(other statements)'
+                stat = _sql_stats.setdefault(key, {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0})
+            else:
+                stat = _sql_stats[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0}
+        stat['count'] += 1
+        stat['total'] += elapsed
+        stat['rows'] += rows
+        if elapsed > stat['max']:
+            stat['max'] = elapsed
+
+def sql_fingerprint(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:10]
+
+def sql_stats_snapshot():
+    with _sql_stats_lock:
+        return {sql: dict(stat) for sql, stat in _sql_stats.items()}
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's execute + fetch time to the metrics.
+
+    Besides the per-kind histogram, every statement is added to _sql_stats
+    (count, total/max time, rows returned or changed) under its normalized text.
+    """
+    _stmt_kind = None
+    _stmt_sql = None
+    _stmt_elapsed = 0.0
+    _stmt_rows = 0
+
+    def _begin(self, sql):
+        self._finish()
+        self._stmt_kind = (sql.lstrip().split(None, 1) or ['other'])[0].lower()
+        self._stmt_sql = sql
+        self._stmt_elapsed = 0.0
+        self._stmt_rows = 0
+
+    def _finish(self):
+        if self._stmt_kind is not None:
+            SQLITE_STATEMENT_SECONDS.observe(self._stmt_elapsed, kind=self._stmt_kind)
+            profile_add('db', self._stmt_elapsed)
+            _record_sql(self._stmt_sql, self._stmt_elapsed, self._stmt_rows)
+            self._stmt_kind = None
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._stmt_elapsed += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        result = self._timed(super().execute, sql, parameters)
+        if self.description is None:  # no result set to fetch
+            self._stmt_rows = max(self.rowcount, 0)
+            self._finish()
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        result = self._timed(super().executemany, sql, seq_of_parameters)
+        self._stmt_rows = max(self.rowcount, 0)
+        self._finish()
+        return result
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is not None:
+            self._stmt_rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size if size is not None else self.arraysize)
+        self._stmt_rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._stmt_rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        row = self._timed(super().__next__)
+        self._stmt_rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
+    start = time.perf_counter()
+    # Concurrent request threads wait on each other's write locks instead of failing
+    conn = sqlite3.connect(DB_PATH, factory=_TimedConnection,
+                           timeout=int(cfg.get('sqlite_busy_timeout_ms', 5000)) / 1000)
+    profile_add('db', time.perf_counter() - start)
     conn.row_factory = sqlite3.Row
+    # Connection setup, not a query: a plain cursor keeps it out of the SQL stats
+    sqlite3.Cursor(conn).execute("PRAGMA synchronous=NORMAL")
     return conn
 
+# The seed of a database built by generate_dataset.py (read by init_db), else
+# None. Its employee ids collide with real cloud ids, so such a database never
+# syncs: has_internet() reports offline and sync_request() refuses.
+dataset_seed = None
+
 def init_db():
+    global dataset_seed
     db = get_db()
+    # WAL lets readers proceed while a punch or sync is writing (persists in the DB file)
+    db.execute("PRAGMA journal_mode=WAL")
     db.executescript("""
         CREATE TABLE IF NOT EXISTS employees (
             id INTEGER PRIMARY KEY,
@@ -186,6 +947,19 @@ def init_db():
         db.execute("ALTER TABLE attendance ADD COLUMN notes TEXT DEFAULT ''")
     except:
         pass
+    # Two-way sync: the cloud row this one mirrors, the cloud version last seen
+    # and the time of the last local change
+    for col in ("cloud_id INTEGER", "cloud_version INTEGER", "updated_at TEXT"):
+        try:
+            db.execute(f"ALTER TABLE attendance ADD COLUMN {col}")
+        except:
+            pass
+    # Backlog drain walks unsynced rows newest day first
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_synced ON attendance(synced, attendance_date, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_cloud_id ON attendance(cloud_id)")
+    # Keyset pages for the admin lists: newest first, optionally per employee
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date_id ON attendance(attendance_date, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_employee ON attendance(employee_id, attendance_date, id)")
     db.execute('''
         CREATE TABLE IF NOT EXISTS sync_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -195,6 +969,11 @@ def init_db():
             message TEXT
         )
     ''')
+    for col in ("bytes_sent INTEGER DEFAULT 0", "bytes_received INTEGER DEFAULT 0"):
+        try:
+            db.execute(f"ALTER TABLE sync_log ADD COLUMN {col}")
+        except:
+            pass
     db.execute('''
         CREATE TABLE IF NOT EXISTS settings (
             key TEXT PRIMARY KEY,
@@ -225,10 +1004,156 @@ def init_db():
             created_at TEXT
         )
     ''')
+    # Inventory push pages unsynced counts by id
+    db.execute("CREATE INDEX IF NOT EXISTS idx_offline_counts_unsynced ON offline_counts(synced, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_offline_counts_employee ON offline_counts(employee_id, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_offline_counts_date ON offline_counts(count_date, id)")
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS cloud_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            method TEXT NOT NULL,
+            path TEXT NOT NULL,
+            payload_json TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            revision INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            created_at TEXT
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_cloud_outbox_status ON cloud_outbox(status, id)")
+    # Change feed for /api/today/delta: every insert, content update or delete
+    # of an attendance row takes the next sequence number. Sync bookkeeping
+    # (synced, cloud_id, cloud_version) doesn't count as a change.
+    db.execute("CREATE TABLE IF NOT EXISTS change_counter (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)")
+    try:
+        db.execute("ALTER TABLE attendance ADD COLUMN change_seq INTEGER")
+        db.execute("UPDATE attendance SET change_seq=id")
+    except:
+        pass
+    db.execute("INSERT OR IGNORE INTO change_counter (name, seq) "
+               "SELECT 'attendance', COALESCE(MAX(change_seq), 0) FROM attendance")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_change_seq ON attendance(attendance_date, change_seq)")
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_tombstones (
+            id INTEGER NOT NULL,
+            attendance_date TEXT NOT NULL,
+            change_seq INTEGER NOT NULL
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_tombstones ON attendance_tombstones(attendance_date, change_seq)")
+    db.executescript('''
+        CREATE TRIGGER IF NOT EXISTS attendance_change_insert AFTER INSERT ON attendance
+        BEGIN
+            UPDATE change_counter SET seq=seq+1 WHERE name='attendance';
+            UPDATE attendance SET change_seq=(SELECT seq FROM change_counter WHERE name='attendance')
+            WHERE id=NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS attendance_change_update
+        AFTER UPDATE OF employee_id, attendance_date, check_in_time, check_out_time, status, notes ON attendance
+        BEGIN
+            UPDATE change_counter SET seq=seq+1 WHERE name='attendance';
+            UPDATE attendance SET change_seq=(SELECT seq FROM change_counter WHERE name='attendance')
+            WHERE id=NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS attendance_change_delete AFTER DELETE ON attendance
+        BEGIN
+            UPDATE change_counter SET seq=seq+1 WHERE name='attendance';
+            INSERT INTO attendance_tombstones (id, attendance_date, change_seq)
+            SELECT OLD.id, OLD.attendance_date, seq FROM change_counter WHERE name='attendance';
+            DELETE FROM attendance_tombstones WHERE attendance_date < date('now', '-7 day');
+        END;
+    ''')
+    # Analytics rollups (see refresh_attendance_daily): one row per employee and
+    # day, and per employee and week. Attendance writes and shift-start changes
+    # only mark days dirty; a new rollup starts with every day dirty.
+    fresh_rollup = not db.execute("SELECT 1 FROM sqlite_master WHERE name='attendance_daily'").fetchone()
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            attendance_date TEXT NOT NULL,
+            employee_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            sessions INTEGER NOT NULL,
+            first_in INTEGER NOT NULL,
+            start_offset INTEGER,
+            late INTEGER NOT NULL,
+            PRIMARY KEY (attendance_date, employee_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_attendance_daily_employee ON attendance_daily(employee_id, attendance_date);
+        CREATE TABLE IF NOT EXISTS attendance_weekly (
+            week_start TEXT NOT NULL,
+            employee_id INTEGER NOT NULL,
+            present_mask INTEGER NOT NULL,
+            late_mask INTEGER NOT NULL,
+            PRIMARY KEY (week_start, employee_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_attendance_weekly_employee
+            ON attendance_weekly(employee_id, week_start, present_mask, late_mask);
+        CREATE TABLE IF NOT EXISTS attendance_daily_dirty (
+            employee_id INTEGER NOT NULL,
+            attendance_date TEXT NOT NULL,
+            PRIMARY KEY (employee_id, attendance_date)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_insert AFTER INSERT ON attendance
+        BEGIN
+            INSERT OR IGNORE INTO attendance_daily_dirty VALUES (NEW.employee_id, NEW.attendance_date);
+        END;
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_update
+        AFTER UPDATE OF employee_id, attendance_date, check_in_time, status ON attendance
+        BEGIN
+            INSERT OR IGNORE INTO attendance_daily_dirty
+            VALUES (OLD.employee_id, OLD.attendance_date), (NEW.employee_id, NEW.attendance_date);
+        END;
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_delete AFTER DELETE ON attendance
+        BEGIN
+            INSERT OR IGNORE INTO attendance_daily_dirty VALUES (OLD.employee_id, OLD.attendance_date);
+        END;
+        CREATE TRIGGER IF NOT EXISTS attendance_daily_shift AFTER UPDATE OF work_start_time ON employees
+        WHEN OLD.work_start_time IS NOT NEW.work_start_time
+        BEGIN
+            INSERT OR IGNORE INTO attendance_daily_dirty
+            SELECT employee_id, attendance_date FROM attendance_daily WHERE employee_id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS employees_roster_insert AFTER INSERT ON employees
+        BEGIN
+            INSERT INTO settings (key, value) VALUES ('roster_version', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS employees_roster_update AFTER UPDATE OF name, phone, is_active ON employees
+        WHEN OLD.name IS NOT NEW.name OR OLD.phone IS NOT NEW.phone OR OLD.is_active IS NOT NEW.is_active
+        BEGIN
+            INSERT INTO settings (key, value) VALUES ('roster_version', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS employees_roster_delete AFTER DELETE ON employees
+        BEGIN
+            INSERT INTO settings (key, value) VALUES ('roster_version', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        END;
+    ''')
+    if fresh_rollup:
+        db.execute("INSERT OR IGNORE INTO attendance_daily_dirty "
+                   "SELECT DISTINCT employee_id, attendance_date FROM attendance")
+    # Hub mode: rows forwarded by a satellite remember (kiosk id, satellite row id)
+    for table in ('attendance', 'offline_counts'):
+        for col in ("origin TEXT", "origin_id INTEGER"):
+            try:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {col}")
+            except:
+                pass
+        db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_origin ON {table}(origin, origin_id) "
+                   "WHERE origin IS NOT NULL")
     
     db.commit()
+    row = db.execute("SELECT value FROM settings WHERE key='dataset_seed'").fetchone()
+    dataset_seed = row['value'] if row else None
     db.close()
 
+# A check-in without check-out stays open this long; the next punch inside the
+# window is its check-out (possibly after midnight), later ones start a new session
+OPEN_SHIFT_HOURS = 16
+
 def calculate_status(check_in: str, work_start: str, threshold) -> str:
     if not check_in:
         return 'absent'
@@ -244,6 +1169,127 @@ def calculate_status(check_in: str, work_start: str, threshold) -> str:
         print(f"Error logic check late: {e}")
         return 'present'
 
+# ── Login lookup ────────────────────────────
+# Employees type their name or phone on a phone keyboard, so hamza/alef
+# forms, taa marbuta/haa, alef maqsura/yaa, harakat, Arabic-Indic digits and
+# stray spaces all vary. Lookups go through normalized keys held in memory;
+# the employees triggers bump settings.roster_version, and the next lookup
+# after a roster sync or an admin edit rebuilds the index. Prefix and typo
+# matches only feed the type-ahead: a PIN is checked against exact matches
+# alone, so one guess can't be tried on several employees at once.
+LOGIN_SUGGEST_LIMIT = 8
+_ARABIC_FOLD = {
+    **{ord(c): 'ا' for c in 'أإآٱ'},
+    ord('ة'): 'ه', ord('ى'): 'ي', ord('ئ'): 'ي', ord('ؤ'): 'و',
+    **{c: None for c in [0x0640, *range(0x064b, 0x0653), 0x0670]},  # tatweel, harakat
+    **{0x0660 + d: str(d) for d in range(10)},
+    **{0x06f0 + d: str(d) for d in range(10)},
+}
+
+def name_key(text):
+    """Folded, single-spaced form of a name: 'أحمد  صلاح ' and 'احمد صلاح' match."""
+    text = unicodedata.normalize('NFKC', str(text or '')).translate(_ARABIC_FOLD).casefold()
+    return ' '.join(text.split())
+
+def phone_key(text):
+    """Local form of a phone number: '+20 101 234 5678' -> '01012345678'."""
+    digits = ''.join(c for c in name_key(text) if c in '0123456789')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    if digits.startswith('20') and len(digits) == 12:
+        digits = '0' + digits[2:]
+    return digits
+
+def _near_prefix(a, b, limit):
+    """Whether `a` is at most `limit` edits away from some prefix of `b`
+    (the whole of `b` included), so half-typed names with a typo still match."""
+    if len(b) < len(a) - limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return min(previous) <= limit
+
+class LoginIndex:
+    """Active employees by normalized name and phone."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._version = None
+        self._entries = []  # (id, name, compact name key, name words)
+        self._by_name = {}
+        self._by_phone = {}
+
+    def _load(self, db):
+        row = db.execute("SELECT value FROM settings WHERE key='roster_version'").fetchone()
+        version = row['value'] if row else None
+        with self._lock:
+            if self._loaded and version == self._version:
+                return
+            entries, by_name, by_phone = [], {}, {}
+            for emp in db.execute("SELECT id, name, phone FROM employees WHERE is_active=1 ORDER BY name"):
+                key = name_key(emp['name'])
+                compact = key.replace(' ', '')
+                entries.append((emp['id'], emp['name'], compact, key.split()))
+                by_name.setdefault(compact, []).append(emp['id'])
+                phone = phone_key(emp['phone'])
+                if phone:
+                    by_phone.setdefault(phone, []).append(emp['id'])
+            self._entries, self._by_name, self._by_phone = entries, by_name, by_phone
+            self._version, self._loaded = version, True
+
+    def _ranked(self, query, enough):
+        """(rank, name, id) of entries matching `query`: 0 exact, 1 name prefix,
+        2 word prefix, and only while fewer than `enough` matched, 3 for names
+        one or two typos away."""
+        key = name_key(query)
+        compact = key.replace(' ', '')
+        if not compact:
+            return []
+        words = key.split()
+        ranked, rest = [], []
+        for emp_id, name, emp_compact, emp_words in self._entries:
+            if emp_compact == compact:
+                ranked.append((0, name, emp_id))
+            elif emp_compact.startswith(compact):
+                ranked.append((1, name, emp_id))
+            elif all(any(w.startswith(q) for w in emp_words) for q in words):
+                ranked.append((2, name, emp_id))
+            else:
+                rest.append((emp_id, name, emp_compact))
+        if len(ranked) < enough and len(compact) >= 4:
+            limit = 1 if len(compact) < 6 else 2
+            ranked.extend((3, name, emp_id) for emp_id, name, emp_compact in rest
+                          if _near_prefix(compact, emp_compact, limit))
+        ranked.sort()
+        return ranked
+
+    def candidates(self, db, identifier):
+        """Employee ids whose id, phone or normalized name is exactly `identifier`.
+
+        Only more than one for employees who share a name; prefixes and typos
+        never count here (the type-ahead turns them into a full name first).
+        """
+        self._load(db)
+        exact = set(self._by_phone.get(phone_key(identifier), ()))
+        exact.update(self._by_name.get(name_key(identifier).replace(' ', ''), ()))
+        if identifier.isdigit():
+            exact.update(emp_id for emp_id, *_ in self._entries if emp_id == int(identifier))
+        return sorted(exact)
+
+    def suggest(self, db, query, limit=LOGIN_SUGGEST_LIMIT):
+        """Names for type-ahead. Phone numbers are matched at login but never
+        suggested, so the box can't be used to find whose number is whose."""
+        self._load(db)
+        return [{'id': emp_id, 'name': name} for _, name, emp_id in self._ranked(query, limit)[:limit]]
+
+login_index = LoginIndex()
+
 # ── Routes ──────────────────────────────────
 @app.route('/')
 def index():
@@ -290,10 +1336,14 @@ def index():
 def login():
     port = cfg.get('kiosk_port', 8080)
     network_url = f"http://{get_local_ip()}:{port}"
+    employees = reads.do('login_employees', _load_login_employees)
+    return render_template('login.html', employees=employees, company=cfg.get('company_name', 'Suzz'), network_url=network_url)
+
+def _load_login_employees():
     db = get_db()
     employees = db.execute("SELECT id, name FROM employees WHERE is_active=1 ORDER BY name").fetchall()
     db.close()
-    return render_template('login.html', employees=[dict(e) for e in employees], company=cfg.get('company_name', 'Suzz'), network_url=network_url)
+    return [dict(e) for e in employees]
 
 @app.route('/login_and_link', methods=['POST'])
 def login_and_link():
@@ -304,13 +1354,15 @@ def login_and_link():
     
     db = get_db()
     
-    # We strip both sides in Python, but DB might have trailing spaces like "صلاح "
-    if identifier.isdigit():
-        emp = db.execute("SELECT * FROM employees WHERE (TRIM(name)=? OR TRIM(phone)=? OR id=?) AND is_active=1", (identifier, identifier, int(identifier))).fetchone()
-    else:
-        emp = db.execute("SELECT * FROM employees WHERE (TRIM(name)=? OR TRIM(phone)=?) AND is_active=1", (identifier, identifier)).fetchone()
+    # Name/phone spellings vary ("أحمد صلاح " vs "احمد صلاح"); the PIN picks
+    # between employees who share the same name
+    ids = login_index.candidates(db, identifier)
+    placeholders = ','.join('?' * len(ids))
+    matches = [e for e in db.execute(f"SELECT * FROM employees WHERE id IN ({placeholders}) AND is_active=1", ids)
+               if str(e['pin_code']).strip() == pin] if ids else []
+    emp = matches[0] if len(matches) == 1 else None
         
-    if emp and str(emp['pin_code']).strip() == pin:
+    if emp:
         # Check if already linked to another device
         if emp['device_id'] and emp['device_id'] != device_id:
             db.close()
@@ -319,11 +1371,12 @@ def login_and_link():
                 'error': 'هذا الحساب مربوط بجهاز آخر بالفعل. يرجى مراجعة الأدمن لفك الارتباط.'
             }), 403
 
-        # Link device locally
+        # Link device locally; the cloud copy is updated by the outbox worker
         db.execute("UPDATE employees SET device_id=? WHERE id=?", (device_id, emp['id']))
+        enqueue_cloud_mutation(db, 'PUT', f"/api/hr/employees/{emp['id']}", {'device_id': device_id})
         db.commit()
         db.close()
-        try_sync_device_id_to_cloud(emp['id'], device_id)
+        wake_cloud_outbox()
         
         session.permanent = True
         session['employee_id'] = emp['id']
@@ -334,6 +1387,17 @@ def login_and_link():
     db.close()
     return jsonify({'success': False, 'error': 'الاسم/الرقم أو الرمز السري غير صحيح'})
 
+@app.route('/api/login_suggest')
+def login_suggest():
+    """Type-ahead for the login box: active employees whose name matches `q`."""
+    query = request.args.get('q', '')
+    if not name_key(query):
+        return jsonify({'success': True, 'suggestions': []})
+    db = get_db()
+    suggestions = login_index.suggest(db, query)
+    db.close()
+    return jsonify({'success': True, 'suggestions': suggestions})
+
 @app.route('/api/auto_login', methods=['POST'])
 def auto_login():
     data = request.json
@@ -410,6 +1474,12 @@ def save_local_inventory():
 
 @app.route('/api/local/my_counts', methods=['GET'])
 def get_my_counts():
+    """Inventory counts, newest first, as a JSON list.
+
+    Filters: count_date | start_date+end_date, employee_id (admin only), shift.
+    `items=0` returns item counts without the item lists. With `limit`, the
+    X-Next-Cursor header carries the id to pass as `cursor` for the next page.
+    """
     admin_pin = request.args.get('admin_pin')
     db = get_db()
     
@@ -424,18 +1494,28 @@ def get_my_counts():
         db.close()
         return jsonify({'error': 'Unauthorized'}), 401
     
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    count_date = request.args.get('count_date')
-    employee_id = request.args.get('employee_id')
+    try:
+        start_date = _date_arg(request.args, 'start_date')
+        end_date = _date_arg(request.args, 'end_date')
+        count_date = _date_arg(request.args, 'count_date')
+        employee_id = _int_arg(request.args, 'employee_id')
+        cursor = _int_arg(request.args, 'cursor')
+        limit = _int_arg(request.args, 'limit')
+    except ValueError as e:
+        db.close()
+        return jsonify({'success': False, 'error': str(e)}), 400
     no_date = request.args.get('no_date') == '1'
-    limit = request.args.get('limit')
+    shift = request.args.get('shift')
+    with_items = request.args.get('items') != '0'
     
     if not is_admin:
         employee_id = session.get('employee_id')
     
-    query = '''
-        SELECT oc.id, oc.created_at, oc.count_date, oc.items_json, oc.shift, oc.branch, e.name as employee_name
+    # Without items, count them in SQLite instead of shipping the JSON to Python
+    items_column = "oc.items_json" if with_items else (
+        "CASE WHEN json_valid(oc.items_json) THEN json_array_length(oc.items_json) ELSE 0 END AS item_count")
+    query = f'''
+        SELECT oc.id, oc.created_at, oc.count_date, {items_column}, oc.shift, oc.branch, e.name as employee_name
         FROM offline_counts oc
         JOIN employees e ON oc.employee_id = e.id
         WHERE 1=1
@@ -454,45 +1534,58 @@ def get_my_counts():
         params.append(date.today().isoformat())
         
     if employee_id:
-        try:
-            query += " AND oc.employee_id = ?"
-            params.append(int(employee_id))
-        except:
-            pass
+        query += " AND oc.employee_id = ?"
+        params.append(employee_id)
+    if shift:
+        query += " AND oc.shift = ?"
+        params.append(shift)
+    if cursor:
+        query += " AND oc.id < ?"
+        params.append(cursor)
         
     query += " ORDER BY oc.id DESC"
     
-    if limit:
-        try:
-            query += " LIMIT ?"
-            params.append(int(limit))
-        except:
-            pass
+    page_size = limit
+    if page_size:
+        query += " LIMIT ?"
+        params.append(page_size + 1)
     
     counts = db.execute(query, params).fetchall()
     db.close()
+    next_cursor = None
+    if page_size and len(counts) > page_size:
+        counts = counts[:page_size]
+        next_cursor = counts[-1]['id']
     
     result = []
     for c in counts:
-        try:
-            items = json.loads(c['items_json'] or '[]')
-            item_count = len(items)
-        except:
-            items = []
-            item_count = 0
+        if not with_items:
+            items, item_count = None, c['item_count']
+        else:
+            try:
+                items = json.loads(c['items_json'] or '[]')
+                item_count = len(items)
+            except:
+                items = []
+                item_count = 0
             
-        result.append({
+        entry = {
             'id': c['id'],
             'created_at': c['created_at'],
             'count_date': c['count_date'],
             'employee_name': c['employee_name'],
             'items_counted': item_count,
-            'items': items,
             'branch': c['branch'],
             'shift': c['shift']
-        })
+        }
+        if with_items:
+            entry['items'] = items
+        result.append(entry)
         
-    return jsonify(result)
+    resp = jsonify(result)
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = str(next_cursor)
+    return resp
 
 @app.route('/link_device', methods=['POST'])
 def link_device():
@@ -512,13 +1605,12 @@ def link_device():
         db.close()
         return jsonify({'success': False, 'message': 'الرمز السري غير صحيح'}), 401
         
-    # Correct PIN. Link the device locally.
+    # Correct PIN. Link the device locally and queue the cloud update.
     db.execute("UPDATE employees SET device_id=? WHERE id=?", (device_id, emp_id))
+    enqueue_cloud_mutation(db, 'PUT', f"/api/hr/employees/{emp_id}", {'device_id': device_id})
     db.commit()
     db.close()
-    
-    # We will also try to sync this device_id to the cloud
-    try_sync_device_id_to_cloud(emp_id, device_id)
+    wake_cloud_outbox()
     
     return jsonify({
         'success': True,
@@ -545,40 +1637,6 @@ def verify_link():
     is_linked = emp and emp['device_id'] == dev_id
     return jsonify({'linked': bool(is_linked)})
 
-def try_sync_device_id_to_cloud(emp_id, device_id):
-    if not REQUESTS_OK or not has_internet():
-        return
-    cloud_url = cfg.get('cloud_base_url', '').rstrip('/')
-    if not cloud_url:
-        return
-    try:
-        # We only update the device_id in the cloud to avoid overwriting other fields
-        requests.put(
-            f"{cloud_url}/api/hr/employees/{emp_id}",
-            json={'device_id': device_id},
-            headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
-            timeout=5
-        )
-    except:
-        pass
-
-def try_unlink_device_on_cloud(emp_id):
-    if not REQUESTS_OK or not has_internet():
-        return
-    cloud_url = cfg.get('cloud_base_url', '').rstrip('/')
-    if not cloud_url:
-        return
-    try:
-        requests.put(
-            f"{cloud_url}/api/hr/employees/{emp_id}",
-            json={'device_id': None},
-            headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
-            timeout=5
-        )
-    except Exception as e:
-        print(f"Error unlinking on cloud: {e}")
-
-
 @app.route('/checkin', methods=['POST'])
 def checkin():
     try:
@@ -612,11 +1670,12 @@ def checkin():
                 db.close()
                 return jsonify({'error': 'الرمز السري (PIN) غير صحيح'}), 403
 
-        # Find latest session globally for this employee
+        # Find latest session globally for this employee (by date/time, since
+        # sessions pulled from the cloud can arrive with newer local ids)
         existing = db.execute("""
             SELECT * FROM attendance 
             WHERE employee_id = ? 
-            ORDER BY id DESC LIMIT 1
+            ORDER BY attendance_date DESC, check_in_time DESC, id DESC LIMIT 1
         """, (emp_id,)).fetchone()
         
         now_dt = datetime.now()
@@ -624,12 +1683,12 @@ def checkin():
         is_open_shift_valid = False
         if existing and not existing['check_out_time']:
             try:
-                # Check if the open shift is within 16 hours
+                # Check if the open shift is within OPEN_SHIFT_HOURS
                 ci_date_str = existing['attendance_date']
                 ci_time_str = existing['check_in_time'][:5]
                 ci_dt = datetime.strptime(f"{ci_date_str} {ci_time_str}", "%Y-%m-%d %H:%M")
                 
-                if (now_dt - ci_dt).total_seconds() <= 16 * 3600:
+                if (now_dt - ci_dt).total_seconds() <= OPEN_SHIFT_HOURS * 3600:
                     is_open_shift_valid = True
             except:
                 pass
@@ -654,10 +1713,10 @@ def checkin():
             # the single-record "resume" logic but without the "re-check in" text.
             
             if not existing:
-                db.execute(
-                    """INSERT INTO attendance (employee_id, attendance_date, check_in_time, status, synced)
-                       VALUES (?,?,?,?,0)""",
-                    (emp_id, today, now_time, status)
+                cur = db.execute(
+                    """INSERT INTO attendance (employee_id, attendance_date, check_in_time, status, synced, updated_at)
+                       VALUES (?,?,?,?,0,?)""",
+                    (emp_id, today, now_time, status, now_dt.isoformat())
                 )
             else:
                 # If we're starting a "new cycle" but constraint exists, 
@@ -665,27 +1724,30 @@ def checkin():
                 # keep the original check_in_time? 
                 # User asked to: "ظهرلك تسجيل حضور طبيعي وبعدها يتسجل فالسيستم انك سجلت حضور تاني وانصراف"
                 # This implies separate records. I will remove the UNIQUE constraint.
-                db.execute(
-                    """INSERT INTO attendance (employee_id, attendance_date, check_in_time, status, synced)
-                       VALUES (?,?,?,?,0)""",
-                    (emp_id, today, now_time, status)
+                cur = db.execute(
+                    """INSERT INTO attendance (employee_id, attendance_date, check_in_time, status, synced, updated_at)
+                       VALUES (?,?,?,?,0,?)""",
+                    (emp_id, today, now_time, status, now_dt.isoformat())
                 )
+            record_id = cur.lastrowid
             action = 'check_in'
         else:
             # Second punch = check-out
             db.execute(
-                "UPDATE attendance SET check_out_time=?, synced=0 WHERE id=?",
-                (now_time, existing['id'])
+                "UPDATE attendance SET check_out_time=?, synced=0, updated_at=? WHERE id=?",
+                (now_time, now_dt.isoformat(), existing['id'])
             )
+            record_id = existing['id']
             action = 'check_out'
 
         db.commit()
-        record = db.execute(
-            "SELECT * FROM attendance WHERE employee_id=? ORDER BY id DESC LIMIT 1",
-            (emp_id,)
-        ).fetchone()
+        attendance_changed()
+        record = db.execute("SELECT * FROM attendance WHERE id=?", (record_id,)).fetchone()
         db.close()
 
+        events.publish('punch', {**dict(record), 'action': action,
+                                 'name': emp['name'], 'job_title': emp['job_title']})
+        publish_sync_status()
         # Trigger immediate sync to Supabase (non-blocking)
         threading.Thread(target=_quick_sync, daemon=True).start()
 
@@ -707,17 +1769,121 @@ def api_employees():
     db.close()
     return jsonify([dict(e) for e in employees])
 
+# Bumped by attendance_changed() after every committed attendance write in
+# this process. Coalesced reads of attendance are keyed on it: a caller only
+# joins a read that started after its own committed punch, never one that
+# may predate it.
+attendance_generation = 0
+_generation_lock = threading.Lock()
+
+def attendance_changed():
+    global attendance_generation
+    with _generation_lock:
+        attendance_generation += 1
+
 @app.route('/api/today')
 def api_today():
-    db = get_db()
     today = date.today().isoformat()
+    return jsonify(reads.do(('today', today, attendance_generation), lambda: _load_today(today)))
+
+def _load_today(today):
+    db = get_db()
     attendance = db.execute(
         """SELECT a.*, e.name, e.job_title FROM attendance a
            JOIN employees e ON a.employee_id=e.id
            WHERE a.attendance_date=? ORDER BY a.check_in_time""", (today,)
     ).fetchall()
     db.close()
-    return jsonify([dict(r) for r in attendance])
+    return [dict(r) for r in attendance]
+
+TODAY_DELTA_LIMIT = 500
+
+@app.route('/api/today/delta')
+def api_today_delta():
+    """Today's attendance changed since `cursor`.
+
+    Returns {rows, deleted, cursor, reset, more}. Without a cursor, or with one
+    from another day or another database, `reset` is true and `rows` is the
+    whole day. Pass the returned cursor back on the next poll; while `more` is
+    true, poll again right away.
+    """
+    today = date.today().isoformat()
+    cursor = request.args.get('cursor') or ''
+    # Screens polling in step mostly send the same cursor
+    return jsonify(reads.do(('today_delta', today, cursor, attendance_generation),
+                            lambda: _load_today_delta(today, cursor)))
+
+def _load_today_delta(today, cursor):
+    cursor_date, _, cursor_seq = cursor.partition(':')
+    db = get_db()
+    # Read the counter first: rows committed after this are picked up next poll
+    head = db.execute("SELECT seq FROM change_counter WHERE name='attendance'").fetchone()['seq']
+    try:
+        since = int(cursor_seq)
+    except ValueError:
+        since = None
+    reset = cursor_date != today or since is None or since > head
+    if reset:
+        since = 0
+
+    rows = db.execute(
+        """SELECT a.*, e.name, e.job_title FROM attendance a
+           JOIN employees e ON a.employee_id=e.id
+           WHERE a.attendance_date=? AND a.change_seq > ? AND a.change_seq <= ?
+           ORDER BY a.change_seq LIMIT ?""",
+        (today, since, head, TODAY_DELTA_LIMIT)
+    ).fetchall()
+    more = len(rows) == TODAY_DELTA_LIMIT
+    upto = rows[-1]['change_seq'] if more else head
+    deleted = [] if reset else [r['id'] for r in db.execute(
+        "SELECT id FROM attendance_tombstones WHERE attendance_date=? AND change_seq > ? AND change_seq <= ?",
+        (today, since, upto)
+    ).fetchall()]
+    db.close()
+    return {
+        'rows': [dict(r) for r in rows],
+        'deleted': deleted,
+        'cursor': f"{today}:{upto}",
+        'reset': reset,
+        'more': more,
+    }
+
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events: 'punch', 'sync_progress', 'sync_status' (sent first) and 'resync'.
+
+    Admin only (`admin_pin`).
+    """
+    db = get_db()
+    pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    if request.args.get('admin_pin') != (pin_row['value'] if pin_row else '1234'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    q = events.subscribe(int(cfg.get('sse_max_clients', 32)))
+    if q is None:
+        return jsonify({'error': 'عدد الشاشات المتصلة كبير، حاول لاحقاً'}), 503, {'Retry-After': '30'}
+    try:
+        status = get_sync_status()
+    except Exception:
+        events.unsubscribe(q)
+        raise
+    first = [events.frame('sync_status', {'unsynced_count': status['unsynced_count'],
+                                          'outbox_pending': status['outbox_pending'],
+                                          'last_sync': status['last_sync']})]
+    return Response(
+        events.stream(q, first, heartbeat=float(cfg.get('sse_heartbeat_seconds', 15))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/sync_status')
+def api_sync_status():
+    """Backlog counts for the sync bar on an employee's phone (coalesced)."""
+    if not session.get('employee_id'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    status = get_sync_status()
+    return jsonify({'success': True, 'unsynced_count': status['unsynced_count'],
+                    'outbox_pending': status['outbox_pending']})
 
 @app.route('/api/network-info')
 def network_info():
@@ -742,30 +1908,142 @@ def admin():
         return "غير مصرح لك بالدخول", 401
 
     today = date.today().isoformat()
-    # Support filtering in the backend, or just send everything to frontend
-    # Since it's a kiosk, sending all attendance is fine for local SQLite
+    # Attendance and counts are fetched page by page from /api/admin/attendance
+    # and /api/local/my_counts; only the (small) roster is rendered here
     employees = db.execute("SELECT * FROM employees ORDER BY name").fetchall()
-    all_attendance = db.execute(
-        """SELECT a.*, e.name, e.job_title FROM attendance a
-           JOIN employees e ON a.employee_id=e.id
-           ORDER BY a.attendance_date DESC, e.name"""
-    ).fetchall()
     unsynced = db.execute("SELECT COUNT(*) as cnt FROM attendance WHERE synced=0").fetchone()
-    sync_logs = db.execute("SELECT * FROM sync_log ORDER BY id DESC LIMIT 10").fetchall()
-    products = db.execute("SELECT id, name FROM products WHERE active=1 ORDER BY category, name").fetchall()
     db.close()
     
     return render_template('admin.html',
         employees=[dict(e) for e in employees],
-        all_attendance=[dict(r) for r in all_attendance],
         unsynced_count=unsynced['cnt'],
-        sync_logs=[dict(r) for r in sync_logs],
         today=today,
         company=cfg.get('company_name', 'Suzz'),
         pin=pin,
-        products=[dict(p) for p in products]
     )
 
+# ── Admin data API (keyset pagination) ──────
+# Lists are returned newest first in pages of `limit` rows. `next_cursor` is
+# the sort key of the last row ("<key>:<id>"); pass it back as `cursor` for
+# the next page, so deep pages cost the same as the first.
+ADMIN_PAGE_SIZE = 100
+ADMIN_PAGE_MAX = 500
+ATTENDANCE_STATUSES = ('present', 'late', 'absent')
+
+def _admin_pin_ok(pin):
+    db = get_db()
+    pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    return pin == (pin_row['value'] if pin_row else '1234')
+
+def _int_arg(args, name):
+    """An optional positive integer query argument, or None. Raises ValueError."""
+    if not args.get(name):
+        return None
+    try:
+        value = int(args[name])
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return value
+
+def _page_limit(default=ADMIN_PAGE_SIZE):
+    """`limit` capped at ADMIN_PAGE_MAX. Raises ValueError."""
+    limit = _int_arg(request.args, 'limit')
+    return default if limit is None else min(ADMIN_PAGE_MAX, limit)
+
+def _parse_cursor(raw):
+    """'<key>:<id>' -> (key, id), or None when absent. The key may itself
+    contain ':'. Raises ValueError for anything that isn't a cursor."""
+    if not raw:
+        return None
+    key, sep, row_id = raw.rpartition(':')
+    try:
+        if not sep or not key:
+            raise ValueError
+        return key, int(row_id)
+    except ValueError:
+        raise ValueError("malformed cursor")
+
+def _date_arg(args, name):
+    """An optional YYYY-MM-DD query argument, or None. Raises ValueError."""
+    if not args.get(name):
+        return None
+    try:
+        return date.fromisoformat(args[name]).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+
+def _page(rows, limit, key):
+    """Trim a limit+1 fetch to one page; returns (rows, next_cursor or None)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, f"{rows[-1][key] or ''}:{rows[-1]['id']}"
+
+def _attendance_filters(args, alias=''):
+    """WHERE clauses + params for start_date/end_date/employee_id/status. Raises ValueError."""
+    where, params = [], []
+    start_date, end_date = _date_arg(args, 'start_date'), _date_arg(args, 'end_date')
+    if start_date:
+        where.append(f"{alias}attendance_date >= ?")
+        params.append(start_date)
+    if end_date:
+        where.append(f"{alias}attendance_date <= ?")
+        params.append(end_date)
+    if args.get('employee_id'):
+        where.append(f"{alias}employee_id = ?")
+        params.append(_int_arg(args, 'employee_id'))
+    if args.get('status'):
+        if args['status'] not in ATTENDANCE_STATUSES:
+            raise ValueError(f"status must be one of {', '.join(ATTENDANCE_STATUSES)}")
+        where.append(f"{alias}status = ?")
+        params.append(args['status'])
+    return where, params
+
+@app.route('/api/admin/attendance')
+def admin_attendance():
+    """One page of attendance joined with the employee, filtered server-side.
+
+    Query: admin_pin, start_date, end_date, employee_id, status, cursor, limit.
+    The first page (no cursor) also carries `total` and `late` for the filter.
+    """
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    try:
+        where, params = _attendance_filters(request.args, 'a.')
+        cursor = _parse_cursor(request.args.get('cursor'))
+        limit = _page_limit()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    page_where = list(where)
+    page_params = list(params)
+    if cursor:
+        page_where.append("(a.attendance_date < ? OR (a.attendance_date = ? AND a.id < ?))")
+        page_params.extend([cursor[0], cursor[0], cursor[1]])
+
+    db = get_db()
+    rows = db.execute(
+        f"""SELECT a.*, e.name, e.job_title FROM attendance a
+            JOIN employees e ON a.employee_id=e.id
+            {'WHERE ' + ' AND '.join(page_where) if page_where else ''}
+            ORDER BY a.attendance_date DESC, a.id DESC LIMIT ?""",
+        page_params + [limit + 1]
+    ).fetchall()
+    result = {'success': True}
+    if not cursor:
+        totals = db.execute(
+            f"""SELECT COUNT(*) AS total, COALESCE(SUM(a.status='late'), 0) AS late FROM attendance a
+                {'WHERE ' + ' AND '.join(where) if where else ''}""",
+            params
+        ).fetchone()
+        result.update(total=totals['total'], late=totals['late'])
+    db.close()
+    rows, next_cursor = _page([dict(r) for r in rows], limit, 'attendance_date')
+    result.update(rows=rows, next_cursor=next_cursor)
+    return jsonify(result)
+
 @app.route('/api/admin/employee/update', methods=['POST'])
 def admin_update_employee():
     try:
@@ -791,21 +2069,12 @@ def admin_update_employee():
             SET name=?, job_title=?, phone=?, pin_code=?, can_view_inventory=?
             WHERE id=?
         """, (name, job_title, phone, pin_code, can_view_inventory, emp_id))
+        # Queue the update for the cloud so it's not overwritten by background sync
+        enqueue_cloud_mutation(db, 'PUT', f"/api/hr/employees/{emp_id}",
+                               {'name': name, 'job_title': job_title, 'phone': phone, 'pin_code': pin_code})
         db.commit()
         db.close()
-        
-        # Sync update to cloud so it's not overwritten by background sync
-        cloud_url = cfg.get('cloud_base_url', '').rstrip('/')
-        if cloud_url and has_internet():
-            try:
-                requests.put(
-                    f"{cloud_url}/api/hr/employees/{emp_id}",
-                    json={'name': name, 'job_title': job_title, 'phone': phone, 'pin_code': pin_code},
-                    headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
-                    timeout=5
-                )
-            except:
-                pass
+        wake_cloud_outbox()
                 
         return jsonify({'success': True})
     except Exception as e:
@@ -826,11 +2095,11 @@ def admin_unlink_employee():
             return jsonify({'success': False, 'error': 'Unauthorized'}), 401
             
         db.execute("UPDATE employees SET device_id = NULL WHERE id = ?", (emp_id,))
+        # Unlink on cloud too
+        enqueue_cloud_mutation(db, 'PUT', f"/api/hr/employees/{emp_id}", {'device_id': None})
         db.commit()
         db.close()
-        
-        # Unlink on cloud too
-        try_unlink_device_on_cloud(emp_id)
+        wake_cloud_outbox()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -838,18 +2107,24 @@ def admin_unlink_employee():
 
 @app.route('/api/admin/employee/history/<int:emp_id>')
 def admin_employee_history(emp_id):
+    """An employee's attendance and counts in [start_date, end_date], newest first.
+
+    Both lists are paged (`limit`, default ADMIN_PAGE_SIZE): pass the returned
+    `attendance_cursor` / `counts_cursor` back to get the next page of each.
+    Cloud payments/purchases are only looked up for the first page.
+    """
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    try:
+        start_date = _date_arg(request.args, 'start_date')
+        end_date = _date_arg(request.args, 'end_date')
+        attendance_cursor = _parse_cursor(request.args.get('attendance_cursor'))
+        counts_cursor = _parse_cursor(request.args.get('counts_cursor'))
+        limit = _page_limit()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     try:
-        admin_pin = request.args.get('admin_pin')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
         db = get_db()
-        admin_pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
-        expected_pin = admin_pin_row['value'] if admin_pin_row else '1234'
-        if admin_pin != expected_pin:
-            db.close()
-            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
-            
         emp = db.execute("SELECT pin_code FROM employees WHERE id=?", (emp_id,)).fetchone()
         emp_pin = str(emp['pin_code']).strip() if emp else '0000'
             
@@ -862,8 +2137,12 @@ def admin_employee_history(emp_id):
         if end_date:
             query += " AND attendance_date <= ?"
             params.append(end_date)
+        if attendance_cursor:
+            query += " AND (attendance_date < ? OR (attendance_date = ? AND id < ?))"
+            params.extend([attendance_cursor[0], attendance_cursor[0], attendance_cursor[1]])
             
-        query += " ORDER BY attendance_date DESC, id DESC"
+        query += " ORDER BY attendance_date DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
         
         history = db.execute(query, params).fetchall()
         
@@ -875,37 +2154,53 @@ def admin_employee_history(emp_id):
         if end_date:
             counts_query += " AND count_date <= ?"
             counts_params.append(end_date)
+        if counts_cursor:
+            counts_query += " AND (COALESCE(created_at, '') < ? OR (COALESCE(created_at, '') = ? AND id < ?))"
+            counts_params.extend([counts_cursor[0], counts_cursor[0], counts_cursor[1]])
         
-        counts_query += " ORDER BY created_at DESC"
+        counts_query += " ORDER BY COALESCE(created_at, '') DESC, id DESC LIMIT ?"
+        counts_params.append(limit + 1)
         counts = db.execute(counts_query, counts_params).fetchall()
         
         db.close()
         
-        cloud_data = {'payments': [], 'purchases': []}
-        cloud_url = cfg.get('cloud_base_url', '').rstrip('/')
-        if cloud_url and has_internet() and start_date:
-            month = start_date[:7]
-            try:
-                resp = requests.get(
-                    f"{cloud_url}/api/employee/profile?pin={emp_pin}&month={month}",
-                    timeout=5
-                )
-                if resp.status_code == 200:
-                    c_data = resp.json()
-                    cloud_data['payments'] = c_data.get('payments', [])
-                    cloud_data['purchases'] = c_data.get('purchases', [])
-            except:
-                pass
-                
+        # Cloud payments/purchases come from the cache; a miss or stale entry is
+        # refreshed in the background and picked up via /cloud/<emp_id>.
+        cloud_data, cloud_status = {'payments': [], 'purchases': []}, 'unavailable'
+        if start_date and not attendance_cursor and not counts_cursor:
+            cloud_data, cloud_status = get_cloud_profile(emp_id, emp_pin, start_date[:7])
+
+        history, next_attendance = _page([dict(r) for r in history], limit, 'attendance_date')
+        counts, next_counts = _page([dict(r) for r in counts], limit, 'created_at')
         return jsonify({
             'success': True, 
-            'attendance': [dict(r) for r in history],
-            'inventory_counts': [dict(r) for r in counts],
-            'cloud_data': cloud_data
+            'attendance': history,
+            'inventory_counts': counts,
+            'attendance_cursor': next_attendance,
+            'counts_cursor': next_counts,
+            'cloud_data': cloud_data,
+            'cloud_status': cloud_status
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/admin/employee/cloud/<int:emp_id>')
+def admin_employee_cloud(emp_id):
+    """Cached cloud payments/purchases, polled by the history modal after a miss."""
+    admin_pin = request.args.get('admin_pin')
+    month = request.args.get('month', date.today().isoformat()[:7])
+    db = get_db()
+    admin_pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    expected_pin = admin_pin_row['value'] if admin_pin_row else '1234'
+    if admin_pin != expected_pin:
+        db.close()
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    emp = db.execute("SELECT pin_code FROM employees WHERE id=?", (emp_id,)).fetchone()
+    db.close()
+    emp_pin = str(emp['pin_code']).strip() if emp else '0000'
+    cloud_data, cloud_status = get_cloud_profile(emp_id, emp_pin, month)
+    return jsonify({'success': True, 'cloud_data': cloud_data, 'cloud_status': cloud_status})
+
 @app.route('/api/admin/inventory/details/<int:count_id>')
 def admin_inventory_details(count_id):
     try:
@@ -943,11 +2238,11 @@ def unlink_employee_device():
         
         # Remove device_id from local db
         db.execute("UPDATE employees SET device_id=NULL WHERE id=?", (emp_id,))
+        # Unlink on cloud too
+        enqueue_cloud_mutation(db, 'PUT', f"/api/hr/employees/{emp_id}", {'device_id': None})
         db.commit()
         db.close()
-        
-        # Unlink on cloud too
-        try_unlink_device_on_cloud(emp_id)
+        wake_cloud_outbox()
         return jsonify({'success': True})
     except Exception as e:
         print(f"Error unlinking device locally: {e}")
@@ -955,40 +2250,1763 @@ def unlink_employee_device():
 
 @app.route('/sync_now', methods=['POST'])
 def sync_now():
+    if sync_mode() == 'satellite':
+        return jsonify(push_to_hub())
     result = sync_attendance_to_supabase()
     return jsonify(result)
 
 @app.route('/refresh_employees', methods=['POST'])
 def refresh_employees():
+    if sync_mode() == 'satellite':
+        return jsonify(pull_from_hub())
     result = sync_employees_from_cloud()
     return jsonify(result)
 
+# ── Worked hours ────────────────────────────
+# Each attendance row is one session: check-in on attendance_date, check-out
+# the same day or, when it reads earlier than the check-in, the day after.
+# Sessions are measured against the employee's shift (work_start_time to
+# work_end_time, which may wrap past midnight) on their shift day; a check-in
+# more than 12 h before the shift start belongs to the previous day's shift
+# (00:30 on a 17:00-01:00 shift). Per shift day:
+#   worked    minutes of closed sessions; open ones (and any longer than
+#             OPEN_SHIFT_HOURS, e.g. after an HR edit) count as unpaired
+#   late      shift start to first check-in, once past the late threshold
+#   overtime  past work_end_time at the last check-out
+#   off day   everything worked on an off day (no late/overtime there)
+#   absent    a past working day with no session (active employees only)
+# SQLite parses the times into integer columns; the per-day grouping runs on
+# numpy arrays when numpy is installed and on plain dicts otherwise.
+HOURS_MAX_DAYS = 400
+HOURS_FIELDS = ('sessions', 'unpaired_sessions', 'days_worked', 'worked_minutes', 'overtime_minutes',
+                'late_minutes', 'late_days', 'off_day_minutes', 'off_days_worked', 'absent_days')
+_NO_TIME = -10 ** 6
+
+def _clock_minutes(value, default):
+    try:
+        h, m = str(value)[:5].split(':')
+        return int(h) * 60 + int(m)
+    except ValueError:
+        return default
+
+def _hours_schedules(db, employee_id=None):
+    """Column lists (ordered by id) of each employee's shift, in minutes."""
+    sql = """SELECT id, name, job_title, work_start_time, work_end_time, late_threshold_minutes,
+                    off_days, is_active FROM employees"""
+    rows = db.execute(sql + (" WHERE id=? ORDER BY id" if employee_id else " ORDER BY id"),
+                      (employee_id,) if employee_id else ()).fetchall()
+    default_start = _clock_minutes(cfg.get('work_start_time'), 9 * 60)
+    default_end = _clock_minutes(cfg.get('work_end_time'), 17 * 60)
+    sched = {k: [] for k in ('id', 'start', 'span', 'threshold', 'off_mask', 'active', 'info')}
+    for r in rows:
+        start = _clock_minutes(r['work_start_time'], default_start)
+        try:
+            off_days = json.loads(r['off_days'] or '[]')
+        except ValueError:
+            off_days = []
+        sched['id'].append(r['id'])
+        sched['start'].append(start)
+        sched['span'].append((_clock_minutes(r['work_end_time'], default_end) - start) % 1440)
+        sched['threshold'].append(int(r['late_threshold_minutes'] or 0))
+        sched['off_mask'].append(sum(1 << d for d in set(off_days) if isinstance(d, int) and 0 <= d < 7))
+        sched['active'].append(bool(r['is_active']))
+        sched['info'].append({'employee_id': r['id'], 'name': r['name'], 'job_title': r['job_title'],
+                              'work_start_time': r['work_start_time'], 'work_end_time': r['work_end_time']})
+    return sched
+
+def _hours_sessions(db, start, end, employee_id=None):
+    """(employee_id, day index from `start`, check-in minute, check-out minute or -1) per session."""
+    sql = """SELECT employee_id,
+                    CAST(julianday(attendance_date) - julianday(?) AS INTEGER),
+                    CAST(substr(check_in_time, 1, 2) AS INTEGER) * 60 + CAST(substr(check_in_time, 4, 2) AS INTEGER),
+                    COALESCE(CAST(substr(NULLIF(check_out_time, ''), 1, 2) AS INTEGER) * 60
+                             + CAST(substr(check_out_time, 4, 2) AS INTEGER), -1)
+             FROM attendance
+             WHERE attendance_date BETWEEN ? AND ? AND check_in_time > ''
+               AND julianday(attendance_date) IS NOT NULL"""
+    params = [start.isoformat(), start.isoformat(), end.isoformat()]
+    if employee_id:
+        sql += " AND employee_id = ?"
+        params.append(employee_id)
+    cur = db.cursor()
+    cur.row_factory = None
+    return cur.execute(sql, params).fetchall()
+
+def _hours_numpy(sessions, sched, ndays, first_weekday, closed_days, daily=False):
+    """Per-employee sums (and per-day records when `daily`), grouped with array ops."""
+    n = len(sched['id'])
+    ids = np.array(sched['id'], dtype=np.int64)
+    shift_start = np.array(sched['start'], dtype=np.int64)
+    span = np.array(sched['span'], dtype=np.int64)[:, None]
+    threshold = np.array(sched['threshold'], dtype=np.int64)[:, None]
+    off_mask = np.array(sched['off_mask'], dtype=np.int64)[:, None]
+    active = np.array(sched['active'], dtype=bool)[:, None]
+
+    a = np.fromiter(itertools.chain.from_iterable(sessions), dtype=np.int64, count=4 * len(sessions)).reshape(-1, 4)
+    emp = np.minimum(np.searchsorted(ids, a[:, 0]), n - 1)
+    known = ids[emp] == a[:, 0]
+    a, emp = a[known], emp[known]
+    day, check_in, check_out = a[:, 1], a[:, 2], a[:, 3]
+    rel = check_in - shift_start[emp]
+    back = rel < -720
+    rel, day = rel + back * 1440, day - back
+    keep = (day >= 0) & (day < ndays)
+    emp, day, check_in, check_out, rel = emp[keep], day[keep], check_in[keep], check_out[keep], rel[keep]
+    duration = (check_out - check_in) % 1440
+    paired = (check_out >= 0) & (duration <= OPEN_SHIFT_HOURS * 60)
+
+    size = n * ndays
+    group = emp * ndays + day
+    count = np.bincount(group, minlength=size).reshape(n, ndays)
+    unpaired = np.bincount(group[~paired], minlength=size).reshape(n, ndays)
+    worked = np.bincount(group[paired], weights=duration[paired], minlength=size).astype(np.int64).reshape(n, ndays)
+    first = np.full(size, -_NO_TIME, dtype=np.int64)
+    np.minimum.at(first, group, rel)
+    first = first.reshape(n, ndays)
+    last = np.full(size, _NO_TIME, dtype=np.int64)
+    np.maximum.at(last, group[paired], rel[paired] + duration[paired])
+    last = last.reshape(n, ndays)
+
+    weekday = (first_weekday + np.arange(ndays)) % 7
+    off = ((off_mask >> weekday[None, :]) & 1).astype(bool)
+    present = count > 0
+    workday = present & ~off
+    late = np.where(workday & (first > threshold), first, 0)
+    overtime = np.where(workday & (span > 0), np.maximum(last - span, 0), 0)
+    off_worked = np.where(off, worked, 0)
+    absent = ~present & ~off & (np.arange(ndays) < closed_days)[None, :] & active
+
+    sums = {
+        'sessions': count.sum(axis=1), 'unpaired_sessions': unpaired.sum(axis=1),
+        'days_worked': present.sum(axis=1), 'worked_minutes': worked.sum(axis=1),
+        'overtime_minutes': overtime.sum(axis=1), 'late_minutes': late.sum(axis=1),
+        'late_days': (late > 0).sum(axis=1), 'off_day_minutes': off_worked.sum(axis=1),
+        'off_days_worked': (present & off).sum(axis=1), 'absent_days': absent.sum(axis=1),
+    }
+    sums = {k: v.tolist() for k, v in sums.items()}
+    if not daily:
+        return sums, []
+    i, d = np.nonzero(present)
+    days = zip(i.tolist(), d.tolist(), count[i, d].tolist(), unpaired[i, d].tolist(), first[i, d].tolist(),
+               last[i, d].tolist(), worked[i, d].tolist(), overtime[i, d].tolist(), late[i, d].tolist(),
+               off[i, d].tolist())
+    return sums, list(days)
+
+def _hours_python(sessions, sched, ndays, first_weekday, closed_days, daily=False):
+    """Same result as _hours_numpy, for kiosks without numpy."""
+    index = {emp_id: i for i, emp_id in enumerate(sched['id'])}
+    groups = {}
+    for emp_id, day, check_in, check_out in sessions:
+        i = index.get(emp_id)
+        if i is None:
+            continue
+        rel = check_in - sched['start'][i]
+        if rel < -720:
+            rel, day = rel + 1440, day - 1
+        if not 0 <= day < ndays:
+            continue
+        grp = groups.setdefault((i, day), [0, 0, -_NO_TIME, _NO_TIME, 0])
+        grp[0] += 1
+        grp[2] = min(grp[2], rel)
+        duration = (check_out - check_in) % 1440
+        if check_out >= 0 and duration <= OPEN_SHIFT_HOURS * 60:
+            grp[3] = max(grp[3], rel + duration)
+            grp[4] += duration
+        else:
+            grp[1] += 1
+
+    n = len(sched['id'])
+    sums = {k: [0] * n for k in HOURS_FIELDS}
+    attended = [0] * n
+    days = []
+    for (i, day), (count, unpaired, first, last, worked) in sorted(groups.items()):
+        off = bool(sched['off_mask'][i] >> ((first_weekday + day) % 7) & 1)
+        span = sched['span'][i]
+        late = first if not off and first > sched['threshold'][i] else 0
+        overtime = max(last - span, 0) if not off and span > 0 else 0
+        for key, value in (('sessions', count), ('unpaired_sessions', unpaired), ('days_worked', 1),
+                           ('worked_minutes', worked), ('overtime_minutes', overtime), ('late_minutes', late),
+                           ('late_days', int(late > 0)), ('off_day_minutes', worked if off else 0),
+                           ('off_days_worked', int(off))):
+            sums[key][i] += value
+        if not off and day < closed_days:
+            attended[i] += 1
+        if daily:
+            days.append((i, day, count, unpaired, first, last, worked, overtime, late, off))
+
+    per_weekday = [0] * 7
+    for day in range(closed_days):
+        per_weekday[(first_weekday + day) % 7] += 1
+    for i in range(n):
+        if sched['active'][i]:
+            scheduled = sum(c for wd, c in enumerate(per_weekday) if not sched['off_mask'][i] >> wd & 1)
+            sums['absent_days'][i] = scheduled - attended[i]
+    return sums, days
+
+def compute_worked_hours(db, start, end, employee_id=None, daily=False, today=None):
+    """Worked, overtime, late, off-day and absent totals per employee for
+    start..end (dates, inclusive), plus per-day rows when `daily`."""
+    ndays = (end - start).days + 1
+    if not 1 <= ndays <= HOURS_MAX_DAYS:
+        raise ValueError(f"date range must be 1..{HOURS_MAX_DAYS} days")
+    sched = _hours_schedules(db, employee_id)
+    # The day after `end` too: its early check-ins may close out a night shift
+    sessions = _hours_sessions(db, start, end + timedelta(days=1), employee_id)
+    closed_days = max(0, min(ndays, ((today or date.today()) - start).days))
+    engine = _hours_numpy if np is not None else _hours_python
+    if sched['id']:
+        sums, days = engine(sessions, sched, ndays, start.toordinal() % 7, closed_days, daily)
+    else:
+        sums, days = {}, []
+
+    employees = []
+    for i, info in enumerate(sched['info']):
+        row = {k: int(sums[k][i]) for k in HOURS_FIELDS}
+        if not sched['active'][i] and not row['sessions']:
+            continue
+        employees.append({**info, **row, 'worked_hours': round(row['worked_minutes'] / 60, 2),
+                          'overtime_hours': round(row['overtime_minutes'] / 60, 2)})
+    employees.sort(key=lambda e: e['name'] or '')
+    result = {
+        'engine': 'numpy' if np is not None else 'python',
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'employees': employees,
+        'totals': {k: sum(e[k] for e in employees) for k in HOURS_FIELDS},
+    }
+    if daily:
+        def clock(i, rel):
+            m = (sched['start'][i] + rel) % 1440
+            return f"{m // 60:02d}:{m % 60:02d}"
+        result['days'] = [{
+            'employee_id': sched['id'][i],
+            'date': (start + timedelta(days=day)).isoformat(),
+            'sessions': count,
+            'unpaired_sessions': unpaired,
+            'first_check_in': clock(i, first),
+            'last_check_out': clock(i, last) if last != _NO_TIME else None,
+            'worked_minutes': worked,
+            'overtime_minutes': overtime,
+            'late_minutes': late,
+            'off_day': bool(off),
+        } for i, day, count, unpaired, first, last, worked, overtime, late, off in days]
+    return result
+
+@app.route('/api/admin/hours')
+def admin_hours():
+    """Worked-hours report for payroll.
+
+    Query: admin_pin, start_date (default: first of this month), end_date
+    (default: today), employee_id, daily=1 for per-day rows.
+    """
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    today = date.today()
+    try:
+        start = date.fromisoformat(request.args.get('start_date') or today.replace(day=1).isoformat())
+        end = date.fromisoformat(request.args.get('end_date') or today.isoformat())
+        employee_id = int(request.args['employee_id']) if request.args.get('employee_id') else None
+        started = time.perf_counter()
+        db = get_db()
+        try:
+            report = compute_worked_hours(db, start, end, employee_id,
+                                          daily=request.args.get('daily') == '1', today=today)
+        finally:
+            db.close()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify({'success': True, **report})
+
+# ── Attendance analytics ────────────────────
+# Aggregates run on two rollups rather than on attendance:
+#   attendance_daily   per employee and day: weekday (0=Sunday, like
+#                      off_days), sessions, first check-in (minutes after
+#                      midnight), its offset from the shift start (-720..719)
+#                      and whether that first session was 'late'
+#   attendance_weekly  per employee and week (weeks start on Sunday); bit d of
+#                      present_mask / late_mask is weekday d
+# Triggers only mark (employee, day) pairs dirty, so punches stay cheap; each
+# analytics request first recomputes the dirty days and their weeks. Rates
+# count working days up to yesterday, using the employee's current off_days.
+ANALYTICS_DEFAULT_DAYS = 84
+
+_CHECK_IN_MINUTES = "CAST(substr(a.check_in_time, 1, 2) AS INTEGER) * 60 + CAST(substr(a.check_in_time, 4, 2) AS INTEGER)"
+_SHIFT_START_MINUTES = "CAST(substr(e.work_start_time, 1, 2) AS INTEGER) * 60 + CAST(substr(e.work_start_time, 4, 2) AS INTEGER)"
+
+def _week_of(column):
+    return f"date({column}, printf('-%d days', CAST(strftime('%w', {column}) AS INTEGER)))"
+
+def refresh_attendance_daily(db, rebuild=False):
+    """Bring both rollups up to date: recompute the dirty days and their weeks
+    (every day when `rebuild`). Returns the number of days recomputed."""
+    if not rebuild and not db.execute("SELECT 1 FROM attendance_daily_dirty LIMIT 1").fetchone():
+        return 0
+    # IMMEDIATE: a punch landing mid-refresh waits instead of being dropped from the dirty set
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # A concurrent request may have refreshed while this one waited for the lock
+        if not rebuild and not db.execute("SELECT 1 FROM attendance_daily_dirty LIMIT 1").fetchone():
+            db.rollback()
+            return 0
+        if rebuild:
+            db.execute("DELETE FROM attendance_daily")
+            db.execute("DELETE FROM attendance_weekly")
+            days, weeks = "attendance a", "attendance_daily d"
+        else:
+            db.execute("""DELETE FROM attendance_daily WHERE (employee_id, attendance_date) IN
+                          (SELECT employee_id, attendance_date FROM attendance_daily_dirty)""")
+            db.execute(f"""DELETE FROM attendance_weekly WHERE (employee_id, week_start) IN
+                           (SELECT employee_id, {_week_of('attendance_date')} FROM attendance_daily_dirty)""")
+            days = """attendance_daily_dirty x JOIN attendance a
+                      ON a.employee_id = x.employee_id AND a.attendance_date = x.attendance_date"""
+            weeks = f"""(SELECT DISTINCT employee_id, {_week_of('attendance_date')} AS week_start
+                         FROM attendance_daily_dirty) w
+                        JOIN attendance_daily d ON d.employee_id = w.employee_id
+                         AND d.attendance_date BETWEEN w.week_start AND date(w.week_start, '+6 days')"""
+        cur = db.execute(f"""
+            INSERT INTO attendance_daily (attendance_date, employee_id, weekday, sessions, first_in, start_offset, late)
+            SELECT a.attendance_date, a.employee_id, CAST(strftime('%w', a.attendance_date) AS INTEGER), COUNT(*),
+                   MIN({_CHECK_IN_MINUTES}), (MIN({_CHECK_IN_MINUTES}) - ({_SHIFT_START_MINUTES}) + 2160) % 1440 - 720,
+                   a.status = 'late'
+            FROM {days} LEFT JOIN employees e ON e.id = a.employee_id
+            WHERE a.check_in_time > '' AND strftime('%w', a.attendance_date) IS NOT NULL
+            GROUP BY a.attendance_date, a.employee_id""")
+        refreshed = cur.rowcount
+        db.execute(f"""
+            INSERT INTO attendance_weekly (week_start, employee_id, present_mask, late_mask)
+            SELECT {_week_of('d.attendance_date')}, d.employee_id, SUM(1 << d.weekday), SUM(d.late << d.weekday)
+            FROM {weeks}
+            GROUP BY 1, 2""")
+        db.execute("DELETE FROM attendance_daily_dirty")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return refreshed
+
+def _analytics_request():
+    """(start, end, employee_id) from the query string; raises ValueError."""
+    end = date.fromisoformat(request.args.get('end_date') or date.today().isoformat())
+    start = date.fromisoformat(request.args.get('start_date')
+                               or (end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)).isoformat())
+    if start > end:
+        raise ValueError("start_date is after end_date")
+    employee_id = int(request.args['employee_id']) if request.args.get('employee_id') else None
+    return start, end, employee_id
+
+def _analytics_employees(db, employee_id=None):
+    rows = db.execute("SELECT id, name, job_title, off_days, is_active FROM employees"
+                      + (" WHERE id=?" if employee_id else ""), (employee_id,) if employee_id else ()).fetchall()
+    employees = {}
+    for r in rows:
+        try:
+            off_days = json.loads(r['off_days'] or '[]')
+        except ValueError:
+            off_days = []
+        employees[r['id']] = {
+            'employee_id': r['id'], 'name': r['name'], 'job_title': r['job_title'], 'active': bool(r['is_active']),
+            'off_mask': sum(1 << d for d in set(off_days) if isinstance(d, int) and 0 <= d < 7),
+        }
+    return employees
+
+def _weeks(start, end):
+    """(week start, mask of its weekdays inside start..end) for each week overlapping the range."""
+    week = start - timedelta(days=start.toordinal() % 7)
+    weeks = []
+    while week <= end:
+        weeks.append((week, sum(1 << d for d in range(7) if start <= week + timedelta(days=d) <= end)))
+        week += timedelta(days=7)
+    return weeks
+
+def _rollup_where(column, start, end, employee_id):
+    where, params = f"{column} BETWEEN ? AND ?", [start.isoformat(), end.isoformat()]
+    if employee_id:
+        where += " AND employee_id = ?"
+        params.append(employee_id)
+    return where, params
+
+def _bits(mask):
+    return bin(mask).count('1')
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+def _analytics_endpoint(fn):
+    """PIN check, query parsing, rollup refresh and timing for the analytics routes."""
+    @functools.wraps(fn)
+    def wrapper():
+        if not _admin_pin_ok(request.args.get('admin_pin')):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        try:
+            start, end, employee_id = _analytics_request()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        started = time.perf_counter()
+        db = get_db()
+        try:
+            refresh_attendance_daily(db)
+            result = fn(db, start, end, employee_id)
+        finally:
+            db.close()
+        return jsonify({'success': True, 'start_date': start.isoformat(), 'end_date': end.isoformat(), **result,
+                        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)})
+    return wrapper
+
+@app.route('/api/admin/analytics/lateness')
+@_analytics_endpoint
+def analytics_lateness(db, start, end, employee_id):
+    """Late rate per employee and weekday (the heatmap), most often late first."""
+    weeks = _weeks(start, end)
+    (first, first_mask), (last, last_mask) = weeks[0], weeks[-1]
+    # The first and last weeks only count their days inside the range
+    in_range = "CASE week_start WHEN ? THEN ? WHEN ? THEN ? ELSE 127 END"
+    edges = [first.isoformat(), first_mask, last.isoformat(), last_mask]
+    where, params = _rollup_where('week_start', first, last, employee_id)
+    sums = ', '.join(f"SUM((p >> {d}) & 1), SUM((l >> {d}) & 1)" for d in range(7))
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(f"""SELECT employee_id, {sums} FROM (
+                        SELECT employee_id, present_mask & {in_range} AS p, late_mask & {in_range} AS l
+                        FROM attendance_weekly WHERE {where})
+                    GROUP BY employee_id""", edges + edges + params)
+    employees = _analytics_employees(db, employee_id)
+    rows = []
+    for emp_id, *counts in cur.fetchall():
+        emp = employees.get(emp_id)
+        if emp is None or not sum(counts):
+            continue
+        weekdays = [{'days': counts[2 * d], 'late': counts[2 * d + 1], 'rate': _rate(counts[2 * d + 1], counts[2 * d])}
+                    for d in range(7)]
+        days, late = sum(counts[0::2]), sum(counts[1::2])
+        rows.append({
+            'employee_id': emp_id, 'name': emp['name'], 'job_title': emp['job_title'],
+            'off_days': [d for d in range(7) if emp['off_mask'] >> d & 1],
+            'days': days, 'late': late, 'rate': _rate(late, days), 'weekdays': weekdays,
+        })
+    rows.sort(key=lambda r: (-(r['rate'] or 0), r['name'] or ''))
+    totals = []
+    for d in range(7):
+        days = sum(r['weekdays'][d]['days'] for r in rows)
+        late = sum(r['weekdays'][d]['late'] for r in rows)
+        totals.append({'days': days, 'late': late, 'rate': _rate(late, days)})
+    return {'employees': rows, 'weekdays': totals}
+
+@app.route('/api/admin/analytics/weekly')
+@_analytics_endpoint
+def analytics_weekly(db, start, end, employee_id):
+    """Attended, absent and late working days per week, with rates."""
+    employees = _analytics_employees(db, employee_id)
+    weeks = _weeks(start, min(end, date.today() - timedelta(days=1)))
+    if not weeks:
+        return {'weeks': []}
+    where, params = _rollup_where('week_start', weeks[0][0], weeks[-1][0], employee_id)
+    cur = db.cursor()
+    cur.row_factory = None
+    present = {}
+    for week, emp_id, present_mask, late_mask in cur.execute(
+            f"SELECT week_start, employee_id, present_mask, late_mask FROM attendance_weekly WHERE {where}", params):
+        present.setdefault(week, []).append((emp_id, present_mask, late_mask))
+    # Active employees are expected on every working day, whether or not they came
+    active_off = {}
+    for emp in employees.values():
+        if emp['active']:
+            active_off[emp['off_mask']] = active_off.get(emp['off_mask'], 0) + 1
+
+    rows = []
+    for week, open_mask in weeks:
+        scheduled = sum(n * _bits(open_mask & ~off) for off, n in active_off.items())
+        attended = late = off_day_work = 0
+        for emp_id, present_mask, late_mask in present.get(week.isoformat(), ()):
+            emp = employees.get(emp_id)
+            if emp is None:
+                continue
+            working = open_mask & ~emp['off_mask']
+            if not emp['active']:
+                scheduled += _bits(working)
+            attended += _bits(present_mask & working)
+            late += _bits(late_mask & working)
+            off_day_work += _bits(present_mask & open_mask & emp['off_mask'])
+        rows.append({
+            'week_start': week.isoformat(), 'scheduled_days': scheduled, 'attended_days': attended,
+            'absent_days': scheduled - attended, 'late_days': late, 'off_day_work': off_day_work,
+            'attendance_rate': _rate(attended, scheduled), 'late_rate': _rate(late, attended),
+        })
+    return {'weeks': rows}
+
+@app.route('/api/admin/analytics/first_punch')
+@_analytics_endpoint
+def analytics_first_punch(db, start, end, employee_id):
+    """Histograms of the day's first check-in, by clock time and by offset
+    from the shift start (negative = early). `bucket` is in minutes."""
+    try:
+        bucket = max(5, min(120, int(request.args.get('bucket', 15))))
+    except ValueError:
+        bucket = 15
+    where, params = _rollup_where('attendance_date', start, end, employee_id)
+    clock = db.execute(f"""SELECT first_in / ? * ? AS minute, COUNT(*) AS days, SUM(late) AS late
+                           FROM attendance_daily WHERE {where} GROUP BY minute ORDER BY minute""",
+                       [bucket, bucket] + params).fetchall()
+    shift = db.execute(f"""SELECT (start_offset + 720) / ? * ? - 720 AS minute, COUNT(*) AS days, SUM(late) AS late
+                           FROM attendance_daily WHERE {where} AND start_offset IS NOT NULL
+                           GROUP BY minute ORDER BY minute""",
+                       [bucket, bucket] + params).fetchall()
+    return {'bucket_minutes': bucket, 'clock': [dict(r) for r in clock], 'shift': [dict(r) for r in shift]}
+
+@app.route('/api/admin/analytics/absences')
+@_analytics_endpoint
+def analytics_absences(db, start, end, employee_id):
+    """Absent working days and absence streaks (consecutive working days
+    missed; off days in between don't break a streak) per active employee.
+    Days before an employee's first punch don't count, so someone who just
+    joined doesn't show the whole range as absent. Streaks shorter than
+    `min_streak` (default 2) are not listed."""
+    try:
+        min_streak = max(1, int(request.args.get('min_streak', 2)))
+    except ValueError:
+        min_streak = 2
+    employees = {k: v for k, v in _analytics_employees(db, employee_id).items() if v['active']}
+    weeks = _weeks(start, min(end, date.today() - timedelta(days=1)))
+    present = {}
+    if weeks:
+        where, params = _rollup_where('week_start', weeks[0][0], weeks[-1][0], employee_id)
+        cur = db.cursor()
+        cur.row_factory = None
+        for week, emp_id, present_mask in cur.execute(
+                f"SELECT week_start, employee_id, present_mask FROM attendance_weekly WHERE {where}", params):
+            present[(week, emp_id)] = present_mask
+    first_punch = dict(db.execute(
+        "SELECT id, (SELECT MIN(attendance_date) FROM attendance_daily WHERE employee_id = e.id) FROM employees e"
+        + (" WHERE id=?" if employee_id else ""), (employee_id,) if employee_id else ()).fetchall())
+
+    rows = []
+    for emp_id, emp in employees.items():
+        if not first_punch.get(emp_id):
+            continue
+        first = date.fromisoformat(first_punch[emp_id])
+        streaks, run = [], None  # run: [days, first day, last day]
+        for week, open_mask in weeks:
+            if week + timedelta(days=6) < first:
+                continue
+            if week < first:
+                open_mask &= ~((1 << (first - week).days) - 1)
+            working = open_mask & ~emp['off_mask']
+            absent = working & ~present.get((week.isoformat(), emp_id), 0)
+            if not absent:
+                if working and run is not None:
+                    streaks.append(run)
+                    run = None
+                continue
+            if absent == working:
+                if run is None:
+                    run = [0, week + timedelta(days=(absent & -absent).bit_length() - 1), None]
+                run[0] += _bits(absent)
+                run[2] = week + timedelta(days=absent.bit_length() - 1)
+                continue
+            for d in range(7):
+                if not working >> d & 1:
+                    continue
+                if absent >> d & 1:
+                    if run is None:
+                        run = [0, week + timedelta(days=d), None]
+                    run[0] += 1
+                    run[2] = week + timedelta(days=d)
+                elif run is not None:
+                    streaks.append(run)
+                    run = None
+        current = run[0] if run else 0
+        if run:
+            streaks.append(run)
+        streaks = [{'days': n, 'from': a.isoformat(), 'to': b.isoformat()} for n, a, b in streaks]
+        rows.append({
+            'employee_id': emp_id, 'name': emp['name'], 'job_title': emp['job_title'],
+            'absent_days': sum(s['days'] for s in streaks),
+            'longest_streak': max(streaks, key=lambda s: s['days'], default=None),
+            'current_streak': current,
+            'streaks': [s for s in streaks if s['days'] >= min_streak],
+        })
+    rows.sort(key=lambda r: (-r['absent_days'], r['name'] or ''))
+    return {'employees': rows}
+
+# ── Exports (streaming CSV / XLSX) ──────────
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+STATUS_LABELS = {'present': 'حاضر', 'late': 'متأخر', 'absent': 'غائب'}
+SHIFT_LABELS = {'morning': 'صباحي', 'evening': 'مسائي', 'night': 'ليلي'}
+# Text starting with one of these runs as a formula when the file is opened
+# (names, notes and item names are typed in by employees), so it's quoted
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Markup escapes, and characters XML 1.0 can't carry at all (Excel would reject the sheet)
+_XML_ESCAPES = {**{c: None for c in [*range(0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0xfffe, 0xffff]},
+                ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;'}
+
+class _ExportSheet:
+    """One table of an export: a title, header row and the query that fills it.
+
+    `convert` maps a result tuple to the row written out (defaults to as-is);
+    text cells that would start a formula then get a leading quote.
+    """
+    def __init__(self, title, headers, sql, params=(), convert=None):
+        self.title = title
+        self.headers = headers
+        self.sql = sql
+        self.params = params
+        self.convert = convert
+
+    def chunks(self, db):
+        """The query's rows, EXPORT_CHUNK_ROWS at a time, straight off the cursor."""
+        cur = db.cursor()
+        cur.row_factory = None
+        cur.execute(self.sql, self.params)
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                return
+            if self.convert:
+                rows = [self.convert(r) for r in rows]
+            yield [[f"'{v}" if type(v) is str and v.startswith(FORMULA_PREFIXES) else v for v in r]
+                   for r in rows]
+
+def _csv_stream(db, sheets):
+    """CSV bytes per chunk. Several sheets become titled sections in one file."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')  # BOM, so Excel reads the Arabic as UTF-8
+    for n, sheet in enumerate(sheets):
+        if len(sheets) > 1:
+            if n:
+                writer.writerow([])
+            writer.writerow([sheet.title])
+        writer.writerow(sheet.headers)
+        for rows in sheet.chunks(db):
+            writer.writerows(rows)
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+class _DrainBuffer:
+    """Write-only, unseekable file for zipfile: the bytes written so far are
+    taken out with drain(), so the archive never sits in memory whole."""
+    def __init__(self):
+        self.parts = []
+        self.offset = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+def _xml_text(value):
+    return str(value).translate(_XML_ESCAPES)
+
+def _xlsx_column(n):
+    """0 -> A, 25 -> Z, 26 -> AA."""
+    name = ''
+    n += 1
+    while n:
+        n, r = divmod(n - 1, 26)
+        name = chr(65 + r) + name
+    return name
+
+def _xlsx_row(number, values, columns):
+    cells = []
+    for col, value in zip(columns, values):
+        if value is None or value == '':
+            continue
+        if type(value) in (int, float):
+            cells.append(f'<c r="{col}{number}"><v>{value}</v></c>')
+        else:
+            cells.append(f'<c r="{col}{number}" t="inlineStr"><is><t xml:space="preserve">'
+                         f'{_xml_text(value)}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+def _xlsx_stream(db, sheets):
+    """A minimal SpreadsheetML workbook, deflated and yielded chunk by chunk.
+
+    Inline strings instead of a shared-strings table keep it one pass; the
+    sheets are right-to-left with a frozen header row.
+    """
+    ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+    rel_ns = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    pkg_ns = 'http://schemas.openxmlformats.org/package/2006/relationships'
+    head = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    numbers = range(1, len(sheets) + 1)
+    buf = _DrainBuffer()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', head + (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for n in numbers)
+            + '</Types>'))
+        zf.writestr('_rels/.rels', head + (
+            f'<Relationships xmlns="{pkg_ns}">'
+            f'<Relationship Id="rId1" Type="{rel_ns}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        zf.writestr('xl/workbook.xml', head + (
+            f'<workbook xmlns="{ns}" xmlns:r="{rel_ns}"><sheets>'
+            + ''.join(f'<sheet name="{_xml_text(s.title[:31])}" sheetId="{n}" r:id="rId{n}"/>'
+                      for n, s in zip(numbers, sheets))
+            + '</sheets></workbook>'))
+        zf.writestr('xl/_rels/workbook.xml.rels', head + (
+            f'<Relationships xmlns="{pkg_ns}">'
+            + ''.join(f'<Relationship Id="rId{n}" Type="{rel_ns}/worksheet" Target="worksheets/sheet{n}.xml"/>'
+                      for n in numbers)
+            + '</Relationships>'))
+        yield buf.drain()
+        for n, sheet in zip(numbers, sheets):
+            columns = [_xlsx_column(i) for i in range(len(sheet.headers))]
+            # force_zip64: the sheet's final size isn't known up front
+            with zf.open(f'xl/worksheets/sheet{n}.xml', 'w', force_zip64=True) as part:
+                part.write((head + f'<worksheet xmlns="{ns}"><sheetViews>'
+                            '<sheetView workbookViewId="0" rightToLeft="1">'
+                            '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                            '</sheetView></sheetViews><sheetData>'
+                            + _xlsx_row(1, sheet.headers, columns)).encode('utf-8'))
+                number = 1
+                for rows in sheet.chunks(db):
+                    lines = []
+                    for row in rows:
+                        number += 1
+                        lines.append(_xlsx_row(number, row, columns))
+                    part.write(''.join(lines).encode('utf-8'))
+                    yield buf.drain()
+                part.write(b'</sheetData></worksheet>')
+            yield buf.drain()
+    yield buf.drain()
+
+def _export_response(fmt, filename, sheets):
+    """Stream `sheets` as a CSV/XLSX download; rows are read while sending."""
+    stream = _xlsx_stream if fmt == 'xlsx' else _csv_stream
+
+    def generate():
+        db = get_db()
+        try:
+            for data in stream(db, sheets):
+                if data:
+                    yield data
+        finally:
+            db.close()
+
+    return Response(generate(), mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{fmt}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+
+def _export_format():
+    fmt = (request.args.get('format') or 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+def _export_attendance_row(row):
+    """Session length in minutes (past midnight when out < in), labels for status."""
+    row = list(row)
+    check_in, check_out = row[3], row[4]
+    if check_in and check_out:
+        start, end = _clock_minutes(check_in, None), _clock_minutes(check_out, None)
+        if start is not None and end is not None:
+            row[5] = (end - start) % 1440
+    row[6] = STATUS_LABELS.get(row[6], row[6])
+    row[8] = 'نعم' if row[8] else 'لا'
+    return row
+
+EXPORT_ATTENDANCE_HEADERS = ['التاريخ', 'الموظف', 'الوظيفة', 'الحضور', 'الانصراف', 'المدة (دقيقة)',
+                             'الحالة', 'ملاحظات', 'متزامن', 'رقم الموظف', 'رقم السجل']
+EXPORT_COUNT_HEADERS = ['التاريخ', 'الوردية', 'الفرع', 'الموظف', 'وقت التسجيل', 'الصنف', 'الكمية',
+                        'رقم الجرد', 'رقم الموظف']
+
+def _attendance_sheet(where, params, title='الحضور'):
+    return _ExportSheet(title, EXPORT_ATTENDANCE_HEADERS, f'''
+        SELECT a.attendance_date, e.name, e.job_title, a.check_in_time, a.check_out_time, NULL,
+               a.status, a.notes, a.synced, a.employee_id, a.id
+        FROM attendance a
+        LEFT JOIN employees e ON e.id = a.employee_id
+        {('WHERE ' + ' AND '.join(where)) if where else ''}
+        ORDER BY a.attendance_date, a.id
+    ''', params, _export_attendance_row)
+
+def _counts_sheet(where, params, title='الجرد'):
+    """One row per counted item; a count with no items still gets a row."""
+    return _ExportSheet(title, EXPORT_COUNT_HEADERS, f'''
+        SELECT oc.count_date, oc.shift, oc.branch, e.name, oc.created_at,
+               COALESCE(json_extract(i.value, '$.item_name'), json_extract(i.value, '$.name')),
+               json_extract(i.value, '$.quantity'), oc.id, oc.employee_id
+        FROM offline_counts oc
+        LEFT JOIN employees e ON e.id = oc.employee_id
+        LEFT JOIN json_each(CASE WHEN json_valid(oc.items_json) THEN oc.items_json ELSE '[]' END) i
+        {('WHERE ' + ' AND '.join(where)) if where else ''}
+        ORDER BY oc.count_date, oc.id
+    ''', params, lambda r: (r[0], SHIFT_LABELS.get(r[1], r[1])) + r[2:])
+
+def _counts_filters(args):
+    """WHERE clauses + params for start_date/end_date/employee_id/shift. Raises ValueError."""
+    where, params = [], []
+    start_date, end_date = _date_arg(args, 'start_date'), _date_arg(args, 'end_date')
+    if start_date:
+        where.append("oc.count_date >= ?")
+        params.append(start_date)
+    if end_date:
+        where.append("oc.count_date <= ?")
+        params.append(end_date)
+    if args.get('employee_id'):
+        where.append("oc.employee_id = ?")
+        params.append(_int_arg(args, 'employee_id'))
+    if args.get('shift'):
+        where.append("oc.shift = ?")
+        params.append(args['shift'])
+    return where, params
+
+def _export_name(kind):
+    args = request.args
+    span = '_'.join(v for v in (args.get('start_date'), args.get('end_date')) if v)
+    return f"{kind}_{span or date.today().isoformat()}"
+
+@app.route('/api/admin/export/attendance')
+def export_attendance():
+    """Attendance with employee names as CSV or XLSX, streamed.
+
+    Query: admin_pin, format=csv|xlsx, start_date, end_date, employee_id, status.
+    """
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    try:
+        fmt = _export_format()
+        where, params = _attendance_filters(request.args, 'a.')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return _export_response(fmt, _export_name('attendance'), [_attendance_sheet(where, params)])
+
+@app.route('/api/admin/export/counts')
+def export_counts():
+    """Inventory counts, one row per item, as CSV or XLSX, streamed.
+
+    Query: admin_pin, format=csv|xlsx, start_date, end_date, employee_id, shift.
+    """
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    try:
+        fmt = _export_format()
+        where, params = _counts_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return _export_response(fmt, _export_name('counts'), [_counts_sheet(where, params)])
+
+@app.route('/api/admin/export/employee/<int:employee_id>')
+def export_employee(employee_id):
+    """One employee's attendance and inventory counts, streamed.
+
+    Query: admin_pin, format=csv|xlsx, start_date, end_date. XLSX gets a
+    sheet for each; CSV puts them one after the other as titled sections.
+    """
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    args = {k: request.args.get(k) for k in ('start_date', 'end_date')}
+    args['employee_id'] = employee_id
+    try:
+        fmt = _export_format()
+        att_where, att_params = _attendance_filters(args, 'a.')
+        count_where, count_params = _counts_filters(args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    db = get_db()
+    exists = db.execute("SELECT 1 FROM employees WHERE id = ?", (employee_id,)).fetchone()
+    db.close()
+    if not exists:
+        return jsonify({'success': False, 'error': 'Employee not found'}), 404
+    return _export_response(fmt, _export_name(f'employee_{employee_id}'), [
+        _attendance_sheet(att_where, att_params), _counts_sheet(count_where, count_params)])
+
+# ── Backlog gauges & metrics endpoints ──────
+def _age_seconds(ts):
+    if not ts:
+        return 0
+    try:
+        return max(0, int((datetime.now() - datetime.fromisoformat(ts)).total_seconds()))
+    except ValueError:
+        return 0
+
+def collect_sync_backlog():
+    """Unsynced row counts and the age of the oldest unsynced row per table."""
+    db = get_db()
+    att = db.execute(
+        "SELECT COUNT(*) AS cnt, MIN(attendance_date || 'T' || COALESCE(check_in_time, '00:00')) AS oldest "
+        "FROM attendance WHERE synced=0"
+    ).fetchone()
+    counts = db.execute("SELECT COUNT(*) AS cnt, MIN(created_at) AS oldest FROM offline_counts WHERE synced=0").fetchone()
+    outbox = db.execute("SELECT COUNT(*) AS cnt, MIN(created_at) AS oldest FROM cloud_outbox WHERE status='pending'").fetchone()
+    last_sync = db.execute("SELECT MAX(synced_at) AS ts FROM sync_log WHERE success=1").fetchone()
+    db.close()
+    return {
+        'attendance': {'count': att['cnt'], 'oldest_age_seconds': _age_seconds(att['oldest'])},
+        'offline_counts': {'count': counts['cnt'], 'oldest_age_seconds': _age_seconds(counts['oldest'])},
+        'cloud_outbox': {'count': outbox['cnt'], 'oldest_age_seconds': _age_seconds(outbox['oldest'])},
+        'last_sync_age_seconds': _age_seconds(last_sync['ts']) if last_sync['ts'] else None,
+    }
+
+Gauge('kiosk_sqlite_query_calls', 'Executions per normalized statement (see /api/admin/sql_stats for the SQL).',
+      lambda: {(('query', sql_fingerprint(q)),): st['count'] for q, st in sql_stats_snapshot().items()})
+Gauge('kiosk_sqlite_query_seconds', 'Total execute + fetch time per normalized statement.',
+      lambda: {(('query', sql_fingerprint(q)),): round(st['total'], 6) for q, st in sql_stats_snapshot().items()})
+Gauge('kiosk_sqlite_query_rows', 'Rows returned or changed per normalized statement.',
+      lambda: {(('query', sql_fingerprint(q)),): st['rows'] for q, st in sql_stats_snapshot().items()})
+
+Gauge('kiosk_sync_backlog', 'Rows waiting to be synced by table.',
+      lambda backlog: {(('table', t),): v['count'] for t, v in backlog.items() if isinstance(v, dict)},
+      source=collect_sync_backlog)
+Gauge('kiosk_sync_oldest_unsynced_age_seconds', 'Age of the oldest unsynced row by table.',
+      lambda backlog: {(('table', t),): v['oldest_age_seconds'] for t, v in backlog.items() if isinstance(v, dict)},
+      source=collect_sync_backlog)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text format. Scrapers send the sync key
+    (`Authorization: Bearer <sync_api_key>`); the admin page link `admin_pin`."""
+    sync_key = cfg.get('sync_api_key', '')
+    if not (sync_key and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {sync_key}')):
+        db = get_db()
+        pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+        db.close()
+        if request.args.get('admin_pin') != (pin_row['value'] if pin_row else '1234'):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/metrics')
+def admin_metrics():
+    """Compact JSON summary of the metrics for the admin dashboard panel."""
+    admin_pin = request.args.get('admin_pin')
+    db = get_db()
+    admin_pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    expected_pin = admin_pin_row['value'] if admin_pin_row else '1234'
+    if admin_pin != expected_pin:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    def summarize(histogram, label):
+        rows = []
+        for key, series in histogram.snapshot().items():
+            labels = dict(key)
+            rows.append({
+                label: labels.get(label),
+                'count': series[-1],
+                'avg_ms': round(series[-2] / series[-1] * 1000, 1) if series[-1] else 0,
+                'p50_ms': round(histogram.quantile(series, 0.5) * 1000, 1),
+                'p95_ms': round(histogram.quantile(series, 0.95) * 1000, 1),
+            })
+        return sorted(rows, key=lambda r: r['p95_ms'], reverse=True)
+
+    runs = {}
+    for key, value in SYNC_RUNS.snapshot().items():
+        labels = dict(key)
+        runs.setdefault(labels['stage'], {})[labels['outcome']] = value
+    sync_stages = summarize(SYNC_STAGE_SECONDS, 'stage')
+    for row in sync_stages:
+        row['outcomes'] = runs.get(row['stage'], {})
+
+    return jsonify({
+        'success': True,
+        'sync_stages': sync_stages,
+        'cloud_requests': summarize(CLOUD_REQUEST_SECONDS, 'target'),
+        'routes': summarize(HTTP_REQUEST_SECONDS, 'route')[:10],
+        'sqlite': summarize(SQLITE_STATEMENT_SECONDS, 'kind'),
+        'retries': {dict(k)['kind']: v for k, v in SYNC_RETRIES.snapshot().items()},
+        'bytes': {dict(k)['direction']: v for k, v in SYNC_BYTES.snapshot().items()},
+        'backlog': collect_sync_backlog(),
+    })
+
+@app.route('/api/admin/sql_stats', methods=['GET', 'POST'])
+def admin_sql_stats():
+    """Statements by total time (or ?sort=count|max|rows|avg). POST {reset: true} clears them."""
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    admin_pin = data.get('admin_pin') or request.args.get('admin_pin')
+    db = get_db()
+    pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    if admin_pin != (pin_row['value'] if pin_row else '1234'):
+        return jsonify({'success': False, 'error': 'PIN الأدمن غير صحيح'}), 401
+
+    if data.get('reset'):
+        with _sql_stats_lock:
+            _sql_stats.clear()
+    statements = [
+        {
+            'query': sql_fingerprint(sql),
+            'sql': sql,
+            'count': st['count'],
+            'total_ms': round(st['total'] * 1000, 2),
+            'avg_ms': round(st['total'] / st['count'] * 1000, 3) if st['count'] else 0,
+            'max_ms': round(st['max'] * 1000, 2),
+            'rows': st['rows'],
+            'rows_per_call': round(st['rows'] / st['count'], 1) if st['count'] else 0,
+        }
+        for sql, st in sql_stats_snapshot().items()
+    ]
+    sort = request.args.get('sort', 'total')
+    sort_key = {'count': 'count', 'max': 'max_ms', 'rows': 'rows', 'avg': 'avg_ms'}.get(sort, 'total_ms')
+    statements.sort(key=lambda r: r[sort_key], reverse=True)
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'success': True, 'statements': statements[:limit], 'distinct': len(statements)})
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """Per-route timing breakdown and recent slow requests. POST {enabled, slow_ms} to change."""
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    admin_pin = data.get('admin_pin') or request.args.get('admin_pin')
+    db = get_db()
+    pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    if admin_pin != (pin_row['value'] if pin_row else '1234'):
+        return jsonify({'success': False, 'error': 'PIN الأدمن غير صحيح'}), 401
+
+    if request.method == 'POST':
+        # Runtime only; set profiling_enabled in config.json to keep it on
+        if 'enabled' in data:
+            cfg['profiling_enabled'] = bool(data['enabled'])
+        if data.get('slow_ms'):
+            cfg['profiling_slow_ms'] = float(data['slow_ms'])
+    return jsonify({
+        'success': True,
+        'enabled': bool(cfg.get('profiling_enabled')),
+        'slow_ms': cfg.get('profiling_slow_ms', 500),
+        'routes': profiling_summary(),
+        'slow': list(reversed(_slow_requests))[:50],
+    })
+
+# ── CPU Sampling Profiler ───────────────────
+# For field diagnosis of the frozen EXE: sample every thread's Python stack
+# (sys._current_frames) at a fixed interval for a few seconds and aggregate
+# identical stacks. Output is Brendan Gregg's collapsed format
+# ("thread;outer;...;leaf count") or a self-contained flamegraph page.
+CPU_PROFILE_MAX_SECONDS = 60
+# Leaf functions of threads that are parked rather than running (heuristic)
+IDLE_LEAF_FUNCTIONS = {'wait', 'select', 'poll', 'accept', '_wait_for_tstate_lock', 'readinto',
+                       'recv_into', 'get'}
+
+_cpu_profile_lock = threading.Lock()
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(seconds, interval, include_idle=False):
+    """Return ({collapsed stack: samples}, number of sampling rounds)."""
+    own = threading.get_ident()
+    counts = {}
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not include_idle and frame.f_code.co_name in IDLE_LEAF_FUNCTIONS:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            key = ';'.join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        rounds += 1
+        time.sleep(interval)
+    return counts, rounds
+
+def collapsed_to_tree(counts):
+    """Nested [name, samples, children] for the flamegraph page."""
+    root = {'name': 'all', 'value': 0, 'children': {}}
+    for stack, n in counts.items():
+        root['value'] += n
+        node = root
+        for part in stack.split(';'):
+            node = node['children'].setdefault(part, {'name': part, 'value': 0, 'children': {}})
+            node['value'] += n
+
+    def pack(node):
+        children = sorted(node['children'].values(), key=lambda c: -c['value'])
+        return [node['name'], node['value'], [pack(c) for c in children]]
+    return pack(root)
+
+FLAMEGRAPH_HTML = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>__TITLE__</title>
+<style>
+body{font:12px monospace;margin:10px;background:#fff}
+#chart{position:relative;width:100%}
+.f{position:absolute;height:17px;overflow:hidden;white-space:nowrap;border:1px solid #fff;box-sizing:border-box;
+   padding:0 3px;cursor:pointer;line-height:15px}
+.f:hover{border-color:#000}
+#info{height:18px;margin:6px 0}
+</style></head><body>
+<h3>__TITLE__</h3>
+<div>Click a frame to zoom, <a href="#" onclick="draw(data);return false">reset</a></div>
+<div id="info"></div><div id="chart"></div>
+<script>
+const data = __DATA__;
+const chart = document.getElementById('chart'), info = document.getElementById('info');
+function color(name) {
+  let h = 0; for (const c of name) h = (h * 31 + c.charCodeAt(0)) >>> 0;
+  return `hsl(${20 + h % 40}, ${70 + h % 25}%, ${55 + h % 15}%)`;
+}
+function draw(root) {
+  chart.innerHTML = '';
+  let depthMax = 0;
+  (function place(node, x, depth) {
+    const w = node[1] / root[1];
+    if (w < 0.002) return;
+    depthMax = Math.max(depthMax, depth);
+    const el = document.createElement('div');
+    el.className = 'f';
+    el.style.left = (x * 100) + '%'; el.style.width = (w * 100) + '%';
+    el.style.top = (depth * 18) + 'px'; el.style.background = color(node[0]);
+    el.textContent = node[0];
+    const pct = (node[1] / data[1] * 100).toFixed(2);
+    el.title = `${node[0]}\\n${node[1]} samples (${pct}%)`;
+    el.onmouseover = () => info.textContent = `${node[0]} — ${node[1]} samples (${pct}%)`;
+    el.onclick = () => draw(node);
+    chart.appendChild(el);
+    let cx = x;
+    for (const c of node[2]) { place(c, cx, depth + 1); cx += c[1] / root[1]; }
+  })(root, 0, 0);
+  chart.style.height = ((depthMax + 1) * 18) + 'px';
+}
+draw(data);
+</script></body></html>"""
+
+@app.route('/api/admin/profile/cpu')
+def admin_cpu_profile():
+    """Sample all threads for ?seconds= (default 10) and return the profile.
+
+    ?format=collapsed (text, for flamegraph.pl / speedscope), html (flamegraph
+    page) or json; ?interval_ms= (default 10); ?idle=1 keeps parked threads.
+    """
+    db = get_db()
+    pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    if request.args.get('admin_pin') != (pin_row['value'] if pin_row else '1234'):
+        return jsonify({'success': False, 'error': 'PIN الأدمن غير صحيح'}), 401
+
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), CPU_PROFILE_MAX_SECONDS)
+    interval = max(request.args.get('interval_ms', 10, type=float), 1) / 1000
+    include_idle = request.args.get('idle') == '1'
+    fmt = request.args.get('format', 'html')
+    if not _cpu_profile_lock.acquire(blocking=False):
+        return jsonify({'success': False, 'error': 'يوجد قياس آخر قيد التشغيل'}), 409
+    try:
+        counts, rounds = sample_stacks(seconds, interval, include_idle)
+    finally:
+        _cpu_profile_lock.release()
+
+    if fmt == 'collapsed':
+        body = '\n'.join(f"{stack} {n}" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+        return Response(body + '\n', mimetype='text/plain; charset=utf-8')
+    if fmt == 'json':
+        return jsonify({'success': True, 'seconds': seconds, 'rounds': rounds, 'samples': sum(counts.values()),
+                        'stacks': counts})
+    title = f"Kiosk CPU profile — {datetime.now().isoformat(timespec='seconds')}, {seconds:g}s, {rounds} rounds"
+    data = json.dumps(collapsed_to_tree(counts)).replace('</', '<\\/')
+    html = FLAMEGRAPH_HTML.replace('__TITLE__', title).replace('__DATA__', data)
+    return Response(html, mimetype='text/html; charset=utf-8')
+
+# ── Memory Profiling ────────────────────────
+# The kiosk runs for weeks, so memory creep matters more than a spike. A
+# sampler thread keeps a rolling history of RSS and, while tracemalloc is on,
+# the top allocation sites. Named snapshots can be diffed against "now" to see
+# which lines grew.
+MEMORY_TOP_SITES = 5
+MEMORY_MAX_SNAPSHOTS = 3
+
+_memory_history = deque(maxlen=int(cfg.get('memory_history_size', 288)))
+_memory_snapshots = {}
+_memory_lock = threading.Lock()
+
+def current_rss_bytes():
+    """Resident set size via psutil, else /proc (Linux), else None."""
+    if psutil:
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception:
+            pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+
+def _stat_site(stat):
+    frame = stat.traceback[0]
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+def memory_sample(top_sites=True):
+    sample = {'at': datetime.now().isoformat(timespec='seconds'), 'rss': current_rss_bytes()}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        sample.update(traced=current, traced_peak=peak)
+        if top_sites:
+            sample['top'] = [
+                {'site': _stat_site(st), 'size': st.size, 'count': st.count}
+                for st in _take_snapshot().statistics('lineno')[:MEMORY_TOP_SITES]
+            ]
+    return sample
+
+def record_memory_sample():
+    sample = memory_sample()
+    with _memory_lock:
+        _memory_history.append(sample)
+    return sample
+
+def memory_sampler_loop():
+    """Background thread: append a memory sample every `memory_sample_seconds`."""
+    if cfg.get('memory_tracking') and not tracemalloc.is_tracing():
+        tracemalloc.start(int(cfg.get('memory_traceback_frames', 1)))
+    while True:
+        try:
+            record_memory_sample()
+        except Exception as e:
+            print(f"[Memory] Sample error: {e}")
+        time.sleep(float(cfg.get('memory_sample_seconds', 300)))
+
+Gauge('kiosk_process_rss_bytes', 'Resident memory of the kiosk process.',
+      lambda: {(): rss} if (rss := current_rss_bytes()) is not None else {})
+Gauge('kiosk_tracemalloc_traced_bytes', 'Memory traced by tracemalloc (0 when not tracing).',
+      lambda: {(): tracemalloc.get_traced_memory()[0]})
+
+@app.route('/api/admin/memory')
+def admin_memory():
+    """Current RSS, tracemalloc state, rolling history and stored snapshot names."""
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'PIN الأدمن غير صحيح'}), 401
+    with _memory_lock:
+        history = list(_memory_history)
+        snapshots = sorted(_memory_snapshots)
+    return jsonify({'success': True, 'tracing': tracemalloc.is_tracing(), 'now': memory_sample(top_sites=False),
+                    'history': history, 'snapshots': snapshots})
+
+@app.route('/api/admin/memory/snapshot', methods=['POST'])
+def admin_memory_snapshot():
+    """Store a named tracemalloc snapshot (starts tracing if needed); {tracing: false} stops tracing."""
+    data = request.get_json(silent=True) or {}
+    if not _admin_pin_ok(data.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'PIN الأدمن غير صحيح'}), 401
+    if data.get('tracing') is False:
+        tracemalloc.stop()
+        with _memory_lock:
+            _memory_snapshots.clear()
+        return jsonify({'success': True, 'tracing': False})
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(int(data.get('frames') or cfg.get('memory_traceback_frames', 1)))
+    name = str(data.get('name') or 'baseline')
+    snapshot = _take_snapshot()
+    with _memory_lock:
+        _memory_snapshots.pop(name, None)
+        while len(_memory_snapshots) >= MEMORY_MAX_SNAPSHOTS:
+            _memory_snapshots.pop(next(iter(_memory_snapshots)))
+        _memory_snapshots[name] = snapshot
+    return jsonify({'success': True, 'tracing': True, 'name': name,
+                    'traced': tracemalloc.get_traced_memory()[0], 'snapshots': list(_memory_snapshots)})
+
+@app.route('/api/admin/memory/diff')
+def admin_memory_diff():
+    """Allocation growth since snapshot ?since= (default 'baseline'), by ?group=lineno|filename|traceback."""
+    if not _admin_pin_ok(request.args.get('admin_pin')):
+        return jsonify({'success': False, 'error': 'PIN الأدمن غير صحيح'}), 401
+    name = request.args.get('since', 'baseline')
+    with _memory_lock:
+        before = _memory_snapshots.get(name)
+    if before is None or not tracemalloc.is_tracing():
+        return jsonify({'success': False, 'error': f'لا توجد لقطة باسم {name}'}), 404
+    group = request.args.get('group', 'lineno')
+    if group not in ('lineno', 'filename', 'traceback'):
+        group = 'lineno'
+    limit = request.args.get('limit', 20, type=int)
+    diffs = _take_snapshot().compare_to(before, group)
+    return jsonify({
+        'success': True,
+        'since': name,
+        'total_size_diff': sum(d.size_diff for d in diffs),
+        'top': [
+            {
+                'site': _stat_site(d) if group != 'traceback' else ' <- '.join(
+                    f"{os.path.basename(f.filename)}:{f.lineno}" for f in d.traceback),
+                'size': d.size,
+                'size_diff': d.size_diff,
+                'count': d.count,
+                'count_diff': d.count_diff,
+            }
+            for d in diffs[:limit]
+        ],
+    })
+
 # ── Background Sync Loop ────────────────────
 def has_internet():
-    if not REQUESTS_OK:
+    if not REQUESTS_OK or dataset_seed is not None:
         return False
-    try:
-        requests.get('https://8.8.8.8', timeout=3)
-        return True
-    except:
+    with timed(SYNC_STAGE_SECONDS, stage='probe'):
         try:
-            requests.head('https://google.com', timeout=4)
+            requests.get('https://8.8.8.8', timeout=3)
             return True
         except:
-            return False
+            try:
+                requests.head('https://google.com', timeout=4)
+                return True
+            except:
+                return False
 
 def get_sync_status():
+    return reads.do('sync_status', _load_sync_status)
+
+def _load_sync_status():
     db = get_db()
     unsynced = db.execute("SELECT COUNT(*) as cnt FROM attendance WHERE synced=0").fetchone()
     last_sync = db.execute("SELECT * FROM sync_log ORDER BY id DESC LIMIT 1").fetchone()
+    outbox = db.execute("SELECT COUNT(*) as cnt FROM cloud_outbox WHERE status='pending'").fetchone()
     db.close()
     return {
         'unsynced_count': unsynced['cnt'],
+        'outbox_pending': outbox['cnt'],
+        'sync_mode': sync_mode(),
         'last_sync': dict(last_sync) if last_sync else None
     }
 
-def sync_attendance_to_supabase():
-    """Sync attendance records DIRECTLY to Supabase REST API — no Next.js intermediary."""
+# ── Sync HTTP (compression & traffic accounting) ──
+class SyncTraffic:
+    """Body bytes moved over the wire during one sync cycle."""
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+
+    def add(self, other):
+        self.sent += other.sent
+        self.received += other.received
+
+# Cleared for the rest of the run if the server refuses gzip request bodies
+_gzip_bodies_accepted = True
+
+def sync_request(method, url, headers, payload=None, params=None, timeout=10, traffic=None, compress=True):
+    """requests.request() for the sync engine.
+
+    JSON bodies are sent compact and, above `sync_gzip_min_bytes`, gzipped;
+    responses are requested gzipped. Wire sizes (compressed) are added to
+    `traffic`. A 400/415 to a gzipped body is retried uncompressed once.
+    Request compression is turned off for the rest of the run on a 415, or
+    when the uncompressed retry of a 400 succeeds (a gateway that can't
+    inflate bodies); a 400 for bad data fails both ways and changes nothing.
+    """
+    global _gzip_bodies_accepted
+    if dataset_seed is not None:
+        raise requests.ConnectionError(f"refusing to sync a generated dataset ({DB_PATH})")
+    headers = {**headers, 'Accept-Encoding': 'gzip'}
+    body = None
+    compressed = False
+    if payload is not None:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+        if (compress and _gzip_bodies_accepted and cfg.get('sync_gzip_requests', True)
+                and len(body) >= int(cfg.get('sync_gzip_min_bytes', 1024))):
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+            compressed = True
+
+    target = _metric_target(url)
+    start = time.perf_counter()
+    try:
+        resp = requests.request(method, url, headers=headers, data=body, params=params, timeout=timeout)
+        content = resp.content
+    except requests.RequestException:
+        CLOUD_REQUESTS.inc(target=target, method=method, status='error')
+        raise
+    finally:
+        CLOUD_REQUEST_SECONDS.observe(time.perf_counter() - start, target=target, method=method)
+        profile_add('http', time.perf_counter() - start)
+    CLOUD_REQUESTS.inc(target=target, method=method, status=resp.status_code)
+
+    if compressed and resp.status_code in (400, 415):
+        SYNC_RETRIES.inc(kind='gzip_fallback')
+        retry = sync_request(method, url, headers={k: v for k, v in headers.items() if k != 'Content-Encoding'},
+                             payload=payload, params=params, timeout=timeout, traffic=traffic, compress=False)
+        if resp.status_code == 415 or retry.status_code < 400:
+            print(f"[Sync] Server rejected gzip body ({resp.status_code}); sending uncompressed from now on")
+            _gzip_bodies_accepted = False
+        return retry
+
+    sent = len(body or b'')
+    try:
+        received = resp.raw.tell() or len(content)
+    except Exception:
+        received = len(content)
+    SYNC_BYTES.inc(sent, direction='sent')
+    SYNC_BYTES.inc(received, direction='received')
+    if traffic is not None:
+        traffic.sent += sent
+        traffic.received += received
+    return resp
+
+def _log_sync_cycle(db, records_count, message, traffic):
+    db.execute(
+        "INSERT INTO sync_log (synced_at, records_count, success, message, bytes_sent, bytes_received) "
+        "VALUES (?,?,?,?,?,?)",
+        (datetime.now().isoformat(), records_count, 1, message, traffic.sent, traffic.received),
+    )
+
+def _time_left(deadline, ceiling=10):
+    """Timeout for a request that has to finish by `deadline` (at most
+    `ceiling` seconds), or None once the deadline has passed."""
+    if deadline is None:
+        return ceiling
+    left = deadline - time.time()
+    return min(ceiling, left) if left > 0 else None
+
+# Share of the sync time budget no PATCH or new chunk may start in: it is
+# kept for each chunk's closing bulk insert and conflict fetch and for the
+# pull, so those are never crowded out yet still end by the deadline
+SYNC_FINISH_SHARE = 0.25
+
+def _push_attendance_chunk(db, rows, base, headers, traffic, deadline=None, work_deadline=None):
+    """Push one chunk of unsynced rows.
+
+    Rows already linked to a cloud row are PATCHed with an optimistic
+    `version=eq.` filter; if HR changed the row in the meantime nothing is
+    updated and the cloud copy is merged locally instead (see
+    _merge_cloud_attendance). Unlinked rows are matched by (employee, date,
+    HH:MM check-in) or inserted, all new rows in one bulk POST.
+
+    The cloud lookup and PATCHes stop at `work_deadline` (default
+    `deadline`); the closing bulk insert and conflict fetch use the time left
+    until `deadline`. Every request's timeout ends by the deadline it runs
+    under, and rows not reached stay unsynced for the next cycle.
+
+    Returns (local id, updated_at, cloud id, cloud version) for each accepted row.
+    """
+    # ── Batch-fetch existing cloud records for this chunk's unlinked rows ──
+    work_deadline = work_deadline or deadline
+    unlinked = [r for r in rows if r['cloud_id'] is None]
+    existing_by_key = {}
+    timeout = _time_left(work_deadline)
+    if unlinked and timeout:
+        distinct_emp_ids = sorted(set(r['employee_id'] for r in unlinked))
+        distinct_dates   = sorted(set(r['attendance_date'] for r in unlinked))
+        try:
+            existing_resp = sync_request(
+                'GET', f"{base}/hr_attendance",
+                params={
+                    'employee_id':     f'in.({",".join(str(e) for e in distinct_emp_ids)})',
+                    'attendance_date': f'in.({",".join(distinct_dates)})',
+                    'select': '*',
+                },
+                headers=headers,
+                traffic=traffic,
+                timeout=timeout,
+            )
+            existing_records = existing_resp.json() if existing_resp.status_code == 200 else []
+        except Exception:
+            existing_records = []
+        # Index cloud sessions by (employee, date, HH:MM check-in)
+        for ex in existing_records:
+            existing_by_key.setdefault(
+                (ex['employee_id'], ex['attendance_date'], (ex.get('check_in_time') or '')[:5]), ex)
+
+    accepted = []
+    conflicts = {}  # cloud id -> local row
+    gone = []       # local rows whose cloud row was deleted
+    inserts = []
+    insert_keys = set()
+    for row in rows:
+        emp_id   = row['employee_id']
+        att_date = row['attendance_date']
+        check_in = (row['check_in_time'] or '')[:5]
+        check_out = row['check_out_time']
+        status   = row['status']
+        try:
+            notes = row['notes'] or ''
+        except Exception:
+            notes = ''
+
+        cloud_id, cloud_version = row['cloud_id'], row['cloud_version']
+        if cloud_id is None:
+            # Find a matching record already in Supabase
+            existing = existing_by_key.get((emp_id, att_date, check_in))
+            if existing:
+                cloud_id, cloud_version = existing['id'], existing.get('version')
+
+        try:
+            if cloud_id is not None:
+                # ── PATCH: update checkout / status, only if the cloud row is unchanged ──
+                timeout = _time_left(work_deadline)
+                if timeout is None:
+                    break
+                url = f"{base}/hr_attendance?id=eq.{cloud_id}"
+                if cloud_version is not None:
+                    url += f"&version=eq.{cloud_version}"
+                resp = sync_request(
+                    'PATCH', url,
+                    payload={
+                        'check_out_time': check_out,
+                        'status': status,
+                        'synced_from_local': True,
+                        'notes': notes,
+                    },
+                    headers=headers,
+                    traffic=traffic,
+                    timeout=timeout,
+                )
+                if resp.status_code not in (200, 204):
+                    continue
+                updated = resp.json() if resp.status_code == 200 else [{}]
+                if not updated:
+                    # Nothing matched: HR edited (or deleted) the row since we last saw it.
+                    # Tracked by local row: a row matched by key has no cloud_id yet
+                    if cloud_version is not None:
+                        conflicts[cloud_id] = row
+                    else:
+                        gone.append(row)
+                    continue
+                accepted.append((row['id'], row['updated_at'], cloud_id, updated[0].get('version', cloud_version)))
+            else:
+                # ── POST: queued for one bulk insert after the loop ──
+                key = (emp_id, att_date, check_in)
+                if key in insert_keys:
+                    continue  # same session twice in one chunk: matched on the next cycle
+                insert_keys.add(key)
+                inserts.append((row, {
+                    'employee_id':      emp_id,
+                    'attendance_date':  att_date,
+                    'check_in_time':    row['check_in_time'] or None,
+                    'check_out_time':   check_out or None,
+                    'status':           status,
+                    'source':           'kiosk',
+                    'synced_from_local': True,
+                    'notes':            notes,
+                }))
+
+        except Exception as e:
+            print(f"[Attendance Sync] Error for row id={row['id']}: {e}")
+
+    # The bulk insert and the conflict fetch finish what this chunk started in
+    # the time kept back from the PATCHes; otherwise rows whose PATCH hit a
+    # conflict would head every chunk and never be resolved
+    timeout = _time_left(deadline)
+    if inserts and timeout:
+        try:
+            resp = sync_request(
+                'POST', f"{base}/hr_attendance",
+                payload=[payload for _, payload in inserts],
+                headers=headers,
+                traffic=traffic,
+                timeout=timeout,
+            )
+            if resp.status_code in (200, 201):
+                # PostgREST returns the representation in insert order
+                for (row, _), created in zip(inserts, resp.json()):
+                    accepted.append((row['id'], row['updated_at'], created.get('id'), created.get('version')))
+            else:
+                print(f"[Attendance Sync] Bulk insert failed: HTTP {resp.status_code}")
+        except Exception as e:
+            print(f"[Attendance Sync] Bulk insert error: {e}")
+
+    timeout = _time_left(deadline)
+    if conflicts and timeout:
+        try:
+            resp = sync_request(
+                'GET', f"{base}/hr_attendance",
+                params={'id': f'in.({",".join(str(c) for c in conflicts)})', 'select': '*'},
+                headers=headers,
+                traffic=traffic,
+                timeout=timeout,
+            )
+            if resp.status_code == 200:
+                cloud_rows = resp.json()
+                _merge_cloud_attendance(db, cloud_rows)
+                found = {c['id'] for c in cloud_rows}
+                gone.extend(row for cloud_id, row in conflicts.items() if cloud_id not in found)
+        except Exception as e:
+            print(f"[Attendance Sync] Conflict fetch error: {e}")
+    if gone:
+        # Deleted in the cloud by HR: drop the local copy rather than resurrect it,
+        # unless it was punched again since it was read
+        db.executemany("DELETE FROM attendance WHERE id=? AND updated_at IS ?",
+                       [(row['id'], row['updated_at']) for row in gone])
+
+    return accepted
+
+def _merge_cloud_attendance(db, cloud_rows):
+    """Apply cloud attendance rows to the local cache. Returns the number of local rows changed.
+
+    Merge policy, per cloud row:
+    - no local copy: insert it as synced;
+    - local copy with no pending change: the cloud row replaces it;
+    - pending local change made on top of the version now in the cloud: keep
+      it, the next push applies it;
+    - both sides changed: the cloud (HR) wins every field, except a local
+      check-out the cloud doesn't have yet. The row stays unsynced if the
+      result still differs from the cloud so that check-out gets pushed.
+    Writes are guarded on the local updated_at so a punch that lands during
+    the merge is never overwritten.
+    """
+    changed = 0
+    now = datetime.now().isoformat()
+    for c in cloud_rows:
+        check_in = (c.get('check_in_time') or '')[:5] or None
+        cloud_fields = {
+            'check_in_time':  check_in,
+            'check_out_time': (c.get('check_out_time') or '')[:5] or None,
+            'status':         c.get('status') or 'present',
+            'notes':          c.get('notes') or '',
+        }
+        version = c.get('version')
+
+        local = db.execute("SELECT * FROM attendance WHERE cloud_id=?", (c['id'],)).fetchone()
+        if local is None:
+            local = db.execute(
+                """SELECT * FROM attendance
+                   WHERE cloud_id IS NULL AND employee_id=? AND attendance_date=? AND substr(check_in_time, 1, 5) IS ?
+                   ORDER BY id LIMIT 1""",
+                (c['employee_id'], c['attendance_date'], check_in)
+            ).fetchone()
+        if local is None:
+            db.execute(
+                """INSERT INTO attendance (employee_id, attendance_date, check_in_time, check_out_time, status, notes,
+                                             synced, cloud_id, cloud_version, updated_at)
+                   VALUES (?,?,?,?,?,?,1,?,?,?)""",
+                (c['employee_id'], c['attendance_date'], cloud_fields['check_in_time'], cloud_fields['check_out_time'],
+                 cloud_fields['status'], cloud_fields['notes'], c['id'], version, now)
+            )
+            changed += 1
+            continue
+
+        local_fields = {
+            'check_in_time':  (local['check_in_time'] or '')[:5] or None,
+            'check_out_time': (local['check_out_time'] or '')[:5] or None,
+            'status':         local['status'],
+            'notes':          local['notes'] or '',
+        }
+        if local['synced']:
+            if local['cloud_id'] == c['id'] and local['cloud_version'] == version and local_fields == cloud_fields:
+                continue
+            merged, synced = cloud_fields, 1
+        else:
+            if local['cloud_version'] is not None and version is not None and version <= local['cloud_version']:
+                continue
+            merged = dict(cloud_fields)
+            if local_fields['check_out_time'] and not cloud_fields['check_out_time']:
+                merged['check_out_time'] = local['check_out_time']
+            synced = 1 if merged == cloud_fields else 0
+
+        cur = db.execute(
+            """UPDATE attendance SET employee_id=?, attendance_date=?, check_in_time=?, check_out_time=?, status=?,
+                   notes=?, synced=?, cloud_id=?, cloud_version=?, updated_at=?
+               WHERE id=? AND updated_at IS ?""",
+            (c['employee_id'], c['attendance_date'], merged['check_in_time'], merged['check_out_time'], merged['status'],
+             merged['notes'], synced, c['id'], version, now, local['id'], local['updated_at'])
+        )
+        changed += cur.rowcount
+    return changed
+
+ATTENDANCE_PULL_PAGE_SIZE = 500
+ATTENDANCE_PULL_OVERLAP_SECONDS = 120
+
+def pull_attendance_from_cloud(db, base, headers, traffic, deadline):
+    """Incrementally pull hr_attendance rows changed since the stored cursor.
+
+    Pages by (updated_at, id) and only covers the last `attendance_pull_days`
+    days. Each pass re-reads a short overlap before the cursor so rows from
+    transactions that committed late are not missed; merging is idempotent.
+    Returns the number of local rows changed.
+    """
+    window_start = (date.today() - timedelta(days=int(cfg.get('attendance_pull_days', 35)))).isoformat()
+    stored = db.execute("SELECT value FROM settings WHERE key='attendance_pull_cursor'").fetchone()
+    cursor = None
+    if stored and stored['value']:
+        try:
+            ts = datetime.fromisoformat(stored['value'].split('|', 1)[0])
+            cursor = ((ts - timedelta(seconds=ATTENDANCE_PULL_OVERLAP_SECONDS)).isoformat(), 0)
+        except ValueError:
+            cursor = None
+
+    changed = 0
+    while True:
+        # The push leaves part of the budget for this, so HR edits still
+        # arrive while a backlog is draining
+        timeout = _time_left(deadline)
+        if timeout is None:
+            break
+        params = {
+            'select': 'id,employee_id,attendance_date,check_in_time,check_out_time,status,notes,version,updated_at',
+            'attendance_date': f'gte.{window_start}',
+            'order': 'updated_at.asc,id.asc',
+            'limit': str(ATTENDANCE_PULL_PAGE_SIZE),
+        }
+        if cursor:
+            params['or'] = f'(updated_at.gt."{cursor[0]}",and(updated_at.eq."{cursor[0]}",id.gt.{cursor[1]}))'
+        # A non-200 (e.g. migration 018 not applied yet) or a page that does
+        # not arrive in the time left just ends the pull for this cycle
+        try:
+            resp = sync_request('GET', f"{base}/hr_attendance", params=params, headers=headers, traffic=traffic,
+                                timeout=timeout)
+        except requests.RequestException as e:
+            print(f"[Attendance Sync] Pull error: {e}")
+            break
+        if resp.status_code != 200:
+            break
+        page = resp.json()
+        if not page:
+            break
+        changed += _merge_cloud_attendance(db, page)
+        cursor = (page[-1]['updated_at'], page[-1]['id'])
+        db.execute(
+            "INSERT INTO settings (key, value) VALUES ('attendance_pull_cursor', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (f"{cursor[0]}|{cursor[1]}",)
+        )
+        db.commit()
+        attendance_changed()
+        if len(page) < ATTENDANCE_PULL_PAGE_SIZE:
+            break
+    return changed
+
+@sync_stage('attendance')
+def sync_attendance_to_supabase(traffic=None):
+    """Sync attendance records DIRECTLY to Supabase REST API — no Next.js intermediary.
+
+    Unsynced rows are drained newest day first in chunks of `sync_chunk_size`.
+    Each chunk is committed before the next one is read, and no push request
+    is started (or left running) past `sync_time_budget_seconds`, so a backlog
+    from a long offline period is worked off over several cycles with bounded
+    request sizes. The last SYNC_FINISH_SHARE of the budget is kept for closing
+    the open chunk and for the pull. Afterwards, cloud-side changes (e.g. HR corrections) are
+    pulled in with pull_attendance_from_cloud.
+
+    When `traffic` is given the caller owns the cycle and its sync_log entry;
+    otherwise this call logs its own row.
+    """
+    owns_cycle = traffic is None
+    traffic = traffic or SyncTraffic()
     if not sync_lock.acquire(blocking=False):
         return {'success': False, 'message': 'المزامنة جارية بالفعل...'}
         
@@ -1006,11 +4024,6 @@ def sync_attendance_to_supabase():
             return {'success': False, 'message': 'لا يوجد اتصال بالإنترنت'}
 
         db = get_db()
-        unsynced = db.execute("SELECT * FROM attendance WHERE synced=0").fetchall()
-
-        if not unsynced:
-            db.close()
-            return {'success': True, 'message': 'لا توجد سجلات جديدة للمزامنة', 'count': 0}
 
         headers = {
             'apikey': supabase_key,
@@ -1020,127 +4033,152 @@ def sync_attendance_to_supabase():
         }
         base = f"{supabase_url}/rest/v1"
 
-        # ── Batch-fetch existing cloud records for the same employees & dates ──
-        distinct_emp_ids = list(set(r['employee_id'] for r in unsynced))
-        distinct_dates   = list(set(r['attendance_date'] for r in unsynced))
-        try:
-            existing_resp = requests.get(
-                f"{base}/hr_attendance",
-                params={
-                    'employee_id':     f'in.({" ,".join(str(e) for e in distinct_emp_ids)})',
-                    'attendance_date': f'in.({",".join(distinct_dates)})',
-                    'select': 'id,employee_id,attendance_date,check_in_time',
-                },
-                headers=headers,
-                timeout=10,
-            )
-            existing_records = existing_resp.json() if existing_resp.status_code == 200 else []
-        except Exception:
-            existing_records = []
-
-        synced_ids = []
-        for row in unsynced:
-            emp_id   = row['employee_id']
-            att_date = row['attendance_date']
-            check_in = (row['check_in_time'] or '')[:5]
-            check_out = row['check_out_time']
-            status   = row['status']
-            try:
-                notes = row['notes'] or ''
-            except Exception:
-                notes = ''
+        chunk_size = max(1, int(cfg.get('sync_chunk_size', 100)))
+        budget = float(cfg.get('sync_time_budget_seconds', 20))
+        deadline = time.time() + budget
+        work_deadline = deadline - budget * SYNC_FINISH_SHARE
+        total_synced = 0
+        cursor = None  # (attendance_date, id) of the last row read this cycle; failed rows are retried next cycle
+        while True:
+            if cursor is None:
+                chunk = db.execute(
+                    "SELECT * FROM attendance WHERE synced=0 ORDER BY attendance_date DESC, id ASC LIMIT ?",
+                    (chunk_size,)
+                ).fetchall()
+            else:
+                chunk = db.execute(
+                    """SELECT * FROM attendance
+                       WHERE synced=0 AND (attendance_date < ? OR (attendance_date = ? AND id > ?))
+                       ORDER BY attendance_date DESC, id ASC LIMIT ?""",
+                    (cursor[0], cursor[0], cursor[1], chunk_size)
+                ).fetchall()
+            if not chunk:
+                break
+            cursor = (chunk[-1]['attendance_date'], chunk[-1]['id'])
 
-            # Find a matching record already in Supabase
-            existing = next(
-                (ex for ex in existing_records
-                 if ex['employee_id'] == emp_id
-                 and ex['attendance_date'] == att_date
-                 and (ex.get('check_in_time') or '')[:5] == check_in),
-                None
-            )
+            accepted = _push_attendance_chunk(db, chunk, base, headers, traffic, deadline, work_deadline)
+            if accepted:
+                db.executemany("UPDATE attendance SET cloud_id=?, cloud_version=? WHERE id=?",
+                               [(cloud_id, version, row_id) for row_id, _, cloud_id, version in accepted])
+                # Only rows unchanged since they were read; a check-out that
+                # landed meanwhile keeps its row unsynced for the next push.
+                db.executemany("UPDATE attendance SET synced=1 WHERE id=? AND updated_at IS ?",
+                               [(row_id, updated_at) for row_id, updated_at, _, _ in accepted])
+                total_synced += len(accepted)
+            db.commit()
+            attendance_changed()
+            events.publish('sync_progress', {'stage': 'attendance', 'synced': total_synced})
 
-            try:
-                if existing:
-                    # ── PATCH: update checkout / status ──
-                    resp = requests.patch(
-                        f"{base}/hr_attendance?id=eq.{existing['id']}",
-                        json={
-                            'check_out_time': check_out,
-                            'status': status,
-                            'synced_from_local': True,
-                            'notes': notes,
-                        },
-                        headers={**headers, 'Prefer': 'return=minimal'},
-                        timeout=10,
-                    )
-                    ok = resp.status_code in (200, 204)
-                else:
-                    # ── POST: insert new session ──
-                    resp = requests.post(
-                        f"{base}/hr_attendance",
-                        json={
-                            'employee_id':      emp_id,
-                            'attendance_date':  att_date,
-                            'check_in_time':    row['check_in_time'] or None,
-                            'check_out_time':   check_out or None,
-                            'status':           status,
-                            'source':           'kiosk',
-                            'synced_from_local': True,
-                            'notes':            notes,
-                        },
-                        headers=headers,
-                        timeout=10,
-                    )
-                    ok = resp.status_code in (200, 201)
-                    if ok:
-                        new_records = resp.json()
-                        if isinstance(new_records, list) and new_records:
-                            existing_records.append({
-                                'id': new_records[0]['id'],
-                                'employee_id': emp_id,
-                                'attendance_date': att_date,
-                                'check_in_time': row['check_in_time'],
-                            })
-
-                if ok:
-                    synced_ids.append(row['id'])
+            if len(chunk) < chunk_size or time.time() >= work_deadline:
+                break
 
-            except Exception as e:
-                print(f"[Attendance Sync] Error for row id={row['id']}: {e}")
+        pulled = pull_attendance_from_cloud(db, base, headers, traffic, deadline)
 
-        if synced_ids:
-            db.execute(
-                f"UPDATE attendance SET synced=1 WHERE id IN ({','.join('?'*len(synced_ids))})",
-                synced_ids,
-            )
-            db.execute(
-                "INSERT INTO sync_log (synced_at, records_count, success, message) VALUES (?,?,?,?)",
-                (datetime.now().isoformat(), len(synced_ids), 1,
-                 f'مزامنة مباشرة Supabase: {len(synced_ids)} سجل'),
-            )
+        remaining = db.execute("SELECT COUNT(*) as cnt FROM attendance WHERE synced=0").fetchone()['cnt']
+        if (total_synced or pulled) and owns_cycle:
+            _log_sync_cycle(db, total_synced + pulled,
+                            f'مزامنة مباشرة Supabase: {total_synced} سجل' + (f'، تحديث {pulled} من السحابة' if pulled else '')
+                            + (f' (متبقي {remaining})' if remaining else ''),
+                            traffic)
             db.commit()
 
         db.close()
-        return {'success': True, 'message': f'تم مزامنة {len(synced_ids)} سجل', 'count': len(synced_ids)}
+        if total_synced or pulled:
+            publish_sync_status()
+        if not total_synced and not pulled and not remaining:
+            return {'success': True, 'message': 'لا توجد سجلات جديدة للمزامنة', 'count': 0, 'pulled': 0, 'remaining': 0}
+        message = f'تم مزامنة {total_synced} سجل' + (f'، وتحديث {pulled} من السحابة' if pulled else '')
+        return {'success': True, 'message': message, 'count': total_synced, 'pulled': pulled, 'remaining': remaining}
     except Exception as e:
         print(f"[Attendance Sync] Global error: {e}")
         return {'success': False, 'message': str(e)}
     finally:
         sync_lock.release()
 
-def sync_inventory_to_supabase():
-    """Push offline counts & pull products DIRECTLY from Supabase REST API."""
+def _replace_products(db, products):
+    """Replace the local catalog with `products` (cloud or hub shape)."""
+    db.execute("DELETE FROM products")
+    db.executemany(
+        'INSERT INTO products (id, name, category, barcode, sku, price, active, unit) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [
+            (p['id'], p['name'], p.get('category'), p.get('barcode'),
+             p.get('sku'), p.get('price', 0), 1, p.get('unit'))
+            for p in products
+        ],
+    )
+
+def _upsert_employees(db, employees):
+    """Upsert the roster (cloud /api/hr/employees shape).
+
+    Local edits still waiting in the outbox win over the incoming copy.
+    """
+    pending_ids = {
+        r['path'].rsplit('/', 1)[1]
+        for r in db.execute(
+            "SELECT path FROM cloud_outbox WHERE status='pending' AND path LIKE '/api/hr/employees/%'"
+        ).fetchall()
+    }
+    now = datetime.now().isoformat()
+    for emp in employees:
+        if str(emp['id']) in pending_ids:
+            continue
+        off_days = json.dumps(emp.get('off_days') or [])
+        db.execute("""
+            INSERT INTO employees (id, name, job_title, work_start_time, work_end_time,
+                late_threshold_minutes, off_days, is_active, pin_code, device_id, last_synced_at)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(id) DO UPDATE SET
+                name=excluded.name, job_title=excluded.job_title,
+                work_start_time=excluded.work_start_time,
+                work_end_time=excluded.work_end_time,
+                late_threshold_minutes=excluded.late_threshold_minutes,
+                off_days=excluded.off_days,
+                is_active=excluded.is_active,
+                pin_code=excluded.pin_code,
+                device_id=excluded.device_id,
+                last_synced_at=excluded.last_synced_at
+        """, (emp['id'], emp['name'], emp.get('job_title',''),
+              emp.get('work_start_time','09:00'), emp.get('work_end_time','17:00'),
+              emp.get('late_threshold_minutes', 15), off_days,
+              1 if emp.get('is_active', True) else 0,
+              emp.get('pin_code', '0000'), emp.get('device_id'),
+              now))
+
+def _store_admin_pin(db, pin):
+    db.execute("INSERT INTO settings (key, value) VALUES ('admin_pin', ?) "
+               "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (pin,))
+
+# What PostgREST answers an upsert on inventory_counts.sync_key with before
+# migration 019: unknown column (PGRST204, 42703) or no unique constraint on
+# it (42P10)
+SYNC_KEY_MISSING_CODES = ('PGRST204', '42703', '42P10')
+
+def _postgrest_code(resp):
+    try:
+        body = resp.json()
+    except ValueError:
+        return None
+    return body.get('code') if isinstance(body, dict) else None
+
+@sync_stage('inventory')
+def sync_inventory_to_supabase(traffic=None):
+    """Push offline counts & pull products DIRECTLY from Supabase REST API.
+
+    Returns the number of counts pushed. Wire bytes are added to `traffic`.
+    """
     if not sync_lock.acquire(blocking=False):
-        return
+        return 0
         
+    pushed = 0
     try:
         if not REQUESTS_OK or not has_internet():
-            return
+            return 0
 
         supabase_url = cfg.get('supabase_url', '').rstrip('/')
         supabase_key = cfg.get('supabase_service_key', '')
         if not supabase_url or not supabase_key:
-            return
+            return 0
 
         headers = {
             'apikey': supabase_key,
@@ -1152,84 +4190,153 @@ def sync_inventory_to_supabase():
 
         db = get_db()
 
-        # ── 1. PUSH: unsynced offline inventory counts ──────────────────────────
-        unsynced_inv = db.execute("SELECT * FROM offline_counts WHERE synced=0").fetchall()
-        for row in unsynced_inv:
+        # ── 1. PUSH: unsynced offline inventory counts, one bulk upsert per chunk ──
+        # Each count carries a sync_key (kiosk id + local id, or the satellite's
+        # origin) so a chunk re-sent after a lost reply updates the same cloud
+        # rows; its items are replaced, and the count only marked synced once
+        # the cloud took them (migration 019). A cloud without migration 019
+        # gets plain inserts, as before it. Counts are read a page at a time
+        # (their items_json can be large) and no request outlives the budget.
+        chunk_size = max(1, int(cfg.get('sync_chunk_size', 100)))
+        deadline = time.time() + float(cfg.get('sync_time_budget_seconds', 20))
+        kiosk_id = get_kiosk_id()
+        keyed = True
+        last_id = 0
+        while True:
+            chunk = db.execute(
+                "SELECT * FROM offline_counts WHERE synced=0 AND id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size),
+            ).fetchall()
+            if not chunk:
+                break
+            last_id = chunk[-1]['id']
+            keys = {
+                row['id']: f"{row['origin']}:{row['origin_id']}" if row['origin'] else f"{kiosk_id}:{row['id']}"
+                for row in chunk
+            }
+            counts_payload = [
+                {
+                    'employee_id': row['employee_id'],
+                    'count_date':  row['count_date'],
+                    'shift':       row['shift'],
+                    'branch':      row['branch'] or 'Suzz 1',
+                    'notes':       'Offline Kiosk Sync',
+                }
+                for row in chunk
+            ]
             try:
-                items = json.loads(row['items_json'] or '[]')
-            except Exception:
-                items = []
-
-            try:
-                # Insert main count record
-                count_resp = requests.post(
-                    f"{base}/inventory_counts",
-                    json={
-                        'employee_id': row['employee_id'],
-                        'count_date':  row['count_date'],
-                        'shift':       row['shift'],
-                        'branch':      row['branch'] or 'Suzz 1',
-                        'notes':       'Offline Kiosk Sync',
-                    },
-                    headers=headers,
-                    timeout=10,
-                )
-                if count_resp.status_code in (200, 201):
-                    count_data = count_resp.json()
-                    count_id = (
-                        count_data[0]['id']
-                        if isinstance(count_data, list) and count_data
-                        else count_data.get('id')
+                if keyed:
+                    timeout = _time_left(deadline)
+                    if timeout is None:
+                        break
+                    count_resp = sync_request(
+                        'POST', f"{base}/inventory_counts",
+                        params={'on_conflict': 'sync_key'},
+                        payload=[{**c, 'sync_key': keys[row['id']]} for c, row in zip(counts_payload, chunk)],
+                        headers={**headers, 'Prefer': 'return=representation,resolution=merge-duplicates'},
+                        traffic=traffic,
+                        timeout=timeout,
+                    )
+                    if count_resp.status_code == 400 and _postgrest_code(count_resp) in SYNC_KEY_MISSING_CODES:
+                        print("[Inventory Sync] Cloud has no inventory_counts.sync_key (migration 019); "
+                              "sending plain inserts")
+                        keyed = False
+                if not keyed:
+                    timeout = _time_left(deadline)
+                    if timeout is None:
+                        break
+                    count_resp = sync_request(
+                        'POST', f"{base}/inventory_counts",
+                        payload=counts_payload,
+                        headers=headers,
+                        traffic=traffic,
+                        timeout=timeout,
                     )
-                    if count_id and items:
-                        items_payload = [
-                            {
-                                'count_id':  count_id,
-                                'item_name': it.get('item_name') or it.get('name', ''),
-                                'quantity':  it.get('quantity', 0),
-                            }
-                            for it in items
-                        ]
-                        requests.post(
-                            f"{base}/inventory_count_items",
-                            json=items_payload,
-                            headers=headers,
-                            timeout=10,
-                        )
-                    db.execute("UPDATE offline_counts SET synced=1 WHERE id=?", (row['id'],))
-                    db.commit()
+                if count_resp.status_code not in (200, 201):
+                    print(f"[Inventory Sync] Push failed: HTTP {count_resp.status_code}")
+                    break
+                if keyed:
+                    cloud_ids = {c.get('sync_key'): c['id'] for c in count_resp.json()}
+                else:
+                    # PostgREST returns the representation in insert order
+                    cloud_ids = {keys[row['id']]: c['id'] for row, c in zip(chunk, count_resp.json())}
+                pushed_rows = [row for row in chunk if keys[row['id']] in cloud_ids]
+                items_payload = []
+                for row in pushed_rows:
+                    try:
+                        items = json.loads(row['items_json'] or '[]')
+                    except Exception:
+                        items = []
+                    items_payload.extend(
+                        {
+                            'count_id':  cloud_ids[keys[row['id']]],
+                            'item_name': it.get('item_name') or it.get('name', ''),
+                            'quantity':  it.get('quantity', 0),
+                        }
+                        for it in items
+                    )
+                # A count whose items were not (re)sent stays unsynced; sending it
+                # again later is safe
+                if pushed_rows and keyed:
+                    timeout = _time_left(deadline)
+                    if timeout is None:
+                        break
+                    # Drop items a previous, unacknowledged attempt left behind
+                    clear_resp = sync_request(
+                        'DELETE', f"{base}/inventory_count_items",
+                        params={'count_id': f'in.({",".join(str(cloud_ids[keys[r["id"]]]) for r in pushed_rows)})'},
+                        headers={**headers, 'Prefer': 'return=minimal'},
+                        traffic=traffic,
+                        timeout=timeout,
+                    )
+                    if clear_resp.status_code not in (200, 204):
+                        print(f"[Inventory Sync] Items reset failed: HTTP {clear_resp.status_code}")
+                        break
+                if items_payload:
+                    timeout = _time_left(deadline)
+                    if timeout is None:
+                        break
+                    items_resp = sync_request(
+                        'POST', f"{base}/inventory_count_items",
+                        payload=items_payload,
+                        headers={**headers, 'Prefer': 'return=minimal'},
+                        traffic=traffic,
+                        timeout=timeout,
+                    )
+                    if items_resp.status_code not in (200, 201, 204):
+                        print(f"[Inventory Sync] Items push failed: HTTP {items_resp.status_code}")
+                        break
+                db.executemany("UPDATE offline_counts SET synced=1 WHERE id=?",
+                               [(row['id'],) for row in pushed_rows])
+                db.commit()
+                pushed += len(pushed_rows)
             except Exception as e:
-                print(f"[Inventory Sync] Push error for count id={row['id']}: {e}")
+                print(f"[Inventory Sync] Push error for counts from id={chunk[0]['id']}: {e}")
+                break
+            if len(chunk) < chunk_size:
+                break
 
         # ── 2. PULL: fresh products catalog ────────────────────────────────────
         try:
-            prod_resp = requests.get(
-                f"{base}/products",
+            prod_resp = sync_request(
+                'GET', f"{base}/products",
                 params={'select': 'id,name,category,barcode,price,unit', 'order': 'category,name'},
                 headers=headers,
-                timeout=10,
+                traffic=traffic,
             )
             if prod_resp.status_code == 200:
-                products = prod_resp.json()
-                db.execute("DELETE FROM products")
-                for p in products:
-                    db.execute(
-                        'INSERT INTO products (id, name, category, barcode, sku, price, active, unit) '
-                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                        (
-                            p['id'], p['name'], p.get('category'), p.get('barcode'),
-                            p.get('sku'), p.get('price', 0), 1, p.get('unit'),
-                        ),
-                    )
+                _replace_products(db, prod_resp.json())
                 db.commit()
         except Exception as e:
             print(f"[Inventory Sync] Products pull error: {e}")
 
         db.close()
+        return pushed
     finally:
         sync_lock.release()
 
-def sync_employees_from_cloud():
+@sync_stage('employees')
+def sync_employees_from_cloud(traffic=None):
     """Pull latest employee list from Supabase directly."""
     if not REQUESTS_OK:
         return {'success': False, 'message': 'requests غير مثبتة'}
@@ -1237,47 +4344,27 @@ def sync_employees_from_cloud():
     if not cloud_url or not has_internet():
         return {'success': False, 'message': 'لا اتصال أو cloud_base_url غير مضبوط'}
     try:
-        resp = requests.get(
-            f"{cloud_url}/api/hr/employees",
+        resp = sync_request(
+            'GET', f"{cloud_url}/api/hr/employees",
             headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
-            timeout=10
+            traffic=traffic
         )
         if resp.status_code == 200:
             employees = resp.json()
             db = get_db()
-            for emp in employees:
-                off_days = json.dumps(emp.get('off_days') or [])
-                db.execute("""
-                    INSERT INTO employees (id, name, job_title, work_start_time, work_end_time,
-                        late_threshold_minutes, off_days, is_active, pin_code, device_id, last_synced_at)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                    ON CONFLICT(id) DO UPDATE SET
-                        name=excluded.name, job_title=excluded.job_title,
-                        work_start_time=excluded.work_start_time,
-                        work_end_time=excluded.work_end_time,
-                        late_threshold_minutes=excluded.late_threshold_minutes,
-                        off_days=excluded.off_days,
-                        is_active=excluded.is_active,
-                        pin_code=excluded.pin_code,
-                        device_id=excluded.device_id,
-                        last_synced_at=excluded.last_synced_at
-                """, (emp['id'], emp['name'], emp.get('job_title',''),
-                      emp.get('work_start_time','09:00'), emp.get('work_end_time','17:00'),
-                      emp.get('late_threshold_minutes', 15), off_days,
-                      1 if emp.get('is_active', True) else 0,
-                      emp.get('pin_code', '0000'), emp.get('device_id'),
-                      datetime.now().isoformat()))
-            
+            _upsert_employees(db, employees)
+
             # Now fetch the admin PIN
-            resp_pin = requests.get(
-                f"{cloud_url}/api/settings/kiosk-pin",
+            resp_pin = sync_request(
+                'GET', f"{cloud_url}/api/settings/kiosk-pin",
                 headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
-                timeout=5
+                timeout=5,
+                traffic=traffic
             )
             if resp_pin.status_code == 200:
                 pin_data = resp_pin.json()
                 if 'pin' in pin_data:
-                    db.execute("INSERT INTO settings (key, value) VALUES ('admin_pin', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (pin_data['pin'],))
+                    _store_admin_pin(db, pin_data['pin'])
 
             db.commit()
             db.close()
@@ -1286,49 +4373,639 @@ def sync_employees_from_cloud():
     except Exception as e:
         return {'success': False, 'message': str(e)}
 
-def try_unlink_device_on_cloud(emp_id):
-    """Helper to wipe device_id on cloud when unlinked by admin"""
+# ── Cloud Outbox (write-behind) ─────────────
+# Cloud mutations (device links, employee edits) are recorded in cloud_outbox
+# in the same transaction as the local change and delivered by
+# cloud_outbox_loop, so request handlers never wait on the network.
+OUTBOX_POLL_SECONDS = 30
+OUTBOX_MAX_ATTEMPTS = 20
+OUTBOX_MAX_BACKOFF_SECONDS = 600
+
+cloud_outbox_event = threading.Event()
+
+def enqueue_cloud_mutation(db, method, path, payload):
+    """Record a cloud API call on `db`; the caller commits it with its own write.
+
+    A still-pending PUT to the same path is merged instead of queued twice, so
+    the cloud only receives the latest state of the resource.
+    """
+    now = datetime.now().isoformat()
+    if method == 'PUT':
+        pending = db.execute(
+            "SELECT id, payload_json FROM cloud_outbox WHERE method=? AND path=? AND status='pending' "
+            "ORDER BY id DESC LIMIT 1", (method, path)
+        ).fetchone()
+        if pending:
+            merged = json.loads(pending['payload_json'] or '{}')
+            merged.update(payload)
+            db.execute(
+                "UPDATE cloud_outbox SET payload_json=?, revision=revision+1, attempts=0, "
+                "next_attempt_at=?, last_error=NULL WHERE id=?",
+                (json.dumps(merged), now, pending['id'])
+            )
+            return
+    db.execute(
+        "INSERT INTO cloud_outbox (method, path, payload_json, status, attempts, revision, next_attempt_at, created_at) "
+        "VALUES (?,?,?,'pending',0,0,?,?)",
+        (method, path, json.dumps(payload), now, now)
+    )
+
+def wake_cloud_outbox():
+    """Ask the outbox worker to deliver now (call after the commit)."""
+    cloud_outbox_event.set()
+
+@sync_stage('outbox')
+def deliver_cloud_outbox():
+    """Deliver due outbox rows in order. Returns the number delivered.
+
+    Rows for the same path are delivered strictly in order: once one fails,
+    later rows for that path wait for the next pass. A connection error ends
+    the pass so an offline kiosk doesn't wait on every row's timeout.
+    """
+    if not REQUESTS_OK:
+        return 0
     cloud_url = cfg.get('cloud_base_url', '').rstrip('/')
-    if not cloud_url or not has_internet():
-        return
+    if not cloud_url:
+        return 0
+
+    db = get_db()
+    rows = db.execute("SELECT * FROM cloud_outbox WHERE status='pending' ORDER BY id LIMIT 50").fetchall()
+    now = datetime.now()
+    blocked_paths = set()
+    delivered = 0
+    for row in rows:
+        if row['path'] in blocked_paths:
+            continue
+        if row['next_attempt_at'] and row['next_attempt_at'] > now.isoformat():
+            blocked_paths.add(row['path'])
+            continue
+
+        offline = False
+        try:
+            resp = sync_request(
+                row['method'],
+                f"{cloud_url}{row['path']}",
+                payload=json.loads(row['payload_json'] or 'null'),
+                headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
+            )
+            if resp.status_code < 300:
+                # revision guards against a merge that happened while we were sending
+                db.execute("DELETE FROM cloud_outbox WHERE id=? AND revision=?", (row['id'], row['revision']))
+                db.commit()
+                delivered += 1
+                continue
+            error = f"HTTP {resp.status_code}"
+            permanent = 400 <= resp.status_code < 500 and resp.status_code not in (408, 429)
+        except requests.RequestException as e:
+            error = str(e)
+            permanent = False
+            offline = isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+        attempts = row['attempts'] + 1
+        SYNC_RETRIES.inc(kind='outbox')
+        status = 'failed' if permanent or attempts >= OUTBOX_MAX_ATTEMPTS else 'pending'
+        backoff = min(OUTBOX_MAX_BACKOFF_SECONDS, 5 * 2 ** (attempts - 1))
+        db.execute(
+            "UPDATE cloud_outbox SET attempts=?, status=?, last_error=?, next_attempt_at=? WHERE id=? AND revision=?",
+            (attempts, status, error, (now + timedelta(seconds=backoff)).isoformat(), row['id'], row['revision'])
+        )
+        db.commit()
+        print(f"[Cloud Outbox] {row['method']} {row['path']} failed (attempt {attempts}): {error}")
+        blocked_paths.add(row['path'])
+        if offline:
+            break
+
+    db.close()
+    if delivered:
+        publish_sync_status()
+    return delivered
+
+def cloud_outbox_loop():
+    """Background thread: deliver queued cloud mutations with retries.
+
+    A satellite forwards them to its hub instead.
+    """
+    while True:
+        cloud_outbox_event.wait(timeout=OUTBOX_POLL_SECONDS)
+        cloud_outbox_event.clear()
+        try:
+            if sync_mode() == 'satellite':
+                push_to_hub()
+            else:
+                deliver_cloud_outbox()
+        except Exception as e:
+            print(f"[Cloud Outbox] Error: {e}")
+
+# ── Cloud Profile Cache ─────────────────────
+# Payments/purchases from {cloud_base_url}/api/employee/profile, keyed by
+# (employee, month). Reads never touch the network: a missing or stale entry
+# is returned as-is and refreshed by a background thread (stale-while-revalidate).
+PROFILE_CACHE_TTL_SECONDS = 300
+PROFILE_CACHE_MAX_ENTRIES = 2000
+PROFILE_PREFETCH_BUDGET_SECONDS = 60
+
+_profile_cache = {}  # in fetch order, oldest first
+_profile_refreshing = set()
+_profile_cache_lock = threading.Lock()
+
+def _fetch_cloud_profile(emp_pin, month):
+    cloud_url = cfg.get('cloud_base_url', '').rstrip('/')
+    if not REQUESTS_OK or not cloud_url:
+        return None
     try:
-        requests.put(
-            f"{cloud_url}/api/hr/employees/{emp_id}",
-            json={'device_id': None},
-            headers={'Authorization': f"Bearer {cfg.get('sync_api_key', '')}"},
+        resp = sync_request(
+            'GET', f"{cloud_url}/api/employee/profile",
+            headers={},
+            params={'pin': emp_pin, 'month': month},
             timeout=5
         )
-    except:
-        pass
+        if resp.status_code == 200:
+            c_data = resp.json()
+            return {'payments': c_data.get('payments', []), 'purchases': c_data.get('purchases', [])}
+    except Exception as e:
+        print(f"[Profile Cache] Fetch error for month {month}: {e}")
+    return None
+
+def refresh_cloud_profile(emp_id, emp_pin, month):
+    """Fetch one (employee, month) entry into the cache. Blocks on the network."""
+    try:
+        data = _fetch_cloud_profile(emp_pin, month)
+        if data is not None:
+            with _profile_cache_lock:
+                _profile_cache.pop((emp_id, month), None)
+                _profile_cache[(emp_id, month)] = {'data': data, 'fetched_at': time.time()}
+                while len(_profile_cache) > PROFILE_CACHE_MAX_ENTRIES:
+                    del _profile_cache[next(iter(_profile_cache))]
+    finally:
+        with _profile_cache_lock:
+            _profile_refreshing.discard((emp_id, month))
+
+def get_cloud_profile(emp_id, emp_pin, month):
+    """Return (cloud_data, status) without blocking.
+
+    status is 'fresh', 'stale' (cached but past the TTL) or 'pending' (nothing
+    cached yet). Anything not fresh schedules a single background refresh.
+    """
+    key = (emp_id, month)
+    with _profile_cache_lock:
+        entry = _profile_cache.get(key)
+        if entry and time.time() - entry['fetched_at'] < PROFILE_CACHE_TTL_SECONDS:
+            return entry['data'], 'fresh'
+        if key not in _profile_refreshing:
+            _profile_refreshing.add(key)
+            threading.Thread(target=refresh_cloud_profile, args=(emp_id, emp_pin, month), daemon=True).start()
+    if entry:
+        return entry['data'], 'stale'
+    return {'payments': [], 'purchases': []}, 'pending'
+
+_profile_prefetch_lock = threading.Lock()
+
+@sync_stage('profiles')
+def prefetch_cloud_profiles(budget=PROFILE_PREFETCH_BUDGET_SECONDS):
+    """Warm the cache with the current month for every active employee.
+
+    Stops after `budget` seconds; the rest are fetched on the next round or on demand.
+    """
+    deadline = time.monotonic() + budget
+    month = date.today().isoformat()[:7]
+    db = get_db()
+    employees = db.execute("SELECT id, pin_code FROM employees WHERE is_active=1").fetchall()
+    db.close()
+    for emp in employees:
+        if time.monotonic() >= deadline:
+            break
+        key = (emp['id'], month)
+        with _profile_cache_lock:
+            entry = _profile_cache.get(key)
+            if (entry and time.time() - entry['fetched_at'] < PROFILE_CACHE_TTL_SECONDS) or key in _profile_refreshing:
+                continue
+            _profile_refreshing.add(key)
+        refresh_cloud_profile(emp['id'], str(emp['pin_code']).strip(), month)
+
+def start_profile_prefetch():
+    """Run prefetch_cloud_profiles on its own thread so a slow cloud can't
+    hold up attendance sync; a round still running is not doubled up."""
+    if not _profile_prefetch_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            prefetch_cloud_profiles()
+        except Exception:
+            pass
+        finally:
+            _profile_prefetch_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+# ── Branch Hub ──────────────────────────────
+# One kiosk per branch runs with sync_mode='hub': besides its own cloud sync
+# it accepts the queued changes of the 'satellite' kiosks on its LAN
+# (/hub/push) and serves them the catalog and roster it pulled (/hub/catalog,
+# /hub/roster), so cloud traffic grows with branches, not kiosks. Satellites
+# never sync with the cloud; push_to_hub and pull_from_hub replace the cloud
+# sync stages there.
+HUB_PUSH_OUTBOX_LIMIT = 50
+HUB_EMPLOYEE_FIELDS = ('name', 'job_title', 'phone', 'pin_code', 'device_id')
+_HUB_EMPLOYEE_PATH = re.compile(r'^/api/hr/employees/(\d+)$')
+
+def sync_mode():
+    return cfg.get('sync_mode') or 'standalone'
+
+def get_kiosk_id():
+    """This kiosk's id as an origin for the hub: `kiosk_id` from config, else generated once."""
+    if cfg.get('kiosk_id'):
+        return cfg['kiosk_id']
+    db = get_db()
+    db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('kiosk_id', ?)", (uuid.uuid4().hex,))
+    db.commit()
+    kiosk_id = db.execute("SELECT value FROM settings WHERE key='kiosk_id'").fetchone()['value']
+    db.close()
+    return kiosk_id
+
+def _hub_authorized():
+    return sync_mode() == 'hub' and hmac.compare_digest(
+        request.headers.get('X-Sync-Key', ''), cfg.get('sync_api_key', ''))
+
+def _hub_json(body):
+    """JSON response with an ETag; answers 304 when the satellite already has it."""
+    payload = json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    resp = Response(payload, mimetype='application/json')
+    resp.set_etag(hashlib.sha1(payload).hexdigest())
+    return resp.make_conditional(request)
+
+def _apply_employee_mutation(db, method, path, payload):
+    """Mirror a satellite's employee edit locally so the roster served back includes it."""
+    match = _HUB_EMPLOYEE_PATH.match(path)
+    if method != 'PUT' or not match or not isinstance(payload, dict):
+        return
+    fields = [f for f in HUB_EMPLOYEE_FIELDS if f in payload]
+    if fields:
+        db.execute(f"UPDATE employees SET {', '.join(f + '=?' for f in fields)} WHERE id=?",
+                   [payload[f] for f in fields] + [int(match.group(1))])
+
+def _hub_rows(data, key, fields):
+    """data[key] as a list of rows that all have `fields` and integer ids."""
+    rows = data.get(key) or []
+    if not isinstance(rows, list):
+        raise ValueError(f"{key} must be a list")
+    for row in rows:
+        if not isinstance(row, dict) or any(row.get(f) in (None, '') for f in fields):
+            raise ValueError(f"{key} rows need {', '.join(fields)}")
+        if any(type(row[f]) is not int for f in ('id', 'employee_id')):
+            raise ValueError(f"{key}: id and employee_id must be integers")
+    return rows
+
+def _parse_hub_batch(raw, encoding):
+    """A satellite's /hub/push body, checked before anything is written.
+
+    Only employee edits (PUT /api/hr/employees/<id> with HUB_EMPLOYEE_FIELDS)
+    may be relayed to the cloud. Raises ValueError.
+    """
+    if encoding == 'gzip':
+        try:
+            raw = gzip.decompress(raw)
+        except (OSError, EOFError, zlib.error):
+            raise ValueError("body is not valid gzip")
+    try:
+        data = json.loads(raw or b'{}')
+    except ValueError:
+        raise ValueError("body is not valid JSON")
+    if not isinstance(data, dict):
+        raise ValueError("body must be a JSON object")
+    data['attendance'] = _hub_rows(data, 'attendance', ('id', 'employee_id', 'attendance_date', 'status'))
+    data['counts'] = _hub_rows(data, 'counts', ('id', 'employee_id', 'count_date', 'shift'))
+    mutations = data.get('mutations') or []
+    if not isinstance(mutations, list):
+        raise ValueError("mutations must be a list")
+    for m in mutations:
+        payload = m.get('payload') if isinstance(m, dict) else None
+        if (not isinstance(payload, dict) or not payload or not set(payload) <= set(HUB_EMPLOYEE_FIELDS)
+                or m.get('method') != 'PUT' or not _HUB_EMPLOYEE_PATH.match(str(m.get('path') or ''))):
+            raise ValueError("only employee edits may be relayed")
+    data['mutations'] = mutations
+    return data
+
+@app.route('/hub/push', methods=['POST'])
+def hub_push():
+    """Accept a satellite's unsynced attendance, counts and cloud mutations.
+
+    Rows are keyed by (kiosk id, satellite row id), so a batch re-sent after a
+    lost reply is applied once. Everything is queued for the hub's own sync.
+    """
+    if not _hub_authorized():
+        return jsonify({'success': False, 'error': 'غير مصرح'}), 403
+    try:
+        data = _parse_hub_batch(request.get_data(), request.headers.get('Content-Encoding'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    origin = str(data.get('kiosk_id') or '')
+    if not origin:
+        return jsonify({'success': False, 'error': 'kiosk_id مطلوب'}), 400
+
+    attendance = data['attendance']
+    counts = data['counts']
+    mutations = data['mutations']
+    db = get_db()
+    for row in attendance:
+        existing = db.execute("SELECT id, updated_at FROM attendance WHERE origin=? AND origin_id=?",
+                              (origin, row['id'])).fetchone()
+        if existing is None:
+            db.execute("""
+                INSERT INTO attendance (employee_id, attendance_date, check_in_time, check_out_time,
+                    status, notes, synced, updated_at, origin, origin_id)
+                VALUES (?,?,?,?,?,?,0,?,?,?)
+            """, (row['employee_id'], row['attendance_date'], row.get('check_in_time'),
+                  row.get('check_out_time'), row['status'], row.get('notes') or '',
+                  row.get('updated_at'), origin, row['id']))
+        elif (existing['updated_at'] or '') < (row.get('updated_at') or ''):
+            db.execute("""
+                UPDATE attendance SET check_in_time=?, check_out_time=?, status=?, notes=?,
+                    updated_at=?, synced=0
+                WHERE id=?
+            """, (row.get('check_in_time'), row.get('check_out_time'), row['status'],
+                  row.get('notes') or '', row['updated_at'], existing['id']))
+    db.executemany("""
+        INSERT OR IGNORE INTO offline_counts (employee_id, count_date, shift, branch, items_json,
+            synced, created_at, origin, origin_id)
+        VALUES (?,?,?,?,?,0,?,?,?)
+    """, [(c['employee_id'], c['count_date'], c['shift'], c.get('branch'), c.get('items_json'),
+           c.get('created_at'), origin, c['id']) for c in counts])
+    for m in mutations:
+        enqueue_cloud_mutation(db, m['method'], m['path'], m['payload'])
+        _apply_employee_mutation(db, m['method'], m['path'], m['payload'])
+    db.commit()
+    db.close()
+    if attendance:
+        attendance_changed()
+
+    if mutations:
+        wake_cloud_outbox()
+    if attendance:
+        threading.Thread(target=_quick_sync, daemon=True).start()
+    return jsonify({'success': True, 'attendance': len(attendance), 'counts': len(counts),
+                    'mutations': len(mutations)})
+
+@app.route('/hub/catalog')
+def hub_catalog():
+    if not _hub_authorized():
+        return jsonify({'success': False, 'error': 'غير مصرح'}), 403
+    db = get_db()
+    products = db.execute("SELECT id, name, category, barcode, sku, price, unit FROM products ORDER BY id").fetchall()
+    db.close()
+    return _hub_json({'products': [dict(p) for p in products]})
+
+@app.route('/hub/roster')
+def hub_roster():
+    """Employees in the cloud /api/hr/employees shape, plus the admin PIN."""
+    if not _hub_authorized():
+        return jsonify({'success': False, 'error': 'غير مصرح'}), 403
+    db = get_db()
+    employees = db.execute("""
+        SELECT id, name, job_title, work_start_time, work_end_time, late_threshold_minutes,
+               off_days, is_active, pin_code, device_id
+        FROM employees ORDER BY id
+    """).fetchall()
+    pin_row = db.execute("SELECT value FROM settings WHERE key='admin_pin'").fetchone()
+    db.close()
+    roster = []
+    for e in employees:
+        emp = dict(e)
+        emp['off_days'] = json.loads(emp['off_days'] or '[]')
+        emp['is_active'] = bool(emp['is_active'])
+        roster.append(emp)
+    return _hub_json({'employees': roster, 'admin_pin': pin_row['value'] if pin_row else None})
+
+def _hub_url():
+    return cfg.get('hub_url', '').rstrip('/')
+
+def _hub_headers():
+    return {'X-Sync-Key': cfg.get('sync_api_key', '')}
+
+@sync_stage('hub_push')
+def push_to_hub(traffic=None):
+    """Satellite: forward unsynced attendance, counts and outbox rows to the hub.
+
+    Batches of `sync_chunk_size` rows are sent until the backlog is empty or
+    `sync_time_budget_seconds` is spent; each acknowledged batch is marked
+    synced (attendance only if unchanged since it was read).
+    """
+    owns_cycle = traffic is None
+    traffic = traffic or SyncTraffic()
+    hub_url = _hub_url()
+    if not REQUESTS_OK or not hub_url:
+        return {'success': False, 'message': 'hub_url غير مضبوط في config.json'}
+    if not sync_lock.acquire(blocking=False):
+        return {'success': False, 'message': 'المزامنة جارية بالفعل...'}
+
+    try:
+        kiosk_id = get_kiosk_id()
+        db = get_db()
+        chunk_size = max(1, int(cfg.get('sync_chunk_size', 100)))
+        deadline = time.time() + float(cfg.get('sync_time_budget_seconds', 20))
+        totals = {'attendance': 0, 'counts': 0, 'mutations': 0}
+        last_ids = {'attendance': 0, 'counts': 0, 'mutations': 0}
+        error = None
+        while True:
+            attendance = db.execute(
+                "SELECT * FROM attendance WHERE synced=0 AND id>? ORDER BY id LIMIT ?",
+                (last_ids['attendance'], chunk_size)).fetchall()
+            counts = db.execute(
+                "SELECT * FROM offline_counts WHERE synced=0 AND id>? ORDER BY id LIMIT ?",
+                (last_ids['counts'], chunk_size)).fetchall()
+            outbox = db.execute(
+                "SELECT * FROM cloud_outbox WHERE status='pending' AND id>? ORDER BY id LIMIT ?",
+                (last_ids['mutations'], HUB_PUSH_OUTBOX_LIMIT)).fetchall()
+            if not (attendance or counts or outbox):
+                break
+
+            try:
+                resp = sync_request(
+                    'POST', f"{hub_url}/hub/push",
+                    headers=_hub_headers(),
+                    payload={
+                        'kiosk_id': kiosk_id,
+                        'attendance': [
+                            {k: r[k] for k in ('id', 'employee_id', 'attendance_date', 'check_in_time',
+                                               'check_out_time', 'status', 'notes', 'updated_at')}
+                            for r in attendance
+                        ],
+                        'counts': [
+                            {k: r[k] for k in ('id', 'employee_id', 'count_date', 'shift', 'branch',
+                                               'items_json', 'created_at')}
+                            for r in counts
+                        ],
+                        'mutations': [
+                            {'method': r['method'], 'path': r['path'],
+                             'payload': json.loads(r['payload_json'] or 'null')}
+                            for r in outbox
+                        ],
+                    },
+                    traffic=traffic,
+                )
+            except requests.RequestException as e:
+                error = f'تعذر الاتصال بالمحور: {e}'
+                break
+            if resp.status_code != 200:
+                error = f'رفض المحور الدفعة: {resp.status_code}'
+                break
+
+            db.executemany("UPDATE attendance SET synced=1 WHERE id=? AND updated_at IS ?",
+                           [(r['id'], r['updated_at']) for r in attendance])
+            db.executemany("UPDATE offline_counts SET synced=1 WHERE id=?", [(r['id'],) for r in counts])
+            # revision guards against a merge that happened while we were sending
+            db.executemany("DELETE FROM cloud_outbox WHERE id=? AND revision=?",
+                           [(r['id'], r['revision']) for r in outbox])
+            db.commit()
+            if attendance:
+                attendance_changed()
+            for name, batch in (('attendance', attendance), ('counts', counts), ('mutations', outbox)):
+                totals[name] += len(batch)
+                if batch:
+                    last_ids[name] = batch[-1]['id']
+            events.publish('sync_progress', {'stage': 'hub_push', 'synced': totals['attendance']})
+
+            if (len(attendance) < chunk_size and len(counts) < chunk_size
+                    and len(outbox) < HUB_PUSH_OUTBOX_LIMIT) or time.time() >= deadline:
+                break
+
+        remaining = db.execute("SELECT COUNT(*) as cnt FROM attendance WHERE synced=0").fetchone()['cnt']
+        pushed = totals['attendance'] + totals['counts']
+        if pushed and owns_cycle:
+            _log_sync_cycle(db, pushed, f"إرسال إلى المحور: {totals['attendance']} سجل، {totals['counts']} جرد", traffic)
+            db.commit()
+        db.close()
+        if any(totals.values()):
+            publish_sync_status()
+
+        if error:
+            return {'success': False, 'message': error, 'count': totals['attendance'],
+                    'counts': totals['counts'], 'remaining': remaining}
+        return {'success': True, 'message': f"تم إرسال {totals['attendance']} سجل إلى المحور",
+                'count': totals['attendance'], 'counts': totals['counts'],
+                'mutations': totals['mutations'], 'pulled': 0, 'remaining': remaining}
+    except Exception as e:
+        print(f"[Hub Push] Error: {e}")
+        return {'success': False, 'message': str(e)}
+    finally:
+        sync_lock.release()
+
+def _apply_hub_roster(db, data):
+    _upsert_employees(db, data.get('employees') or [])
+    if data.get('admin_pin'):
+        _store_admin_pin(db, data['admin_pin'])
+
+@sync_stage('hub_pull')
+def pull_from_hub(traffic=None):
+    """Satellite: refresh catalog and roster from the hub (conditional GETs)."""
+    hub_url = _hub_url()
+    if not REQUESTS_OK or not hub_url:
+        return {'success': False, 'message': 'hub_url غير مضبوط في config.json'}
+    db = get_db()
+    updated = []
+    try:
+        for name, etag_key, apply in (
+            ('catalog', 'hub_catalog_etag', lambda data: _replace_products(db, data.get('products') or [])),
+            ('roster',  'hub_roster_etag',  lambda data: _apply_hub_roster(db, data)),
+        ):
+            headers = _hub_headers()
+            etag_row = db.execute("SELECT value FROM settings WHERE key=?", (etag_key,)).fetchone()
+            if etag_row:
+                headers['If-None-Match'] = etag_row['value']
+            resp = sync_request('GET', f"{hub_url}/hub/{name}", headers=headers, traffic=traffic)
+            if resp.status_code == 304:
+                continue
+            if resp.status_code != 200:
+                return {'success': False, 'message': f'فشل: {resp.status_code}'}
+            apply(resp.json())
+            db.execute("INSERT INTO settings (key, value) VALUES (?, ?) "
+                       "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                       (etag_key, resp.headers.get('ETag')))
+            db.commit()
+            updated.append(name)
+        return {'success': True, 'message': 'تم التحديث من المحور' if updated else 'لا تغييرات من المحور',
+                'updated': updated}
+    except requests.RequestException as e:
+        return {'success': False, 'message': f'تعذر الاتصال بالمحور: {e}'}
+    finally:
+        db.close()
 
 def _quick_sync():
     """Triggered immediately after a checkin/checkout to push data without waiting."""
     try:
-        sync_attendance_to_supabase()
+        if sync_mode() == 'satellite':
+            push_to_hub()
+        else:
+            sync_attendance_to_supabase()
     except Exception as e:
         print(f"[Quick Sync] Error: {e}")
 
 
 def background_sync_loop():
-    """Background thread: sync every 10 seconds, refresh employees every 30 seconds."""
+    """Background thread: sync every 10 seconds, refresh employees every 30 seconds
+    and re-warm the cloud profile cache every 5 minutes.
+
+    Each cycle that pushes records gets a sync_log row with its wire bytes;
+    pull-only cycles are folded into one row every 5 minutes. A satellite
+    pushes to and pulls from its hub instead of the cloud.
+    """
+    satellite = sync_mode() == 'satellite'
     # Immediate refresh on startup
     try:
-        sync_employees_from_cloud()
-        sync_attendance_to_supabase()
+        if satellite:
+            pull_from_hub()
+            push_to_hub()
+        else:
+            sync_employees_from_cloud()
+            sync_attendance_to_supabase()
     except Exception:
         pass
 
     loops = 0
+    profile_loops = 0
+    idle_traffic = SyncTraffic()
+    idle_cycles = 0
+    idle_since = time.time()
     while True:
         time.sleep(10)
         loops += 1
+        profile_loops += 1
         try:
-            sync_attendance_to_supabase()
-            sync_inventory_to_supabase()
-            # Refresh employees every 3 loops (≈30 seconds)
+            traffic = SyncTraffic()
+            if satellite:
+                att = push_to_hub(traffic)
+                counts_pushed = att.get('counts')
+            else:
+                att = sync_attendance_to_supabase(traffic)
+                counts_pushed = sync_inventory_to_supabase(traffic)
+            # Refresh employees (and on a satellite the catalog) every 3 loops (≈30 seconds)
             if loops >= 3:
-                sync_employees_from_cloud()
+                if satellite:
+                    pull_from_hub(traffic)
+                else:
+                    sync_employees_from_cloud(traffic)
                 loops = 0
+
+            records = (att.get('count') or 0) + (att.get('pulled') or 0) + (counts_pushed or 0)
+            if records:
+                db = get_db()
+                _log_sync_cycle(db, records, f'دورة مزامنة: {records} سجل', traffic)
+                db.commit()
+                db.close()
+            elif traffic.sent or traffic.received:
+                if not idle_cycles:
+                    idle_since = time.time()
+                idle_traffic.add(traffic)
+                idle_cycles += 1
+            if idle_cycles and time.time() - idle_since >= 300:
+                db = get_db()
+                _log_sync_cycle(db, 0, f'تحديث البيانات فقط: {idle_cycles} دورة', idle_traffic)
+                db.commit()
+                db.close()
+                idle_traffic, idle_cycles, idle_since = SyncTraffic(), 0, time.time()
+            # Prefetch this month's payments/purchases (≈5 minutes, and right after startup)
+            if not satellite and (profile_loops == 1 or profile_loops % (PROFILE_CACHE_TTL_SECONDS // 10) == 0):
+                start_profile_prefetch()
         except Exception:
             pass
 
@@ -1372,6 +5049,31 @@ def kill_port_processes(port):
         except:
             pass
 
+def run_http_server(port):
+    """Serve the app on all interfaces; blocks.
+
+    Uses waitress (multi-threaded, keep-alive, bounded connections) unless
+    `http_server` is 'dev' or waitress isn't installed.
+    """
+    if cfg.get('http_server', 'waitress') == 'waitress' and waitress:
+        # Open /api/events streams each hold a thread; keep http_threads for requests
+        threads = int(cfg.get('http_threads', 8)) + int(cfg.get('sse_max_clients', 32))
+        print(f"[HTTP] waitress: {threads} threads, {cfg.get('http_connection_limit', 200)} connections")
+        waitress.serve(
+            app,
+            host='0.0.0.0',
+            port=port,
+            threads=threads,
+            connection_limit=int(cfg.get('http_connection_limit', 200)),
+            channel_timeout=int(cfg.get('http_channel_timeout', 30)),
+            backlog=int(cfg.get('http_backlog', 1024)),
+            ident='SuzzKiosk',
+        )
+    else:
+        if cfg.get('http_server', 'waitress') == 'waitress':
+            print("[HTTP] waitress not installed, using the Flask development server")
+        app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False, threaded=True)
+
 # ── Main ────────────────────────────────────
 if __name__ == '__main__':
     port = cfg.get('kiosk_port', 8085)
@@ -1380,6 +5082,8 @@ if __name__ == '__main__':
     kill_port_processes(port)
     
     init_db()
+    if dataset_seed is not None:
+        print(f"[Sync] {DB_PATH} was built by generate_dataset.py (seed {dataset_seed}); cloud sync is off")
     
     # Try to add firewall rule
     add_firewall_rule(port)
@@ -1387,6 +5091,10 @@ if __name__ == '__main__':
     # Start background sync thread
     sync_thread = threading.Thread(target=background_sync_loop, daemon=True)
     sync_thread.start()
+    outbox_thread = threading.Thread(target=cloud_outbox_loop, daemon=True)
+    outbox_thread.start()
+    memory_thread = threading.Thread(target=memory_sampler_loop, daemon=True)
+    memory_thread.start()
 
     print(f"\n{'='*50}")
     print(f"  Suzz Inventory Kiosk")
@@ -1394,8 +5102,8 @@ if __name__ == '__main__':
     print(f"  Local IP: {get_local_ip()}")
     print(f"{'='*50}\n")
 
-    # Start Flask Server
-    flask_thread = threading.Thread(target=lambda: app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False), daemon=True)
+    # Start HTTP server
+    flask_thread = threading.Thread(target=run_http_server, args=(port,), daemon=True)
     flask_thread.start()
 
     # Launch in Edge App Mode (Dedicated Window)
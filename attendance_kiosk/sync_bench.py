@@ -0,0 +1,222 @@
+"""
+Sync Benchmark
+==============
+Runs the real sync engine (sync_attendance_to_supabase,
+sync_inventory_to_supabase, sync_employees_from_cloud) against fake_cloud.py
+with injected latency/failures/throttling, then checks the result:
+
+  1. seed a temporary kiosk DB with an offline backlog of punches and counts
+  2. sync cycles until the backlog is gone (or --max-cycles)
+  3. optionally: HR edits some cloud rows while the kiosk records check-outs
+     on some of the same rows, then sync again until converged
+  4. turn faults off and compare the cloud with the local DB
+
+    python sync_bench.py --rows 5000 --counts 200 --latency-ms 80 --failure-rate 0.05
+    python sync_bench.py --rows 2000 --lost-response-rate 0.05 --hr-edits 100 --out flaky.json
+
+The JSON report has cycle timings, rows/s, cloud request and fault counts,
+bytes on the wire and a `correctness` section (missing, duplicated and
+mismatched rows) that should be all zeros.
+"""
+
+import argparse, json, os, random, shutil, sys, tempfile, time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from fake_cloud import FakeCloud, add_fault_arguments, faults_from_args
+
+STATUSES = ['present', 'present', 'present', 'late']
+
+
+def seed_backlog(server, rows, counts, days, employees, rng):
+    """Offline backlog: `rows` punches over the last `days` days and `counts` inventory counts."""
+    db = server.get_db()
+    today = date.today()
+    punches = []
+    for i in range(rows):
+        emp_id = i % employees + 1
+        day = (today - timedelta(days=(i // employees) % days)).isoformat()
+        # A few sessions per employee/day, distinct HH:MM check-ins
+        check_in = f"{7 + (i // (employees * days)) % 14:02d}:{rng.randint(0, 59):02d}"
+        check_out = f"{min(23, int(check_in[:2]) + rng.randint(1, 8)):02d}:{rng.randint(0, 59):02d}" \
+            if rng.random() < 0.8 else None
+        punches.append((emp_id, day, check_in, check_out, rng.choice(STATUSES), datetime.now().isoformat()))
+    db.executemany(
+        """INSERT INTO attendance (employee_id, attendance_date, check_in_time, check_out_time, status, synced, updated_at)
+           VALUES (?,?,?,?,?,0,?)""", punches)
+    db.executemany(
+        """INSERT INTO offline_counts (employee_id, count_date, shift, branch, items_json, created_at, synced)
+           VALUES (?,?,?,?,?,?,0)""",
+        [(i % employees + 1, (today - timedelta(days=i % days)).isoformat(), rng.choice(['morning', 'evening']),
+          'Suzz 1',
+          json.dumps([{'item_name': f'منتج {rng.randint(1, 200)}', 'quantity': rng.randint(0, 40)}
+                      for _ in range(rng.randint(5, 30))]),
+          datetime.now().isoformat())
+         for i in range(counts)])
+    db.commit()
+    db.close()
+
+
+def backlog(server):
+    db = server.get_db()
+    att = db.execute("SELECT COUNT(*) FROM attendance WHERE synced=0").fetchone()[0]
+    inv = db.execute("SELECT COUNT(*) FROM offline_counts WHERE synced=0").fetchone()[0]
+    db.close()
+    return att, inv
+
+
+def sync_until_drained(server, max_cycles):
+    cycles = []
+    for _ in range(max_cycles):
+        traffic = server.SyncTraffic()
+        start = time.perf_counter()
+        att = server.sync_attendance_to_supabase(traffic)
+        inv = server.sync_inventory_to_supabase(traffic)
+        remaining = backlog(server)
+        cycles.append({
+            'seconds': round(time.perf_counter() - start, 3),
+            'attendance_synced': att.get('count', 0),
+            'attendance_pulled': att.get('pulled', 0),
+            'counts_pushed': inv,
+            'bytes_sent': traffic.sent,
+            'bytes_received': traffic.received,
+            'remaining': {'attendance': remaining[0], 'counts': remaining[1]},
+            **({} if att.get('success') else {'error': att.get('message')}),
+        })
+        if remaining == (0, 0):
+            break
+    return cycles
+
+
+def hr_conflicts(server, cloud, edits, rng):
+    """HR corrects `edits` cloud rows; the kiosk checks out on half of those and on as many other rows."""
+    db = server.get_db()
+    linked = db.execute("SELECT id, cloud_id FROM attendance WHERE cloud_id IS NOT NULL").fetchall()
+    picked = rng.sample(list(linked), min(len(linked), edits * 3 // 2))
+    hr_rows, local_rows = picked[:edits], picked[edits // 2:]
+    for row in hr_rows:
+        cloud.hr_edit(row['cloud_id'], status='late', notes='تعديل HR')
+    now = datetime.now().isoformat()
+    db.executemany("UPDATE attendance SET check_out_time=?, synced=0, updated_at=? WHERE id=?",
+                   [(f"{rng.randint(18, 23)}:{rng.randint(0, 59):02d}", now, row['id']) for row in local_rows])
+    db.commit()
+    db.close()
+    return {'hr_edited': len(hr_rows), 'local_checkouts': len(local_rows),
+            'both': len({r['id'] for r in hr_rows} & {r['id'] for r in local_rows})}
+
+
+def verify(server, cloud):
+    db = server.get_db()
+    local = db.execute("SELECT * FROM attendance").fetchall()
+    counts = db.execute("SELECT * FROM offline_counts").fetchall()
+    db.close()
+    cloud_att = {r['id']: r for r in cloud.rows('hr_attendance')}
+
+    sessions = Counter((r['employee_id'], r['attendance_date'], (r.get('check_in_time') or '')[:5])
+                       for r in cloud_att.values())
+    missing = mismatched = 0
+    for row in local:
+        c = cloud_att.get(row['cloud_id'])
+        if c is None:
+            missing += 1
+            continue
+        local_fields = ((row['check_out_time'] or '')[:5], row['status'], row['notes'] or '')
+        cloud_fields = ((c.get('check_out_time') or '')[:5], c.get('status'), c.get('notes') or '')
+        if row['synced'] and local_fields != cloud_fields:
+            mismatched += 1
+    linked_ids = {row['cloud_id'] for row in local}
+
+    expected_items = sum(len(json.loads(c['items_json'] or '[]')) for c in counts)
+    return {
+        'attendance_local': len(local),
+        'attendance_cloud': len(cloud_att),
+        'attendance_unsynced': sum(1 for r in local if not r['synced']),
+        'attendance_missing_in_cloud': missing,
+        'attendance_duplicate_sessions': sum(n - 1 for n in sessions.values() if n > 1),
+        'attendance_cloud_orphans': len(set(cloud_att) - linked_ids),
+        'attendance_mismatched': mismatched,
+        'counts_local': len(counts),
+        'counts_cloud': len(cloud.rows('inventory_counts')),
+        'count_items_expected': expected_items,
+        'count_items_cloud': len(cloud.rows('inventory_count_items')),
+    }
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    cloud = FakeCloud(employees=args.employees, seed=args.seed)
+    cloud_url = cloud.start()
+    data_dir = tempfile.mkdtemp(prefix='kiosk-syncbench-')
+    with open(os.path.join(data_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump({'supabase_url': cloud_url, 'supabase_service_key': 'bench', 'sync_endpoint': cloud_url,
+                   'cloud_base_url': cloud_url, 'sync_api_key': 'bench',
+                   'sync_chunk_size': args.chunk_size, 'sync_time_budget_seconds': args.time_budget}, f)
+    os.environ['KIOSK_DATA_DIR'] = data_dir
+    try:
+        import server
+        # The fake cloud is on localhost; don't probe 8.8.8.8 before every sync
+        server.has_internet = lambda: server.REQUESTS_OK
+        server.init_db()
+        server.sync_employees_from_cloud()
+        seed_backlog(server, args.rows, args.counts, args.days, args.employees, rng)
+
+        cloud.set_faults(**faults_from_args(args))
+        start = time.perf_counter()
+        push = sync_until_drained(server, args.max_cycles)
+        push_seconds = time.perf_counter() - start
+
+        report = {
+            'config': {k: v for k, v in vars(args).items() if k != 'out'},
+            'push': {
+                'cycles': len(push),
+                'seconds': round(push_seconds, 2),
+                'rows_per_second': round((args.rows + args.counts) / push_seconds, 1) if push_seconds else None,
+                'drained': push[-1]['remaining'] == {'attendance': 0, 'counts': 0} if push else True,
+                'cycle_log': push,
+            },
+        }
+        if args.hr_edits:
+            scenario = hr_conflicts(server, cloud, args.hr_edits, rng)
+            start = time.perf_counter()
+            merge = sync_until_drained(server, args.max_cycles)
+            report['conflicts'] = {**scenario, 'cycles': len(merge),
+                                   'seconds': round(time.perf_counter() - start, 2), 'cycle_log': merge}
+
+        with cloud.lock:
+            report['cloud_requests'] = dict(sorted(cloud.requests.items()))
+            report['injected_faults'] = dict(cloud.injected)
+        report['retries'] = {dict(k)['kind']: v for k, v in server.SYNC_RETRIES.snapshot().items()}
+        cloud.set_faults(**{k: 0 for k in faults_from_args(args)})
+        report['correctness'] = verify(server, cloud)
+        return report
+    finally:
+        cloud.stop()
+        if args.keep:
+            print(f"[sync_bench] kept data in {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description='Benchmark the sync engine against the fake cloud')
+    parser.add_argument('--rows', type=int, default=2000, help='unsynced attendance rows to seed')
+    parser.add_argument('--counts', type=int, default=100, help='unsynced inventory counts to seed')
+    parser.add_argument('--employees', type=int, default=40)
+    parser.add_argument('--days', type=int, default=30, help='spread the backlog over this many days')
+    parser.add_argument('--chunk-size', type=int, default=100, help='sync_chunk_size for the kiosk')
+    parser.add_argument('--time-budget', type=float, default=20, help='sync_time_budget_seconds')
+    parser.add_argument('--max-cycles', type=int, default=200)
+    parser.add_argument('--hr-edits', type=int, default=0, help='run the HR-edit/check-out conflict phase')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='also write the JSON report to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the temp data dir')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
@@ -0,0 +1,55 @@
+"""
+Shared fixtures. Run from attendance_kiosk:
+
+    python -m pytest tests
+
+Every test gets its own empty kiosk database, and the cloud settings point
+nowhere, so nothing here talks to the real cloud.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+# server.py reads KIOSK_DATA_DIR and config.json when imported; the local
+# config.json there overrides the bundled one
+_DATA_DIR = tempfile.mkdtemp(prefix='kiosk-tests-')
+with open(os.path.join(_DATA_DIR, 'config.json'), 'w', encoding='utf-8') as f:
+    json.dump({'supabase_url': '', 'supabase_service_key': '', 'sync_endpoint': '',
+               'cloud_base_url': '', 'sync_api_key': 'test-key'}, f)
+os.environ['KIOSK_DATA_DIR'] = _DATA_DIR
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask.testing import FlaskClient
+
+import server
+
+
+@pytest.fixture
+def kiosk(tmp_path, monkeypatch):
+    """The server module on a fresh database, offline, with no background syncs."""
+    monkeypatch.setattr(server, 'DB_PATH', str(tmp_path / 'attendance.db'))
+    monkeypatch.setattr(server, 'has_internet', lambda: False)
+    monkeypatch.setattr(server, '_quick_sync', lambda: None)
+    server.init_db()
+    return server
+
+
+class ClosingClient(FlaskClient):
+    """Buffers and closes each response, as a WSGI server does once the body is sent."""
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return super().open(*args, **kwargs)
+
+
+@pytest.fixture
+def client(kiosk, monkeypatch):
+    monkeypatch.setattr(kiosk.app, 'test_client_class', ClosingClient)
+    return kiosk.app.test_client()
+
+
+def add_employee(db, emp_id, name, **fields):
+    row = {'id': emp_id, 'name': name, 'pin_code': f'{emp_id:04d}', 'is_active': 1, 'off_days': '[]', **fields}
+    db.execute(f"INSERT INTO employees ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
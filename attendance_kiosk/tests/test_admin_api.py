@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import pytest
+
+import server
+from conftest import add_employee
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (None, None),
+    ('', None),
+    ('2026-10-01:42', ('2026-10-01', 42)),
+    ('2026-10-01T09:00:00:7', ('2026-10-01T09:00:00', 7)),  # the key may contain ':'
+])
+def test_parse_cursor(raw, expected):
+    assert server._parse_cursor(raw) == expected
+
+
+@pytest.mark.parametrize('raw', ['42', ':42', '2026-10-01:x', '2026-10-01:'])
+def test_parse_cursor_rejects_garbage(raw):
+    with pytest.raises(ValueError):
+        server._parse_cursor(raw)
+
+
+@pytest.fixture
+def attendance(kiosk):
+    """25 sessions over 5 days, several per day, inserted out of order."""
+    db = kiosk.get_db()
+    add_employee(db, 1, 'أحمد')
+    add_employee(db, 2, 'منى')
+    today = date.today()
+    for i in (3, 17, 0, 24, 9, 11, 21, 5, 14, 1, 19, 7, 22, 2, 16, 8, 13, 4, 23, 10, 18, 6, 12, 20, 15):
+        db.execute("INSERT INTO attendance (employee_id, attendance_date, check_in_time, status) VALUES (?,?,?,?)",
+                   (i % 2 + 1, (today - timedelta(days=i % 5)).isoformat(), f"{8 + i % 10:02d}:00",
+                    'late' if i % 3 == 0 else 'present'))
+    db.commit()
+    db.close()
+
+
+def test_attendance_pages_cover_every_row_once(client, attendance):
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {'admin_pin': '1234', 'limit': 4, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/api/admin/attendance', query_string=params).get_json()
+        assert body['success']
+        if pages == 0:
+            assert (body['total'], body['late']) == (25, 9)
+        seen.extend((r['attendance_date'], r['id']) for r in body['rows'])
+        pages += 1
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert pages == 7
+    assert len(set(seen)) == 25
+    assert seen == sorted(seen, key=lambda k: (k[0], k[1]), reverse=True)
+
+
+def test_attendance_filters_apply_to_every_page(client, attendance):
+    params = {'admin_pin': '1234', 'limit': 2, 'employee_id': 2, 'status': 'late'}
+    rows, cursor = [], None
+    while True:
+        body = client.get('/api/admin/attendance', query_string={**params, **({'cursor': cursor} if cursor else {})}).get_json()
+        rows.extend(body['rows'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert rows and all(r['employee_id'] == 2 and r['status'] == 'late' for r in rows)
+
+
+@pytest.mark.parametrize('query', [
+    {'cursor': 'nonsense'},
+    {'limit': 'ten'},
+    {'limit': '0'},
+    {'start_date': '2026-13-01'},
+    {'employee_id': 'x'},
+])
+def test_malformed_arguments_are_rejected(client, attendance, query):
+    resp = client.get('/api/admin/attendance', query_string={'admin_pin': '1234', **query})
+    assert resp.status_code == 400
+    assert resp.get_json()['success'] is False
+
+
+def test_wrong_pin_is_unauthorized(client):
+    assert client.get('/api/admin/attendance', query_string={'admin_pin': '0000'}).status_code == 401
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from flask import Response
+
+import server
+from server import AdmissionController
+
+
+def controller(capacity=4, reserved_punch=1, limits=None, queue_size=8):
+    return AdmissionController(capacity, reserved_punch, limits or {}, queue_size)
+
+
+def test_admission_classes():
+    assert server.admission_class('/checkin') == 'punch'
+    assert server.admission_class('/api/admin/attendance') == 'admin'
+    assert server.admission_class('/admin') == 'admin'
+    assert server.admission_class('/api/today') == 'api'
+    assert server.admission_class('/login') == 'page'
+    assert server.admission_class('/api/events') is None
+    assert server.admission_class('/static/app.js') is None
+
+
+def test_class_limit_and_punch_reserve():
+    adm = controller(capacity=4, reserved_punch=1, limits={'admin': 2})
+    assert adm.acquire('admin', 0) is None
+    assert adm.acquire('admin', 0) is None
+    assert adm.acquire('admin', 0) == 'timeout'  # at its class limit
+    assert adm.acquire('api', 0) is None
+    assert adm.acquire('api', 0) == 'timeout'    # the last slot is kept for punches
+    assert adm.acquire('punch', 0) is None
+    assert adm.in_flight == {'punch': 1, 'api': 1, 'page': 0, 'admin': 2}
+
+
+def test_punch_waiter_goes_before_earlier_waiters():
+    adm = controller(capacity=1, reserved_punch=0)
+    assert adm.acquire('page', 0) is None
+    order = []
+
+    def wait(cls):
+        assert adm.acquire(cls, 5) is None
+        order.append(cls)
+        adm.release(cls)
+
+    threads = [threading.Thread(target=wait, args=(cls,)) for cls in ('admin', 'api', 'punch')]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)  # queue them in this order
+    adm.release('page')
+    for t in threads:
+        t.join(5)
+    assert order == ['punch', 'api', 'admin']
+
+
+def test_full_queue_is_refused():
+    adm = controller(capacity=1, reserved_punch=0, queue_size=1)
+    assert adm.acquire('api', 0) is None
+    waiter = threading.Thread(target=adm.acquire, args=('api', 0.5))
+    waiter.start()
+    time.sleep(0.05)
+    assert adm.acquire('api', 0) == 'queue_full'
+    waiter.join()
+
+
+def test_refused_request_gets_503_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(server, 'admission', controller(capacity=1, reserved_punch=0))
+    monkeypatch.setitem(server.cfg, 'admission_max_wait_seconds', {'api': 0})
+    server.admission.acquire('api', 0)
+    resp = client.get('/api/employees')
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After']
+    server.admission.release('api')
+    assert client.get('/api/employees').status_code == 200
+    assert server.admission.in_flight['api'] == 0
+
+
+def test_streamed_response_keeps_its_slot_until_sent(kiosk, monkeypatch):
+    monkeypatch.setattr(server, 'admission', controller())
+    with kiosk.app.test_request_context('/api/admin/export/attendance'):
+        assert server._admission_enter() is None
+        resp = server._admission_hand_over(Response(iter([b'a', b'b'])))
+    assert server.admission.in_flight['admin'] == 1
+    resp.close()
+    assert server.admission.in_flight['admin'] == 0
@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import add_employee
+
+
+@pytest.fixture
+def staff(kiosk):
+    """A veteran who missed yesterday and a hire whose first punch was 3 days ago."""
+    db = kiosk.get_db()
+    add_employee(db, 1, 'أحمد')
+    add_employee(db, 2, 'منى')
+    add_employee(db, 3, 'سارة')  # never punched
+    today = date.today()
+    for ago in range(2, 15):
+        db.execute("INSERT INTO attendance (employee_id, attendance_date, check_in_time, status) "
+                   "VALUES (1, ?, '09:00', 'present')", ((today - timedelta(days=ago)).isoformat(),))
+    for ago in (3, 2):
+        db.execute("INSERT INTO attendance (employee_id, attendance_date, check_in_time, status) "
+                   "VALUES (2, ?, '09:00', 'present')", ((today - timedelta(days=ago)).isoformat(),))
+    db.commit()
+    db.close()
+
+
+def absences(client):
+    start = (date.today() - timedelta(days=13)).isoformat()
+    body = client.get('/api/admin/analytics/absences',
+                      query_string={'admin_pin': '1234', 'start_date': start, 'min_streak': 1}).get_json()
+    assert body['success']
+    return {r['employee_id']: r for r in body['employees']}
+
+
+def test_absences_start_at_each_employees_first_punch(client, staff):
+    rows = absences(client)
+    assert (rows[1]['absent_days'], rows[1]['current_streak']) == (1, 1)
+    assert (rows[2]['absent_days'], rows[2]['current_streak']) == (1, 1)  # not the 11 days before joining
+    assert 3 not in rows
+
+
+def test_new_punches_reach_the_rollup(client, staff, kiosk):
+    absences(client)
+    db = kiosk.get_db()
+    db.execute("INSERT INTO attendance (employee_id, attendance_date, check_in_time, status) VALUES (2, ?, '09:00', 'present')",
+               ((date.today() - timedelta(days=1)).isoformat(),))
+    db.commit()
+    db.close()
+    assert absences(client)[2]['absent_days'] == 0
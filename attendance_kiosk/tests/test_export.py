@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import date
+
+import pytest
+
+from conftest import add_employee
+
+TODAY = date.today().isoformat()
+
+
+@pytest.fixture
+def exportable(kiosk):
+    """Employee-typed text that a spreadsheet would otherwise run as formulas."""
+    db = kiosk.get_db()
+    add_employee(db, 1, '=HYPERLINK("http://x","y")')
+    add_employee(db, 2, 'منى')
+    db.execute("INSERT INTO attendance (employee_id, attendance_date, check_in_time, status, notes) "
+               "VALUES (1, ?, '09:00', 'present', '@SUM(A1:A9)')", (TODAY,))
+    db.execute("INSERT INTO attendance (employee_id, attendance_date, check_in_time, status, notes) "
+               "VALUES (2, ?, '09:10', 'present', 'a-b')", (TODAY,))
+    db.execute("INSERT INTO offline_counts (employee_id, count_date, shift, branch, items_json, created_at) "
+               "VALUES (2, ?, 'morning', 'Suzz 1', ?, ?)",
+               (TODAY, json.dumps([{'item_name': '-قهوة', 'quantity': -3}, {'item_name': '+1', 'quantity': 2}]), TODAY))
+    db.commit()
+    db.close()
+
+
+def export(client, kind, fmt):
+    resp = client.get(f'/api/admin/export/{kind}', query_string={'admin_pin': '1234', 'format': fmt})
+    assert resp.status_code == 200
+    return resp.data
+
+
+def test_csv_quotes_formula_text(client, exportable):
+    rows = list(csv.reader(io.StringIO(export(client, 'attendance', 'csv').decode('utf-8-sig'))))
+    cells = {c for r in rows[1:] for c in r}
+    assert {'\'=HYPERLINK("http://x","y")', "'@SUM(A1:A9)", 'a-b', 'منى'} <= cells
+    assert not any(c.startswith(('=', '+', '-', '@')) for c in cells)
+
+
+def test_csv_counts_keep_negative_quantities_numeric(client, exportable):
+    rows = list(csv.reader(io.StringIO(export(client, 'counts', 'csv').decode('utf-8-sig'))))
+    items = {(r[5], r[6]) for r in rows[1:]}
+    assert items == {("'-قهوة", '-3'), ("'+1", '2')}
+
+
+def test_xlsx_quotes_formula_text_but_not_numbers(client, exportable):
+    with zipfile.ZipFile(io.BytesIO(export(client, 'counts', 'xlsx'))) as zf:
+        assert zf.testzip() is None
+        sheet = zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert "<t xml:space=\"preserve\">'-قهوة</t>" in sheet
+    assert "<t xml:space=\"preserve\">'+1</t>" in sheet
+    assert '<v>-3</v>' in sheet
+
+    with zipfile.ZipFile(io.BytesIO(export(client, 'attendance', 'xlsx'))) as zf:
+        sheet = zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert '>\'=HYPERLINK(&quot;' not in sheet  # quotes aren't escaped in text nodes
+    assert '>\'=HYPERLINK("http://x","y")<' in sheet
+    assert ">=" not in sheet and ">@" not in sheet
+
+
+def test_unknown_format_is_rejected(client, exportable):
+    resp = client.get('/api/admin/export/attendance', query_string={'admin_pin': '1234', 'format': 'pdf'})
+    assert resp.status_code == 400
@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import pytest
+
+import server
+from conftest import add_employee
+
+START = date(2026, 3, 2)  # a Monday
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def engine(request, kiosk, monkeypatch):
+    """Runs each test with both grouping engines; they must agree."""
+    if request.param == 'numpy':
+        if server.np is None:
+            pytest.skip("numpy not installed")
+    else:
+        monkeypatch.setattr(server, 'np', None)
+    return request.param
+
+
+def hours(sessions, work_start='09:00', work_end='17:00', days=3, **employee):
+    """Report for one employee with `sessions` [(day offset, check-in, check-out)]."""
+    db = server.get_db()
+    add_employee(db, 1, 'سارة', work_start_time=work_start, work_end_time=work_end,
+                 late_threshold_minutes=15, **employee)
+    db.executemany(
+        "INSERT INTO attendance (employee_id, attendance_date, check_in_time, check_out_time, status) "
+        "VALUES (1,?,?,?,'present')",
+        [((START + timedelta(days=day)).isoformat(), check_in, check_out) for day, check_in, check_out in sessions])
+    db.commit()
+    report = server.compute_worked_hours(db, START, START + timedelta(days=days - 1), daily=True,
+                                         today=START + timedelta(days=days))
+    db.close()
+    return report['employees'][0], report['days']
+
+
+def test_day_shift_with_overtime_and_lateness(engine):
+    emp, days = hours([(0, '09:30', '17:45')], days=1)
+    assert (emp['worked_minutes'], emp['overtime_minutes'], emp['late_minutes']) == (495, 45, 30)
+    assert emp['absent_days'] == 0
+
+
+def test_check_out_after_midnight_closes_the_night_shift(engine):
+    emp, days = hours([(0, '17:00', '01:30')], work_start='17:00', work_end='01:00', days=1)
+    assert (emp['sessions'], emp['unpaired_sessions']) == (1, 0)
+    assert (emp['worked_minutes'], emp['overtime_minutes'], emp['late_minutes']) == (510, 30, 0)
+    assert days[0]['last_check_out'] == '01:30'
+
+
+def test_check_in_after_midnight_belongs_to_the_previous_shift(engine):
+    # Stored on day 1, but 00:30 is 7.5 h into day 0's 17:00-01:00 shift
+    emp, days = hours([(1, '00:30', '01:00')], work_start='17:00', work_end='01:00', days=2)
+    assert [d['date'] for d in days] == [START.isoformat()]
+    assert (emp['late_minutes'], emp['worked_minutes']) == (450, 30)
+    assert emp['absent_days'] == 1
+
+
+def test_split_shift_and_open_session(engine):
+    emp, _ = hours([(0, '09:00', '13:00'), (0, '14:00', '17:00'), (1, '09:00', None)], days=2)
+    assert (emp['sessions'], emp['unpaired_sessions'], emp['days_worked']) == (3, 1, 2)
+    assert emp['worked_minutes'] == 7 * 60
+
+
+def test_work_on_an_off_day(engine):
+    # START + 5 is a Saturday (weekday 6 in SQLite's %w numbering)
+    emp, _ = hours([(5, '10:00', '14:00')], days=7, off_days='[6]')
+    assert (emp['off_days_worked'], emp['off_day_minutes'], emp['late_minutes']) == (1, 240, 0)
+    assert emp['absent_days'] == 6
@@ -0,0 +1,70 @@
+import pytest
+
+import server
+from conftest import add_employee
+
+
+@pytest.mark.parametrize('a, b', [
+    ('أحمد  صلاح ', 'احمد صلاح'),
+    ('إيمان', 'ايمان'),
+    ('فاطمة', 'فاطمه'),
+    ('مُحَمَّد', 'محمد'),
+    ('مـــنى', 'منى'),
+    ('Sara ALI', 'sara ali'),
+])
+def test_name_key_folds_spelling_variants(a, b):
+    assert server.name_key(a) == server.name_key(b)
+
+
+@pytest.mark.parametrize('raw', ['+20 101 234 5678', '00201012345678', '0101-234-5678', '٠١٠١٢٣٤٥٦٧٨'])
+def test_phone_key_is_the_local_number(raw):
+    assert server.phone_key(raw) == '01012345678'
+
+
+def test_near_prefix():
+    assert server._near_prefix('محمود', 'محمود علي', 1)
+    assert server._near_prefix('محمد', 'محمود', 1)      # one typo
+    assert not server._near_prefix('سارة', 'محمود', 1)
+
+
+@pytest.fixture
+def roster(kiosk):
+    db = kiosk.get_db()
+    add_employee(db, 1, 'عبد الله أحمد', phone='+20 101 234 5678')
+    add_employee(db, 2, 'عبدالرحمن سعيد')
+    add_employee(db, 3, 'نور محمد')
+    add_employee(db, 4, 'نور محمد', phone='01122223333')
+    add_employee(db, 5, 'سارة علي', is_active=0)
+    db.commit()
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('identifier, expected', [
+    ('1', [1]),
+    ('01012345678', [1]),
+    ('عبدالله احمد', [1]),
+    ('نور  محمد', [3, 4]),           # namesakes both need the PIN tried
+    ('عبد', []),                      # a prefix is only a suggestion
+    ('نور', []),
+    ('عبد الله احمم', []),             # so is a typo
+    ('سارة علي', []),                 # inactive
+])
+def test_candidates_are_exact_matches_only(roster, identifier, expected):
+    assert server.LoginIndex().candidates(roster, identifier) == expected
+
+
+def test_suggest_ranks_prefixes_and_hides_phones(roster):
+    index = server.LoginIndex()
+    assert {s['id'] for s in index.suggest(roster, 'عبد')} == {1, 2}
+    assert [s['id'] for s in index.suggest(roster, 'عبدالله')][0] == 1  # exact before typo matches
+    assert index.suggest(roster, '0101') == []
+    assert {s['id'] for s in index.suggest(roster, 'محمد')} == {3, 4}
+
+
+def test_index_reloads_after_a_roster_edit(roster):
+    index = server.LoginIndex()
+    assert index.candidates(roster, 'منى حسن') == []
+    add_employee(roster, 6, 'منى حسن')
+    roster.commit()
+    assert index.candidates(roster, 'منى حسن') == [6]
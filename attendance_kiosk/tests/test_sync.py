@@ -0,0 +1,213 @@
+import gzip
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import server
+from fake_cloud import FakeCloud, PostgrestError
+
+
+@pytest.fixture
+def cloud(kiosk, monkeypatch):
+    """A FakeCloud the kiosk syncs with, and the kiosk's roster pulled from it."""
+    fake = FakeCloud(employees=5, products=3, seed=1)
+    url = fake.start()
+    for key in ('supabase_url', 'cloud_base_url', 'sync_endpoint'):
+        monkeypatch.setitem(server.cfg, key, url)
+    monkeypatch.setitem(server.cfg, 'supabase_service_key', 'test')
+    monkeypatch.setattr(server, 'has_internet', lambda: True)
+    server.sync_employees_from_cloud()
+    yield fake
+    fake.stop()
+
+
+def add_punches(n, check_out=None):
+    """`n` unsynced sessions spread over employees and the last few days."""
+    db = server.get_db()
+    today = date.today()
+    db.executemany(
+        "INSERT INTO attendance (employee_id, attendance_date, check_in_time, check_out_time, status, synced, updated_at) "
+        "VALUES (?,?,?,?,'present',0,?)",
+        [(i % 5 + 1, (today - timedelta(days=i // 5 % 4)).isoformat(), f"{8 + i // 20:02d}:{i % 60:02d}",
+          check_out, datetime.now().isoformat()) for i in range(n)])
+    db.commit()
+    db.close()
+
+
+def local_rows():
+    db = server.get_db()
+    rows = [dict(r) for r in db.execute("SELECT * FROM attendance ORDER BY id")]
+    db.close()
+    return rows
+
+
+def sync_until_synced(cycles=20):
+    for _ in range(cycles):
+        server.sync_attendance_to_supabase()
+        if all(r['synced'] for r in local_rows()):
+            return
+    pytest.fail("attendance did not finish syncing")
+
+
+def test_backlog_is_pushed_once_despite_lost_replies(cloud, monkeypatch):
+    monkeypatch.setitem(server.cfg, 'sync_chunk_size', 7)
+    add_punches(30)
+    cloud.set_faults(lost_response_rate=0.3, failure_rate=0.1)
+    sync_until_synced()
+    cloud.set_faults(lost_response_rate=0, failure_rate=0)
+
+    rows = local_rows()
+    cloud_rows = {r['id']: r for r in cloud.rows('hr_attendance')}
+    assert len(cloud_rows) == 30
+    assert sorted(r['cloud_id'] for r in rows) == sorted(cloud_rows)
+    for row in rows:
+        c = cloud_rows[row['cloud_id']]
+        assert (c['employee_id'], c['attendance_date'], c['check_in_time'][:5]) == \
+            (row['employee_id'], row['attendance_date'], row['check_in_time'])
+
+
+def test_hr_edit_wins_but_local_check_out_is_kept(cloud):
+    add_punches(1)
+    sync_until_synced()
+    row = local_rows()[0]
+    cloud.hr_edit(row['cloud_id'], status='late', notes='تعديل HR')
+    db = server.get_db()
+    db.execute("UPDATE attendance SET check_out_time='17:05', synced=0, updated_at=? WHERE id=?",
+               (datetime.now().isoformat(), row['id']))
+    db.commit()
+    db.close()
+
+    sync_until_synced()
+    c = {r['id']: r for r in cloud.rows('hr_attendance')}[row['cloud_id']]
+    assert (c['status'], c['notes'], c['check_out_time'][:5]) == ('late', 'تعديل HR', '17:05')
+    local = local_rows()[0]
+    assert (local['status'], local['notes'], local['check_out_time']) == ('late', 'تعديل HR', '17:05')
+
+
+def test_pull_brings_in_hr_edits_to_synced_rows(cloud):
+    add_punches(3, check_out='16:00')
+    sync_until_synced()
+    target = local_rows()[1]
+    cloud.hr_edit(target['cloud_id'], check_out_time='18:30:00')
+
+    result = server.sync_attendance_to_supabase()
+    assert result['pulled'] >= 1
+    assert {r['id']: r for r in local_rows()}[target['id']]['check_out_time'] == '18:30'
+
+
+def test_outbox_backs_off_and_retries(cloud):
+    db = server.get_db()
+    server.enqueue_cloud_mutation(db, 'PUT', '/api/hr/employees/2', {'device_id': 'dev-a'})
+    server.enqueue_cloud_mutation(db, 'PUT', '/api/hr/employees/2', {'phone': '01000000002'})
+    db.commit()
+    assert db.execute("SELECT COUNT(*) FROM cloud_outbox").fetchone()[0] == 1  # merged
+
+    cloud.set_faults(failure_rate=1)
+    assert server.deliver_cloud_outbox() == 0
+    row = db.execute("SELECT * FROM cloud_outbox").fetchone()
+    assert (row['status'], row['attempts']) == ('pending', 1)
+    assert row['next_attempt_at'] > datetime.now().isoformat()
+
+    cloud.set_faults(failure_rate=0)
+    assert server.deliver_cloud_outbox() == 0  # not due yet
+    db.execute("UPDATE cloud_outbox SET next_attempt_at=?", ((datetime.now() - timedelta(seconds=1)).isoformat(),))
+    db.commit()
+    assert server.deliver_cloud_outbox() == 1
+    assert (cloud.employees[2]['device_id'], cloud.employees[2]['phone']) == ('dev-a', '01000000002')
+
+    server.enqueue_cloud_mutation(db, 'PUT', '/api/hr/employees/99', {'device_id': None})
+    db.commit()
+    assert server.deliver_cloud_outbox() == 0
+    assert db.execute("SELECT status FROM cloud_outbox").fetchone()['status'] == 'failed'  # 404 is permanent
+    db.close()
+
+
+def add_counts(n):
+    db = server.get_db()
+    db.executemany(
+        "INSERT INTO offline_counts (employee_id, count_date, shift, branch, items_json, synced, created_at) "
+        "VALUES (?,?,'morning','Suzz 1',?,0,?)",
+        [(i % 5 + 1, date.today().isoformat(), json.dumps([{'item_name': f'منتج {i}', 'quantity': i}, {'item_name': 'قهوة', 'quantity': 1}]),
+          datetime.now().isoformat()) for i in range(n)])
+    db.commit()
+    db.close()
+
+
+def resend_counts():
+    db = server.get_db()
+    db.execute("UPDATE offline_counts SET synced=0")
+    db.commit()
+    db.close()
+
+
+def test_resent_counts_update_the_same_cloud_rows(cloud, monkeypatch):
+    monkeypatch.setitem(server.cfg, 'sync_chunk_size', 2)
+    add_counts(5)
+    assert server.sync_inventory_to_supabase() == 5
+    resend_counts()  # as if every reply had been lost
+    assert server.sync_inventory_to_supabase() == 5
+    assert len(cloud.rows('inventory_counts')) == 5
+    assert len(cloud.rows('inventory_count_items')) == 10
+
+
+def test_counts_fall_back_to_plain_inserts_without_migration_019(cloud):
+    insert = cloud.insert
+
+    def insert_without_sync_key(table, objects, on_conflict=None, resolution=None):
+        if table == 'inventory_counts' and objects and 'sync_key' in objects[0]:
+            raise PostgrestError(400, 'PGRST204', "Could not find the 'sync_key' column of 'inventory_counts'")
+        return insert(table, objects, on_conflict, resolution)
+
+    cloud.insert = insert_without_sync_key
+    add_counts(3)
+    assert server.sync_inventory_to_supabase() == 3
+    assert len(cloud.rows('inventory_counts')) == 3
+    assert len(cloud.rows('inventory_count_items')) == 6
+
+
+@pytest.fixture
+def hub(client, monkeypatch):
+    monkeypatch.setitem(server.cfg, 'sync_mode', 'hub')
+    monkeypatch.setattr(server, 'wake_cloud_outbox', lambda: None)
+    return client
+
+
+def hub_push(hub, body, raw=None):
+    data = raw if raw is not None else gzip.compress(json.dumps(body).encode())
+    return hub.post('/hub/push', data=data, headers={'X-Sync-Key': 'test-key', 'Content-Encoding': 'gzip'})
+
+
+def test_hub_applies_a_resent_batch_once(hub):
+    batch = {
+        'kiosk_id': 'sat-1',
+        'attendance': [{'id': 7, 'employee_id': 1, 'attendance_date': date.today().isoformat(),
+                        'check_in_time': '09:00', 'status': 'present', 'updated_at': '2026-01-01T09:00:00'}],
+        'counts': [{'id': 3, 'employee_id': 1, 'count_date': date.today().isoformat(), 'shift': 'morning',
+                    'items_json': '[]'}],
+        'mutations': [{'method': 'PUT', 'path': '/api/hr/employees/1', 'payload': {'device_id': 'dev-1'}}],
+    }
+    assert hub_push(hub, batch).status_code == 200
+    assert hub_push(hub, batch).status_code == 200
+    db = server.get_db()
+    assert db.execute("SELECT COUNT(*) FROM attendance WHERE origin='sat-1'").fetchone()[0] == 1
+    assert db.execute("SELECT COUNT(*) FROM offline_counts WHERE origin='sat-1'").fetchone()[0] == 1
+    db.close()
+
+
+@pytest.mark.parametrize('body, raw', [
+    (None, b'not gzip'),
+    (None, gzip.compress(b'{not json')),
+    ([], None),
+    ({'kiosk_id': 's', 'attendance': [{'id': 1, 'employee_id': 1}]}, None),
+    ({'kiosk_id': 's', 'counts': [{'id': '1', 'employee_id': 1, 'count_date': '2026-01-01', 'shift': 'a'}]}, None),
+    ({'kiosk_id': 's', 'mutations': [{'method': 'DELETE', 'path': '/api/hr/employees/1', 'payload': {'name': 'x'}}]}, None),
+    ({'kiosk_id': 's', 'mutations': [{'method': 'PUT', 'path': '/api/settings/kiosk-pin', 'payload': {'name': 'x'}}]}, None),
+    ({'kiosk_id': 's', 'mutations': [{'method': 'PUT', 'path': '/api/hr/employees/1', 'payload': {'salary': 1}}]}, None),
+])
+def test_hub_rejects_malformed_batches(hub, body, raw):
+    resp = hub_push(hub, body, raw)
+    assert resp.status_code == 400
+    db = server.get_db()
+    assert db.execute("SELECT COUNT(*) FROM cloud_outbox").fetchone()[0] == 0
+    db.close()
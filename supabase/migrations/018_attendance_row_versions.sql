@@ -0,0 +1,33 @@
+-- =====================================================
+-- Migration 018: Row versions for two-way kiosk attendance sync
+-- =====================================================
+-- The kiosk pulls hr_attendance incrementally by (updated_at, id) and uses
+-- `version` for optimistic concurrency, so HR corrections made in the web
+-- app are not overwritten by a later kiosk PATCH.
+
+ALTER TABLE hr_attendance
+  ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+-- clock_timestamp() (not now()) so rows written later in a long transaction
+-- still sort after rows the kiosk may already have pulled.
+CREATE OR REPLACE FUNCTION hr_attendance_stamp_version()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' THEN
+    NEW.version := OLD.version + 1;
+  ELSE
+    NEW.version := 1;
+  END IF;
+  NEW.updated_at := clock_timestamp();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_hr_attendance_stamp_version ON hr_attendance;
+CREATE TRIGGER trg_hr_attendance_stamp_version
+  BEFORE INSERT OR UPDATE ON hr_attendance
+  FOR EACH ROW EXECUTE FUNCTION hr_attendance_stamp_version();
+
+-- Incremental pull cursor
+CREATE INDEX IF NOT EXISTS idx_hr_attendance_updated_at ON hr_attendance(updated_at, id);
@@ -0,0 +1,10 @@
+-- =====================================================
+-- Migration 019: Idempotent kiosk inventory pushes
+-- =====================================================
+-- Each kiosk count is sent with a sync_key ("<kiosk id>:<local id>") and
+-- upserted on it, so a push retried after a lost response updates the same
+-- cloud row instead of creating a duplicate header.
+
+ALTER TABLE inventory_counts ADD COLUMN IF NOT EXISTS sync_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_counts_sync_key ON inventory_counts(sync_key);